@@ -0,0 +1,98 @@
+"""
+Benchmark: duplicate_groups' batch pass on the listings table scaled up in memory.
+
+Each listing is replicated `--scale` times as distinct cars (new ad_id,
+mileage and price redrawn), then `--duplicates` of them are copied as
+another site would post them: title reworded, mileage and price nudged
+within what the matcher tolerates. For each size, reports
+  fingerprint  listings/s through Fingerprints.from_rows (normalize, MinHash, LSH buckets)
+  group        seconds for compute_groups (candidate pairs, checks, merging)
+  pairs        candidate pairs compared, against the n * (n - 1) / 2 of a pairwise pass
+  recall       share of the injected copies grouped with their original
+Nothing is written to the database.
+
+    cd backend && python benchmarks/duplicate_groups.py [--scale 1 5 25] [--duplicates 0.05] [--runs 3]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_connection_service.db_connection import get_connection
+from duplicate_groups import SOURCE_QUERY, MILEAGE_TOLERANCE, PRICE_TOLERANCE, Fingerprints, compute_groups, candidate_pairs
+
+BATCH_SIZE = 20000
+REWORDINGS = [
+    lambda t: t.upper(),
+    lambda t: f"  {t}!!",
+    lambda t: f"{t} - full option",
+    lambda t: f"For sale: {t}",
+    lambda t: t.replace(" ", "-"),
+]
+
+
+def workload(rows, scale, duplicates, rng):
+    """`rows` replicated `scale` times as distinct cars, plus the injected copies and their (copy, original) ids."""
+    listings = list(rows)
+    for k in range(1, scale):
+        for ad_id, brand, model, year, mileage, price, title, description in rows:
+            listings.append((f"{ad_id}~{k}", brand, model, year,
+                             None if mileage is None else rng.randint(0, 300000),
+                             None if price is None else price * rng.uniform(0.8, 1.2), title, description))
+    copies = []
+    for ad_id, brand, model, year, mileage, price, title, description in rng.sample(listings, int(len(listings) * duplicates)):
+        copy_id = f"{ad_id}~copy"
+        copies.append((copy_id, ad_id))
+        listings.append((copy_id, brand, model, year,
+                         None if mileage is None else max(0, mileage + rng.uniform(-0.25, 0.25) * MILEAGE_TOLERANCE),
+                         None if price is None else price * (1 + rng.uniform(-0.25, 0.25) * PRICE_TOLERANCE),
+                         rng.choice(REWORDINGS)(title or ""), None))
+    rng.shuffle(listings)
+    return listings, copies
+
+
+def fingerprint(listings):
+    return Fingerprints.concat([Fingerprints.from_rows(listings[i:i + BATCH_SIZE]) for i in range(0, len(listings), BATCH_SIZE)])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 5, 25])
+    parser.add_argument("--duplicates", type=float, default=0.05, help="Share of listings copied to another site")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SOURCE_QUERY)
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    print(f"{'listings':>10}{'fingerprint/s':>15}{'group s':>9}{'pairs':>12}{'pairwise':>16}{'grouped':>10}{'recall':>8}")
+    for scale in args.scale:
+        listings, copies = workload(rows, scale, args.duplicates, random.Random(scale))
+        fingerprint_times, group_times = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            fingerprints = fingerprint(listings)
+            fingerprint_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            group_of = compute_groups(fingerprints)
+            group_times.append(time.perf_counter() - start)
+        pairs = len(candidate_pairs(fingerprints.buckets)[0])
+        recalled = sum(1 for copy_id, ad_id in copies if copy_id in group_of and group_of[copy_id] == group_of.get(ad_id))
+        n = len(listings)
+        print(f"{n:>10}{n / statistics.median(fingerprint_times):>15,.0f}{statistics.median(group_times):>9.2f}"
+              f"{pairs:>12,}{n * (n - 1) // 2:>16,}{len(group_of):>10}{recalled / max(len(copies), 1):>8.1%}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
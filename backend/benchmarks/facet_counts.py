@@ -0,0 +1,108 @@
+"""
+Benchmark: /facets against the /dynamic-filter-options queries it extends.
+
+For a set of filter combinations built from the most common values, times
+  options   the per-facet SELECT DISTINCT queries (/dynamic-filter-options on the database)
+  grouping  the single GROUPING SETS query with per-facet counts (/facets on the database)
+  engine    facet_engine.counts, the in-process path /facets normally takes
+and checks that both count paths agree and list exactly the options (and year
+range) of the DISTINCT queries.
+
+    cd backend && python benchmarks/facet_counts.py [--runs 5]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_connection_service.async_db import adb
+from facet_catalog import facet_catalog
+from facet_engine import facet_engine, DYNAMIC_FACETS
+from facet_counts import facet_counts
+from filters import build_contributor_filter_async
+from main import query_dynamic_filter_options
+
+
+async def top_values(column, limit=2):
+    return await adb.fetch_column(
+        f"SELECT {column} FROM listings WHERE {column} IS NOT NULL AND {column} <> '' GROUP BY {column} ORDER BY COUNT(*) DESC LIMIT %s",
+        (limit,),
+    )
+
+
+async def filter_combinations():
+    brands = await top_values('brand')
+    models = await top_values('model')
+    bodies = await top_values('body_type')
+    agencies = await adb.fetch_column(
+        "SELECT agency_name FROM dubizzle_details WHERE agency_name IS NOT NULL GROUP BY agency_name ORDER BY COUNT(*) DESC LIMIT 1"
+    )
+    combos = [
+        {},
+        {'brand': brands[0]},
+        {'brand': brands[0], 'model': models[0]},
+        {'body_type': bodies[0], 'min_year': 2015},
+        {'brand': brands[-1][:3], 'is_new': False, 'max_price': 100000},
+        {'min_price': 20000, 'max_price': 80000, 'location_city': 'a'},
+    ]
+    if agencies:
+        combos.append({'seller': agencies[0], 'brand': brands[0]})
+    return combos
+
+
+async def timed(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def differences(options, counts):
+    """Where `counts` doesn't list the same options as `options`."""
+    diffs = []
+    for key in [key for key, _, _ in DYNAMIC_FACETS] + ['locations']:
+        if [item['value'] for item in counts[key]] != options[key]:
+            diffs.append(key)
+    years = [item['value'] for item in counts['years']]
+    if (years and list(range(years[0], years[-1] + 1))) != (options['years'] or []):
+        diffs.append('years')
+    return diffs
+
+
+async def run(runs):
+    await adb.open()
+    try:
+        await facet_catalog.load()
+        await facet_engine.load()
+        failures = 0
+        print(f"{'filters':<64}{'options ms':>11}{'grouping ms':>12}{'engine ms':>10}  check")
+        for combo in await filter_combinations():
+            contributor_filter = await build_contributor_filter_async(combo['seller']) if combo.get('seller') else None
+            options, options_ms = await timed(lambda: query_dynamic_filter_options(dict(combo)), runs)
+            grouped, grouped_ms = await timed(lambda: facet_counts(dict(combo), contributor_filter), runs)
+            engine, engine_ms = await timed(lambda: facet_engine.counts(dict(combo)), runs)
+            problems = differences(options, grouped) + (["engine != grouping"] if engine != grouped else [])
+            failures += bool(problems)
+            label = ", ".join(f"{k}={v}" for k, v in combo.items()) or "(none)"
+            print(f"{label[:62]:<64}{options_ms:>11.2f}{grouped_ms:>12.2f}{engine_ms:>10.3f}  {', '.join(problems) or 'ok'}")
+    finally:
+        await adb.close()
+    if failures:
+        sys.exit(f"{failures} combination(s) disagree")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.runs))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark: serializing a page of listing rows.
+
+"model" is the old path: dict(zip()) per row, format_db_row, a validated
+`Listing` per row, then FastAPI's jsonable_encoder + JSONResponse.
+"fast" is listing_json: rows mapped onto the Listing keys and written by
+orjson. Both outputs are decoded and compared before timing.
+
+    cd backend && python benchmarks/listing_serialization.py [--rows 100] [--repeat 200]
+
+Uses synthetic rows shaped like the /search SELECT, so no database is needed.
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from database_connection_service.classes_input import Listing
+from utils import format_db_row
+from listing_json import listing_rows, FastJSONResponse
+
+COLS = [
+    "ad_id", "url", "website", "title", "price", "currency", "brand", "model", "trim", "year", "mileage", "mileage_unit",
+    "fuel_type", "transmission_type", "body_type", "condition", "color", "seller", "seller_type",
+    "location_city", "location_region", "image_url", "number_of_images", "post_date", "date_scraped",
+]
+
+
+def synthetic_rows(count):
+    base = datetime(2025, 6, 30, 23, 41)
+    return [
+        (
+            str(100000 + i), f"https://example.com/ad/{i}", "Dubizzle", f"Toyota Camry {2010 + i % 15}",
+            Decimal(15000 + 37 * i), "SAR", "Toyota", "Camry", "GLE" if i % 3 else None, 2010 + i % 15,
+            1000 * i, "km", "Petrol", "Automatic", "Sedan", "used", "White", f"seller{i % 50}", "individual",
+            "Riyadh", "Central", f"https://example.com/img/{i}.jpg", 5, base - timedelta(minutes=i),
+            base - timedelta(days=1, microseconds=i),
+        )
+        for i in range(count)
+    ]
+
+
+def model_path(rows):
+    items = [Listing(**format_db_row(dict(zip(COLS, row)))) for row in rows]
+    return JSONResponse(jsonable_encoder(items)).body
+
+
+def fast_path(rows):
+    return FastJSONResponse(listing_rows(COLS, rows)).body
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    rows = synthetic_rows(args.rows)
+    if json.loads(model_path(rows)) != json.loads(fast_path(rows)):
+        sys.exit("Outputs differ")
+
+    results = {}
+    for name, fn in [("model", model_path), ("fast", fast_path)]:
+        best = min(timeit.repeat(lambda: fn(rows), number=args.repeat, repeat=5)) / args.repeat
+        results[name] = best
+        print(f"{name:<6} {best * 1000:8.3f} ms per {args.rows}-row page")
+    print(f"speedup {results['model'] / results['fast']:.1f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,106 @@
+"""
+Before/after benchmark for the text facet filters.
+
+For a sample of canonical values (most common brands, models, trims, cities,
+colors, fuel types, websites) and partial inputs, compares the old
+`ILIKE '%value%'` predicate with the one the filter engine emits: row counts
+must match, and the median execution time and top scan node are reported
+for both.
+
+    cd backend && python benchmarks/text_filters.py [--runs 5]
+
+Run `python migrate.py` first to measure with the indexes in place.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_connection_service.db_connection import get_connection
+from database_connection_service.async_db import adb
+from facet_catalog import facet_catalog
+
+SAMPLE_COLUMNS = ['brand', 'model', 'trim', 'location_city', 'color', 'fuel_type', 'website']
+
+
+def text_filter(column: str, value: str):
+    """The filter engine's text facet predicate for `value`, as (sql, param)."""
+    values = facet_catalog.equality_values(column, value)
+    if values is not None:
+        return f"{column} = ANY(%s)", values
+    return f"{column} ILIKE %s", f"%{value}%"
+
+
+def sample_inputs(cur, column, limit=3):
+    cur.execute(f"""
+        SELECT {column} FROM listings
+        WHERE {column} IS NOT NULL AND {column} <> ''
+        GROUP BY {column} ORDER BY COUNT(*) DESC LIMIT %s
+    """, (limit,))
+    values = [row[0] for row in cur.fetchall()]
+    # Canonical values as typed in the UI, plus a partial input
+    return [v.lower() for v in values] + ([values[0][:3]] if values else [])
+
+
+def scan_nodes(plan):
+    nodes = [plan["Node Type"] + (f" on {plan['Index Name']}" if "Index Name" in plan else "")]
+    for child in plan.get("Plans", []):
+        nodes.extend(scan_nodes(child))
+    return [n for n in nodes if "Scan" in n]
+
+
+def measure(cur, condition, param, runs):
+    query = f"SELECT COUNT(*) FROM listings WHERE {condition}"
+    cur.execute(query, (param,))
+    count = cur.fetchone()[0]
+    timings, plan = [], None
+    for _ in range(runs):
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", (param,))
+        result = cur.fetchone()[0]
+        result = result if isinstance(result, list) else json.loads(result)
+        timings.append(result[0]["Execution Time"])
+        plan = result[0]["Plan"]
+    return count, statistics.median(timings), ", ".join(scan_nodes(plan))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    async def load_catalog():
+        await adb.open()
+        try:
+            await facet_catalog.load()
+        finally:
+            await adb.close()
+    asyncio.run(load_catalog())
+
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    mismatches = 0
+    try:
+        with conn.cursor() as cur:
+            print(f"{'column':<15}{'input':<22}{'rows':>8}{'before ms':>11}{'after ms':>10}  after plan")
+            for column in SAMPLE_COLUMNS:
+                for value in sample_inputs(cur, column):
+                    before = measure(cur, f"{column} ILIKE %s", f"%{value}%", args.runs)
+                    condition, param = text_filter(column, value)
+                    after = measure(cur, condition, param, args.runs)
+                    if before[0] != after[0]:
+                        mismatches += 1
+                    print(f"{column:<15}{value[:20]:<22}{after[0]:>8}{before[1]:>11.2f}{after[1]:>10.2f}  {after[2]}"
+                          + ("  ROW COUNT MISMATCH" if before[0] != after[0] else ""))
+    finally:
+        conn.close()
+    if mismatches:
+        sys.exit(f"{mismatches} predicate(s) changed the result set")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,294 @@
+import os
+import time
+import logging
+import numpy as np
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+from facet_engine import Dictionary
+
+logger = logging.getLogger(__name__)
+
+# Distance scales: one unit is a year of age, MILEAGE_SCALE km, or the trim (or
+# city) penalty when it differs; a comparable without a mileage is one unit off
+YEAR_SCALE = 1.0
+MILEAGE_SCALE = 20000.0
+TRIM_PENALTY = 1.5
+CITY_PENALTY = 0.5
+MISSING_MILEAGE = 1.0
+
+# Quantiles of the comparables' distance-weighted prices
+ESTIMATE_QUANTILE = 0.5
+RANGE_QUANTILES = (0.25, 0.75)
+
+# Listings that can be comparables have a positive price, brand, model and year;
+# other rows come back with a NULL price so a re-scrape can take them out
+SNAPSHOT_QUERY = """
+    SELECT ad_id, brand, model, trim, year, mileage, location_city,
+           CASE WHEN price > 0 AND brand IS NOT NULL AND model IS NOT NULL AND year IS NOT NULL
+                THEN price::float8 END AS price
+    FROM listings
+"""
+VALUED = "price > 0 AND brand IS NOT NULL AND model IS NOT NULL AND year IS NOT NULL"
+
+# Shown for each comparable; read by primary key, so the index keeps only numbers
+DETAIL_QUERY = "SELECT ad_id, title, url, website, trim, location_city, post_date FROM listings WHERE ad_id = ANY(%s)"
+
+
+def _lowered(value):
+    return value.lower() if value else None
+
+
+def weighted_quantiles(values, weights, quantiles):
+    """Quantiles of `values` under `weights`, interpolated between the weighted midpoints."""
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    positions = (np.cumsum(weights) - 0.5 * weights) / weights.sum()
+    return np.interp(quantiles, positions, values)
+
+
+class _Snapshot:
+    """
+    One snapshot: per listing (a slot) its (brand, model) group, year, mileage,
+    trim and city codes and price; the slots of each group are gathered lazily.
+    """
+
+    def __init__(self):
+        # Trims and cities are compared case-insensitively, so they're encoded lowered
+        self.trims = Dictionary()
+        self.cities = Dictionary()
+        self.groups = {}
+        self.slots = {}
+        self.ad_ids = []
+        self.group = np.full(1024, -1, np.int32)
+        self.year = np.zeros(1024)
+        self.mileage = np.full(1024, np.nan)
+        self.price = np.zeros(1024)
+        self.trim = np.zeros(1024, np.int32)
+        self.city = np.zeros(1024, np.int32)
+        self.size = 0
+        self._members = {}
+        self.watermark = None
+        self.built = time.monotonic()
+
+    def _grow(self, needed):
+        capacity = len(self.group)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, fill in (('group', -1), ('year', 0), ('mileage', np.nan), ('price', 0), ('trim', 0), ('city', 0)):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.full(capacity - len(array), fill, array.dtype)]))
+
+    def upsert(self, cols, rows):
+        """Store rows (SNAPSHOT_QUERY columns); returns the groups whose members changed."""
+        index = {c: i for i, c in enumerate(cols)}
+        ad_id_i, brand_i, model_i, trim_i = index['ad_id'], index['brand'], index['model'], index['trim']
+        year_i, mileage_i, city_i, price_i = index['year'], index['mileage'], index['location_city'], index['price']
+        touched = set()
+        for row in rows:
+            slot = self.slots.get(row[ad_id_i])
+            if slot is None:
+                slot = self.slots[row[ad_id_i]] = self.size
+                self.ad_ids.append(row[ad_id_i])
+                self.size += 1
+                self._grow(self.size)
+            old = int(self.group[slot])
+            if row[price_i] is None:
+                group = -1
+            else:
+                key = (row[brand_i].strip().lower(), row[model_i].strip().lower())
+                group = self.groups.get(key)
+                if group is None:
+                    group = self.groups[key] = len(self.groups)
+                self.year[slot] = row[year_i]
+                self.mileage[slot] = np.nan if row[mileage_i] is None else row[mileage_i]
+                self.price[slot] = row[price_i]
+                self.trim[slot] = self.trims.encode(_lowered(row[trim_i]))
+                self.city[slot] = self.cities.encode(_lowered(row[city_i]))
+            self.group[slot] = group
+            touched.update(g for g in (old, group) if g >= 0)
+        for group in touched:
+            self._members.pop(group, None)
+        return touched
+
+    def index_groups(self):
+        """Gather every group's slots at once (after a full load)."""
+        group = self.group[:self.size]
+        slots = np.flatnonzero(group >= 0)
+        slots = slots[np.argsort(group[slots], kind='stable')]
+        bounds = np.searchsorted(group[slots], np.arange(len(self.groups) + 1))
+        self._members = {g: slots[bounds[g]:bounds[g + 1]] for g in range(len(self.groups))}
+
+    def members(self, group):
+        slots = self._members.get(group)
+        if slots is None:
+            slots = self._members[group] = np.flatnonzero(self.group[:self.size] == group)
+        return slots
+
+    def nbytes(self):
+        arrays = [self.group, self.year, self.mileage, self.price, self.trim, self.city]
+        return sum(a.nbytes for a in arrays) + sum(m.nbytes for m in self._members.values())
+
+
+def distances(year, mileage, trim, city, target_year, target_mileage=None, target_trim=None, target_city=None):
+    """
+    Distance of each candidate (arrays of year, mileage, trim and city codes)
+    to the target spec. Mileage, trim and city only count when the target has
+    them; -1 as a target code matches no candidate.
+    """
+    squared = ((year - target_year) / YEAR_SCALE) ** 2
+    if target_mileage is not None:
+        squared += np.where(np.isnan(mileage), MISSING_MILEAGE, (mileage - target_mileage) / MILEAGE_SCALE) ** 2
+    if target_trim is not None:
+        squared += np.where(trim == target_trim, 0.0, TRIM_PENALTY) ** 2
+    if target_city is not None:
+        squared += np.where(city == target_city, 0.0, CITY_PENALTY) ** 2
+    return np.sqrt(squared)
+
+
+class ComparablesIndex:
+    """
+    In-process nearest-neighbour index behind /valuation.
+
+    Listings are grouped by (brand, model), trimmed and case-insensitively
+    like /years/{brand}/{model}. A valuation
+    scores only its group's listings by the distance over year, mileage, trim
+    and city (see the scales above), keeps the `k` nearest and weights their
+    prices by 1 / (1 + distance): the weighted median is the estimate, the
+    weighted quartiles the range.
+
+    Loaded at startup and refreshed from the rows scraped after its watermark
+    on every ingest tick; deleted listings are dropped by the full rebuild
+    every `rebuild_interval` seconds. `COMPARABLES_INDEX=0` turns it off and
+    each valuation reads its group from the database.
+    """
+
+    def __init__(self, enabled=True, rebuild_interval=3600.0, batch_size=20000):
+        self.enabled = enabled
+        self.rebuild_interval = rebuild_interval
+        self.batch_size = batch_size
+        self._snapshot = None
+        self.valuations = 0
+        self.valuation_time = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("COMPARABLES_INDEX", "1") != "0",
+            rebuild_interval=float(os.getenv("COMPARABLES_REBUILD_SECONDS", 3600)),
+            batch_size=int(os.getenv("COMPARABLES_BATCH_SIZE", 20000)),
+        )
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    async def load(self):
+        """Build a fresh snapshot and swap it in."""
+        if not self.enabled:
+            return
+        start = time.monotonic()
+        snapshot = _Snapshot()
+        snapshot.watermark = (await adb.fetch_one("SELECT MAX(changed_at) AS watermark FROM listings"))["watermark"]
+        async for cols, rows in adb.stream(f"{SNAPSHOT_QUERY} WHERE {VALUED}", batch_size=self.batch_size):
+            snapshot.upsert(cols, rows)
+        snapshot.index_groups()
+        self._snapshot = snapshot
+        logger.info(f"Comparables index loaded {snapshot.size} listings in {len(snapshot.groups)} brand/model groups "
+                    f"in {time.monotonic() - start:.2f}s ({snapshot.nbytes() / 1e6:.1f} MB)")
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback: store the rows scraped after our watermark."""
+        snapshot = self._snapshot
+        if not self.enabled:
+            return
+        if snapshot is None or snapshot.watermark is None or time.monotonic() - snapshot.built > self.rebuild_interval:
+            await self.load()
+            return
+        cols, rows = await adb.fetch(SNAPSHOT_QUERY + " WHERE changed_at > %s", (reread_from(snapshot.watermark),))
+        if snapshot is not self._snapshot:
+            return
+        touched = snapshot.upsert(cols, rows)
+        snapshot.watermark = max(snapshot.watermark, watermark)
+        if rows:
+            logger.info(f"Comparables index: {len(rows)} listings updated in {len(touched)} groups")
+
+    async def _candidates(self, brand, model):
+        """(snapshot, slots) of the (brand, model) group: the index's, or a scratch snapshot read from the database."""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            group = snapshot.groups.get((brand.strip().lower(), model.strip().lower()))
+            return snapshot, snapshot.members(group) if group is not None else np.zeros(0, np.int64)
+        cols, rows = await adb.fetch(
+            f"{SNAPSHOT_QUERY} WHERE LOWER(TRIM(brand)) = LOWER(TRIM(%s)) AND LOWER(TRIM(model)) = LOWER(TRIM(%s)) AND {VALUED}",
+            (brand, model),
+        )
+        snapshot = _Snapshot()
+        snapshot.upsert(cols, rows)
+        return snapshot, np.arange(snapshot.size)
+
+    async def value(self, brand: str, model: str, year: int, mileage: float = None, trim: str = None, city: str = None, k: int = 10):
+        """
+        Estimate, range and the `k` nearest comparables (nearest first) for the
+        spec; None when the group has no listings. Only the comparables'
+        display columns are read from the database, by primary key.
+        """
+        start = time.monotonic()
+        snapshot, slots = await self._candidates(brand, model)
+        if not len(slots):
+            return None
+        # Unknown trims/cities get code -1, which no comparable has
+        target_trim = snapshot.trims.codes.get(trim.lower(), -1) if trim else None
+        target_city = snapshot.cities.codes.get(city.lower(), -1) if city else None
+        distance = distances(
+            snapshot.year[slots], snapshot.mileage[slots], snapshot.trim[slots], snapshot.city[slots],
+            year, mileage, target_trim, target_city,
+        )
+        k = min(k, len(slots))
+        nearest = np.argpartition(distance, k - 1)[:k] if k < len(slots) else np.arange(len(slots))
+        nearest = nearest[np.argsort(distance[nearest], kind='stable')]
+        prices = snapshot.price[slots[nearest]]
+        weights = 1.0 / (1.0 + distance[nearest])
+        estimate, low, high = weighted_quantiles(prices, weights, [ESTIMATE_QUANTILE, *RANGE_QUANTILES])
+        # Read before awaiting: a refresh may rewrite these slots meanwhile
+        comparables = [
+            {
+                "ad_id": snapshot.ad_ids[slot],
+                "price": float(snapshot.price[slot]),
+                "year": int(snapshot.year[slot]),
+                "mileage": None if np.isnan(snapshot.mileage[slot]) else int(snapshot.mileage[slot]),
+                "distance": round(float(d), 3),
+            }
+            for slot, d in zip(slots[nearest], distance[nearest])
+        ]
+        cols, rows = await adb.fetch(DETAIL_QUERY, ([c["ad_id"] for c in comparables],))
+        details = {row[0]: dict(zip(cols[1:], row[1:])) for row in rows}
+        for comparable in comparables:
+            comparable.update(details.get(comparable["ad_id"], {}))
+        self.valuations += 1
+        self.valuation_time += time.monotonic() - start
+        return {
+            "estimated_price": round(float(estimate), 2),
+            "price_range": {"low": round(float(low), 2), "high": round(float(high), 2)},
+            "segment_listings": len(slots),
+            "mean_distance": round(float(distance[nearest].mean()), 3),
+            "comparables": comparables,
+        }
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "enabled": self.enabled,
+            "loaded": snapshot is not None,
+            "listings": int((snapshot.group[:snapshot.size] >= 0).sum()) if snapshot else 0,
+            "groups": len(snapshot.groups) if snapshot else 0,
+            "memory_mb": round(snapshot.nbytes() / 1e6, 2) if snapshot else 0.0,
+            "watermark": snapshot.watermark.isoformat() if snapshot and snapshot.watermark else None,
+            "age_seconds": round(time.monotonic() - snapshot.built, 1) if snapshot else None,
+            "valuations": self.valuations,
+            "avg_valuation_ms": round(self.valuation_time / self.valuations * 1000, 3) if self.valuations else 0.0,
+        }
+
+
+comparables_index = ComparablesIndex.from_env()
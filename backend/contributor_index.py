@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+
+logger = logging.getLogger(__name__)
+
+# Contributor kinds, strongest first: an identifier that is an agency_id anywhere
+# is treated as one even if some individual seller uses the same string.
+KIND_PRECEDENCE = ['agency_id', 'agency_name', 'seller_id', 'seller']
+
+KIND_FILTERS = {
+    'agency_id':   "dd.agency_id = %s",
+    'agency_name': "dd.agency_name = %s",
+    'seller_id':   "dd.seller_id = %s",
+    'seller':      "l.seller = %s",
+}
+
+# One round trip; CASE stops at the first kind that matches.
+RESOLVE_KIND_QUERY = """
+    SELECT CASE
+        WHEN EXISTS (SELECT 1 FROM dubizzle_details WHERE agency_id = %(id)s) THEN 'agency_id'
+        WHEN EXISTS (SELECT 1 FROM dubizzle_details WHERE agency_name = %(id)s) THEN 'agency_name'
+        WHEN EXISTS (SELECT 1 FROM dubizzle_details WHERE seller_id = %(id)s) THEN 'seller_id'
+        WHEN EXISTS (SELECT 1 FROM listings WHERE seller = %(id)s) THEN 'seller'
+    END
+"""
+
+NEW_IDENTIFIERS_QUERY = """
+    SELECT dd.agency_id, dd.agency_name, dd.seller_id, l.seller
+    FROM listings l
+    LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
+    WHERE l.changed_at > %s
+"""
+
+_MISSING = object()
+
+
+class ContributorIndex:
+    """
+    In-process LRU map from a contributor identifier to its kind
+    (agency_id / agency_name / seller_id / seller), or None for unknown
+    identifiers.
+
+    Entries expire after `ttl` seconds (`negative_ttl` for unknown ones) and are
+    upgraded in place when newly scraped rows show the identifier under a
+    stronger kind. Identifiers that aren't cached yet are resolved on demand
+    with a single query, since a new row alone can't tell whether older rows
+    use the same string as a stronger kind.
+    """
+
+    def __init__(self, max_entries=50000, ttl=3600.0, negative_ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.getenv("CONTRIBUTOR_INDEX_MAX_ENTRIES", 50000)),
+            ttl=float(os.getenv("CONTRIBUTOR_INDEX_TTL", 3600)),
+            negative_ttl=float(os.getenv("CONTRIBUTOR_INDEX_NEGATIVE_TTL", 300)),
+        )
+
+    def lookup(self, identifier):
+        """Cached kind for `identifier`, or _MISSING if it has to be resolved."""
+        with self._lock:
+            entry = self._entries.get(identifier)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(identifier)
+            self.hits += 1
+            return entry[0]
+
+    def store(self, identifier, kind):
+        ttl = self.ttl if kind else self.negative_ttl
+        with self._lock:
+            self._entries[identifier] = (kind, time.monotonic() + ttl)
+            self._entries.move_to_end(identifier)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def resolve(self, identifier, conn):
+        kind = self.lookup(identifier)
+        if kind is _MISSING:
+            with conn.cursor() as cur:
+                cur.execute(RESOLVE_KIND_QUERY, {"id": identifier})
+                kind = cur.fetchone()[0]
+            self.store(identifier, kind)
+        return kind
+
+    async def resolve_async(self, identifier):
+        kind = self.lookup(identifier)
+        if kind is _MISSING:
+            _, rows = await adb.fetch(RESOLVE_KIND_QUERY, {"id": identifier})
+            kind = rows[0][0]
+            self.store(identifier, kind)
+        return kind
+
+    def _upgrade(self, seen):
+        """Apply kinds observed in new rows to the identifiers we already hold."""
+        now = time.monotonic()
+        upgraded = 0
+        with self._lock:
+            for identifier, kind in seen.items():
+                entry = self._entries.get(identifier)
+                if entry is None:
+                    continue
+                current = entry[0]
+                if current is None or KIND_PRECEDENCE.index(kind) < KIND_PRECEDENCE.index(current):
+                    self._entries[identifier] = (kind, now + self.ttl)
+                    upgraded += 1
+        return upgraded
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback: fold identifiers from newly scraped rows into the map."""
+        if previous_watermark is None or not self._entries:
+            return
+        _, rows = await adb.fetch(NEW_IDENTIFIERS_QUERY, (reread_from(previous_watermark),))
+        seen = {}
+        for row in rows:
+            for kind, value in zip(KIND_PRECEDENCE, row):
+                if value and (value not in seen or KIND_PRECEDENCE.index(kind) < KIND_PRECEDENCE.index(seen[value])):
+                    seen[value] = kind
+        upgraded = self._upgrade(seen)
+        logger.info(f"Contributor index: {len(rows)} new rows, {upgraded} entries updated")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+contributor_index = ContributorIndex.from_env()
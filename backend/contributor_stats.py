@@ -0,0 +1,215 @@
+"""
+Maintain contributor_stats (migrations/005), the table behind
+/api/analytics/contributors.
+
+    python contributor_stats.py            # rebuild every row
+    python contributor_stats.py --check    # count rows that disagree, change nothing
+
+The API refreshes it on each ingest tick from the listings changed since the
+stored watermark. A rebuild is only needed when listings change in ways the
+watermark can't see: deletes, or a listing moving to another seller/agency,
+which leaves its old contributor's row counting it.
+"""
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+from database_connection_service.db_connection import get_connection
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+
+logger = logging.getLogger(__name__)
+
+STATS_TABLE = "contributor_stats"
+STATE_TABLE = "contributor_stats_state"
+
+# A listing's contributor: its seller, or its Dubizzle agency when the seller is
+# missing; listings with neither aren't contributions
+KEY_COLUMNS = """
+    l.website,
+    CASE WHEN l.seller IS NULL OR l.seller IN ('', 'N/A') THEN '' ELSE l.seller END AS seller,
+    COALESCE(dd.agency_id, '') AS agency_id,
+    COALESCE(dd.agency_name, '') AS agency_name
+"""
+CONTRIBUTION = "NOT ((l.seller IS NULL OR l.seller IN ('', 'N/A')) AND COALESCE(dd.agency_name, '') = '')"
+
+AGGREGATE_ROWS = f"""
+    SELECT {KEY_COLUMNS},
+           COUNT(*) AS total_listings, COUNT(l.price) AS priced, COALESCE(SUM(l.price), 0) AS price_sum,
+           MIN(l.post_date) AS first_post_date, MAX(l.post_date) AS last_post_date
+    FROM listings l
+    LEFT JOIN dubizzle_details dd ON dd.ad_id = l.ad_id
+    WHERE {CONTRIBUTION} AND {{where}}
+    GROUP BY 1, 2, 3, 4
+"""
+
+# Recompute every contributor with a listing changed in (since, until]. All of a
+# contributor's listings share its seller (or agency_name), so the candidates
+# found through those indexes cover each recomputed row completely.
+REFRESH_QUERY = f"""
+    WITH changed AS (
+        SELECT DISTINCT {KEY_COLUMNS}
+        FROM listings l
+        LEFT JOIN dubizzle_details dd ON dd.ad_id = l.ad_id
+        WHERE l.changed_at > %(since)s AND l.changed_at <= %(until)s AND {CONTRIBUTION}
+    ),
+    candidates AS (
+        SELECT ad_id FROM listings WHERE seller IN (SELECT seller FROM changed WHERE seller <> '')
+        UNION
+        SELECT ad_id FROM dubizzle_details WHERE agency_name IN (SELECT agency_name FROM changed WHERE seller = '')
+    )
+    INSERT INTO {STATS_TABLE} AS s
+    {AGGREGATE_ROWS.format(where="l.ad_id IN (SELECT ad_id FROM candidates)")}
+    ON CONFLICT (website, seller, agency_id, agency_name) DO UPDATE
+      SET total_listings = EXCLUDED.total_listings, priced = EXCLUDED.priced, price_sum = EXCLUDED.price_sum,
+          first_post_date = EXCLUDED.first_post_date, last_post_date = EXCLUDED.last_post_date
+      WHERE (s.total_listings, s.priced, s.price_sum, s.first_post_date, s.last_post_date)
+            IS DISTINCT FROM (EXCLUDED.total_listings, EXCLUDED.priced, EXCLUDED.price_sum,
+                              EXCLUDED.first_post_date, EXCLUDED.last_post_date)
+"""
+
+LEADERBOARD_COLUMNS = """
+    CASE WHEN s.seller = '' THEN s.agency_name ELSE s.seller END AS seller_name,
+    CASE WHEN s.seller = '' THEN COALESCE(NULLIF(s.agency_id, ''), 'unknown') ELSE s.seller END AS seller_id,
+    NULLIF(s.agency_name, '') AS agency_name,
+    s.website,
+    s.total_listings,
+    CASE WHEN s.seller = '' THEN 'agency' ELSE 'individual_seller' END AS contributor_type,
+    s.price_sum / NULLIF(s.priced, 0) AS average_price,
+    s.first_post_date AS first_listing_date,
+    s.last_post_date AS last_listing_date
+"""
+
+
+def leaderboard_query(websites, limit):
+    """
+    Top `limit` contributors, overall or within `websites`. Each website is a
+    range read of (website, total_listings DESC); the few heads are then merged.
+    """
+    if not websites:
+        return f"""
+            SELECT {LEADERBOARD_COLUMNS}
+            FROM {STATS_TABLE} s
+            ORDER BY s.total_listings DESC
+            LIMIT %s
+        """, [limit]
+    return f"""
+        SELECT {LEADERBOARD_COLUMNS}
+        FROM unnest(%s::text[]) AS w(website)
+        CROSS JOIN LATERAL (
+            SELECT * FROM {STATS_TABLE} t
+            WHERE t.website = w.website
+            ORDER BY t.total_listings DESC
+            LIMIT %s
+        ) s
+        ORDER BY s.total_listings DESC
+        LIMIT %s
+    """, [list(dict.fromkeys(websites)), limit, limit]
+
+
+class ContributorStats:
+    """
+    Keeps contributor_stats current from newly scraped listings.
+
+    The watermark lives in the database, so however many workers subscribe
+    only the first to lock it does the work; the others wait on the lock and
+    find nothing left to do, which also means no worker returns before the
+    table reflects the tick it was called for.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.refreshes = 0
+        self.rows_updated = 0
+        self.last_refresh_ms = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(enabled=os.getenv("CONTRIBUTOR_STATS_REFRESH", "1") != "0")
+
+    async def refresh(self):
+        """Recompute the contributors changed since the stored watermark; returns rows changed."""
+        start = time.perf_counter()
+        async with adb.transaction() as conn:
+            cur = await conn.execute(f"SELECT watermark FROM {STATE_TABLE} FOR UPDATE")
+            row = await cur.fetchone()
+            since = row[0] if row else None
+            cur = await conn.execute("SELECT MAX(changed_at) FROM listings")
+            until = (await cur.fetchone())[0]
+            if until is None:
+                return 0
+            # Recomputing a contributor is idempotent, so late rows are caught by re-reading
+            since = reread_from(since) if since is not None else datetime.min
+            cur = await conn.execute(REFRESH_QUERY, {"since": since, "until": until})
+            changed = cur.rowcount
+            await conn.execute(
+                f"INSERT INTO {STATE_TABLE} (id, watermark) VALUES (true, %s) "
+                f"ON CONFLICT (id) DO UPDATE SET watermark = EXCLUDED.watermark",
+                (until,),
+            )
+        self.refreshes += 1
+        self.rows_updated += changed
+        self.last_refresh_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"Contributor stats refreshed up to {until}: {changed} rows changed")
+        return changed
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback."""
+        if self.enabled:
+            await self.refresh()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "refreshes": self.refreshes,
+            "rows_updated": self.rows_updated,
+            "last_refresh_ms": self.last_refresh_ms,
+        }
+
+
+contributor_stats = ContributorStats.from_env()
+
+
+def drift(cur):
+    """Number of contributor_stats rows that differ from a recount."""
+    cur.execute(f"""
+        SELECT COUNT(*)
+        FROM ({AGGREGATE_ROWS.format(where="true")}) e
+        FULL JOIN {STATS_TABLE} s USING (website, seller, agency_id, agency_name)
+        WHERE (e.total_listings, e.priced, e.price_sum, e.first_post_date, e.last_post_date)
+              IS DISTINCT FROM (s.total_listings, s.priced, s.price_sum, s.first_post_date, s.last_post_date)
+    """)
+    return cur.fetchone()[0]
+
+
+def rebuild(conn):
+    conn.autocommit = False
+    with conn:
+        with conn.cursor() as cur:
+            # Holding the state row keeps the incremental refresh out until the rebuild commits
+            cur.execute(f"INSERT INTO {STATE_TABLE} (id) VALUES (true) ON CONFLICT (id) DO NOTHING")
+            cur.execute(f"SELECT 1 FROM {STATE_TABLE} FOR UPDATE")
+            cur.execute(f"UPDATE {STATE_TABLE} SET watermark = (SELECT MAX(changed_at) FROM listings)")
+            cur.execute(f"DELETE FROM {STATS_TABLE}")
+            cur.execute(f"INSERT INTO {STATS_TABLE} {AGGREGATE_ROWS.format(where='true')}")
+            return cur.rowcount
+
+
+def main(argv):
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    try:
+        if "--check" in argv:
+            with conn.cursor() as cur:
+                logger.info(f"{drift(cur)} contributor row(s) out of date")
+            return
+        logger.info(f"Rebuilt {STATS_TABLE}: {rebuild(conn)} rows")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
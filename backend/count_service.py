@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from database_connection_service.db_connection import execute_prepared
+
+logger = logging.getLogger(__name__)
+
+
+class CountService:
+    """
+    Total row counts for search results.
+
+    Counts are cached by a fingerprint of the normalized FROM/WHERE clause and
+    its parameters, so `/search?meta=true` and `/search/count` for the same
+    filters share one COUNT(*). The cache is cleared when the ingest watcher
+    sees new listings, and entries also expire after `ttl` seconds to pick up
+    updates and deletes it can't see.
+
+    Filters the planner expects to match at least `cap` rows are counted with
+    a capped scan instead: the result is `cap` and `exact` is False when more
+    rows match (shown as "10,000+"). `exact=True` always counts everything.
+    """
+
+    def __init__(self, max_entries=5000, ttl=300.0, cap=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cap = cap
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.capped = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.getenv("SEARCH_COUNT_CACHE_MAX_ENTRIES", 5000)),
+            ttl=float(os.getenv("SEARCH_COUNT_CACHE_TTL", 300)),
+            cap=int(os.getenv("SEARCH_COUNT_CAP", 10000)),
+        )
+
+    @staticmethod
+    def fingerprint(from_where, params):
+        normalized = json.dumps([" ".join(from_where.split()), [str(p) for p in params]])
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key, exact):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic() or (exact and not entry[1]):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def _store(self, key, total, is_exact):
+        with self._lock:
+            self._entries[key] = (total, is_exact, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def estimate(self, cur, from_where, params):
+        """Planner row estimate for `SELECT ... {from_where}`."""
+        cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 {from_where}", tuple(params))
+        plan = cur.fetchone()[0]
+        plan = plan if isinstance(plan, list) else json.loads(plan)
+        return plan[0]["Plan"]["Plan Rows"]
+
+    def count(self, cur, from_where, params, exact=False):
+        """
+        Number of rows `SELECT ... {from_where}` returns, as (total, is_exact).
+        `from_where` is the query from `FROM` on, e.g.
+        "FROM listings l LEFT JOIN dubizzle_details dd ON ... WHERE ...".
+        """
+        key = self.fingerprint(from_where, params)
+        cached = self._lookup(key, exact)
+        if cached is not None:
+            return cached
+        if not exact and self.estimate(cur, from_where, params) >= self.cap:
+            execute_prepared(cur, f"SELECT COUNT(*) FROM (SELECT 1 {from_where} LIMIT %s) capped", (*params, self.cap + 1))
+            total = cur.fetchone()[0]
+            is_exact = total <= self.cap
+            if not is_exact:
+                total = self.cap
+                self.capped += 1
+        else:
+            execute_prepared(cur, f"SELECT COUNT(*) {from_where}", params)
+            total, is_exact = cur.fetchone()[0], True
+        self._store(key, total, is_exact)
+        return total, is_exact
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def on_ingest(self, previous_watermark, watermark):
+        """Ingest-watcher callback: cached counts may now be stale."""
+        self.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "cap": self.cap,
+                "hits": self.hits,
+                "misses": self.misses,
+                "capped": self.capped,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+count_service = CountService.from_env()
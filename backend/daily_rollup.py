@@ -0,0 +1,81 @@
+"""
+Rebuild listing_daily_rollup (migrations/004) from `listings`.
+
+    python daily_rollup.py            # recompute every row
+    python daily_rollup.py --check    # list the rows that disagree, change nothing
+
+The scraper pipelines keep the rollup current on each upsert. A rebuild is
+only needed when listings change behind their back (rows deleted or edited by
+hand). It holds an EXCLUSIVE lock, so concurrent pipeline upserts wait and then
+apply their deltas on top of the rebuilt rows.
+"""
+import sys
+import logging
+from database_connection_service.db_connection import get_connection
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = "listing_daily_rollup"
+
+# What the rollup should contain; listings without a post_date land on '-infinity'
+EXPECTED_ROWS = """
+    SELECT website, COALESCE(post_date::date, '-infinity') AS day,
+           COUNT(*) AS listings, COUNT(price) AS priced, COALESCE(SUM(price), 0) AS price_sum
+    FROM listings
+    GROUP BY 1, 2
+"""
+
+
+def rollup_filter(websites, alias="r"):
+    """WHERE clause and params restricting rollup rows to `websites` (all when empty)."""
+    if not websites:
+        return "1=1", []
+    return f"{alias}.website IN ({', '.join(['%s'] * len(websites))})", list(websites)
+
+
+def drift(cur):
+    """Rollup rows that differ from a recount, as (website, day, expected, actual)."""
+    cur.execute(f"""
+        SELECT COALESCE(e.website, r.website), COALESCE(e.day, r.day),
+               (e.listings, e.priced, e.price_sum), (r.listings, r.priced, r.price_sum)
+        FROM ({EXPECTED_ROWS}) e
+        FULL JOIN {ROLLUP_TABLE} r ON r.website = e.website AND r.day = e.day
+        WHERE (e.listings, e.priced, e.price_sum) IS DISTINCT FROM (r.listings, r.priced, r.price_sum)
+          -- rows the pipelines emptied by moving their last listing elsewhere
+          AND NOT (e.website IS NULL AND r.listings = 0 AND r.priced = 0 AND r.price_sum = 0)
+        ORDER BY 1, 2
+    """)
+    return cur.fetchall()
+
+
+def rebuild(conn):
+    # One transaction: readers see the old rows until the new ones commit
+    conn.autocommit = False
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(f"LOCK TABLE {ROLLUP_TABLE} IN EXCLUSIVE MODE")
+            cur.execute(f"DELETE FROM {ROLLUP_TABLE}")
+            cur.execute(f"INSERT INTO {ROLLUP_TABLE} (website, day, listings, priced, price_sum) {EXPECTED_ROWS}")
+            return cur.rowcount
+
+
+def main(argv):
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    try:
+        if "--check" in argv:
+            with conn.cursor() as cur:
+                rows = drift(cur)
+            for website, day, expected, actual in rows:
+                print(f"{website:<16} {day}  expected {expected}  found {actual}")
+            logger.info(f"{len(rows)} rollup row(s) out of date")
+            return
+        logger.info(f"Rebuilt {ROLLUP_TABLE}: {rebuild(conn)} rows")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from fastapi import HTTPException
+from database_connection_service.db_connection import connection_kwargs, pool_timeout_key
+
+logger = logging.getLogger(__name__)
+
+# env-var keys
+async_pool_min_key = "aiven-pg-async-pool-min"
+async_pool_max_key = "aiven-pg-async-pool-max"
+
+
+class AsyncDatabase:
+    """
+    asyncio data-access layer on top of a psycopg 3 connection pool.
+
+    Queries use the same `%s` placeholders as the psycopg2 code paths, so the
+    filter builders can be shared. Independent queries should be issued with
+    `gather` so each runs on its own pooled connection and the request only
+    waits for the slowest one.
+    """
+
+    def __init__(self, min_size=1, max_size=20, timeout=2.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pool = None
+        self._open_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            min_size=int(os.getenv(async_pool_min_key, 1)),
+            max_size=int(os.getenv(async_pool_max_key, 20)),
+            timeout=float(os.getenv(pool_timeout_key, 2.0)),
+        )
+
+    async def open(self):
+        async with self._open_lock:
+            if self._pool is None:
+                pool = AsyncConnectionPool(
+                    make_conninfo(**connection_kwargs()),
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    timeout=self.timeout,
+                    kwargs={"autocommit": True},
+                    check=AsyncConnectionPool.check_connection,
+                    open=False,
+                )
+                # Don't block startup on the database; connections are filled in the background.
+                await pool.open(wait=False)
+                self._pool = pool
+        return self._pool
+
+    async def warm(self, timeout=30.0):
+        """Open the pool and wait until its `min_size` connections are up."""
+        pool = await self.open()
+        await pool.wait(timeout=timeout)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def fetch(self, query, params=None, prepare=None):
+        """
+        Run a query and return (column names, rows). `prepare=True` prepares it
+        server-side right away instead of after psycopg's usual five executions.
+        """
+        pool = self._pool or await self.open()
+        try:
+            async with pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(query, params, prepare=prepare)
+                    rows = await cur.fetchall()
+                    cols = [d.name for d in cur.description]
+                    return cols, rows
+        except PoolTimeout as e:
+            logger.error(f"Async pool exhausted: {str(e)}")
+            raise HTTPException(status_code=503, detail="Database busy, please retry")
+        except psycopg.OperationalError as e:
+            logger.error(f"Database connection failed: {str(e)}")
+            raise HTTPException(status_code=500, detail="Database connection failed")
+
+    async def stream(self, query, params=None, batch_size=10000):
+        """
+        Yield (column names, rows) in batches from a server-side cursor, for
+        result sets too large to hold as tuples all at once.
+        """
+        pool = self._pool or await self.open()
+        async with pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor(name="adb_stream") as cur:
+                    await cur.execute(query, params)
+                    while True:
+                        rows = await cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield [d.name for d in cur.description], rows
+
+    @asynccontextmanager
+    async def transaction(self):
+        """A pooled connection inside a transaction, for work that has to commit as a whole."""
+        pool = self._pool or await self.open()
+        async with pool.connection() as conn:
+            async with conn.transaction():
+                yield conn
+
+    async def fetch_dicts(self, query, params=None, prepare=None):
+        cols, rows = await self.fetch(query, params, prepare)
+        return [dict(zip(cols, row)) for row in rows]
+
+    async def fetch_one(self, query, params=None, prepare=None):
+        """First row as a dict, or None."""
+        cols, rows = await self.fetch(query, params, prepare)
+        return dict(zip(cols, rows[0])) if rows else None
+
+    async def fetch_column(self, query, params=None, prepare=None):
+        _, rows = await self.fetch(query, params, prepare)
+        return [row[0] for row in rows]
+
+    @staticmethod
+    async def gather(*queries):
+        """Await independent queries concurrently, preserving order."""
+        return await asyncio.gather(*queries)
+
+    def stats(self):
+        return self._pool.get_stats() if self._pool else {}
+
+
+adb = AsyncDatabase.from_env()
@@ -27,7 +27,7 @@ class Listing(BaseModel):
     image_url: Optional[str] = None  # was 'image' in old schema
     number_of_images: Optional[int] = None
     post_date: Union[str, datetime]  # was 'scraped_at' in old schema
-    date_scraped: Optional[Union[str, datetime]] = None  # when the listing was scraped
+    date_scraped: Optional[Union[str, datetime]] = None  # the scrape that last changed the listing
     agency_name: Optional[str] = None  # from dubizzle_details table
     seller_verified: Optional[bool] = None  # from dubizzle_details table
 
@@ -157,3 +157,22 @@ class ListingWithDetails(BaseModel):
         }
 
 
+class DepreciationSegment(BaseModel):
+    make: str
+    model: str
+    trim: Optional[str] = None
+
+
+class DepreciationBatch(BaseModel):
+    segments: List[DepreciationSegment] = Field(..., min_length=1, max_length=200)
+    websites: Optional[str] = None  # Comma-separated, applied to every segment
+
+
+class AnalyticsSegment(DepreciationSegment):
+    year: Optional[int] = None  # The price spread is only computed for a given year
+
+
+class AnalyticsBatch(BaseModel):
+    segments: List[AnalyticsSegment] = Field(..., min_length=1, max_length=200)
+    websites: Optional[str] = None  # Comma-separated, applied to every segment
+    bins: int = Field(20, ge=1, le=100)
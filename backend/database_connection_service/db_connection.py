@@ -1,62 +1,326 @@
 import os
+import re
 import time
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
 import psycopg2
+import psycopg2.errors
 from psycopg2 import OperationalError
+from fastapi import HTTPException
 import logging
 
 logger = logging.getLogger(__name__)
 
+# env-var keys
+host_key       = "aiven-pg-host"
+port_key       = "aiven-pg-port"
+db_key         = "aiven-pg-db"
+user_key       = "aiven-pg-user"
+password_key   = "aiven-pg-password"
+sslcert_key    = "aiven-pg-sslrootcert"
+
+# pool sizing / behaviour
+pool_min_key     = "aiven-pg-pool-min"
+pool_max_key     = "aiven-pg-pool-max"
+pool_timeout_key = "aiven-pg-pool-timeout"   # seconds to wait for a free connection
+pool_ping_key    = "aiven-pg-pool-ping-after" # idle seconds before a checkout is pinged
+prepare_key      = "aiven-pg-prepare"         # "0" disables server-side prepared statements
+prepared_max_key = "aiven-pg-prepared-max"    # prepared statements kept per connection
+
+
+def connection_kwargs():
+    """Connection parameters for the managed Postgres, read from the environment."""
+    sslrootcert = os.getenv(sslcert_key)
+    # Check if SSL certificate file exists
+    if sslrootcert and not os.path.exists(sslrootcert):
+        logger.error(f"SSL certificate file not found at: {sslrootcert}")
+        raise OperationalError(f"SSL certificate file not found: {sslrootcert}")
+    return dict(
+        host=os.getenv(host_key),
+        port=int(os.getenv(port_key, 5432)),
+        dbname=os.getenv(db_key),
+        user=os.getenv(user_key),
+        password=os.getenv(password_key),
+        sslmode="verify-ca",
+        sslrootcert=sslrootcert,
+    )
+
+
 def get_connection():
-    max_retries = 5
-    retry_delay = 2  # seconds
-    
-    # env-var keys
-    host_key       = "aiven-pg-host"
-    port_key       = "aiven-pg-port"
-    db_key         = "aiven-pg-db"
-    user_key       = "aiven-pg-user"
-    password_key   = "aiven-pg-password"
-    sslcert_key    = "aiven-pg-sslrootcert"
-    
-    for attempt in range(1, max_retries+1):
-        try:
-            host       = os.getenv(host_key)
-            port       = int(os.getenv(port_key, 5432))
-            dbname     = os.getenv(db_key)
-            user       = os.getenv(user_key)
-            password   = os.getenv(password_key)
-            sslrootcert= os.getenv(sslcert_key)
-            
-            # Log connection attempt (without sensitive data)
-            logger.info(f"Attempt {attempt}: Connecting to {host}:{port}/{dbname} as {user}")
-            logger.info(f"SSL cert path: {sslrootcert}")
-            
-            # Check if SSL certificate file exists
-            if sslrootcert and not os.path.exists(sslrootcert):
-                logger.error(f"SSL certificate file not found at: {sslrootcert}")
-                raise OperationalError(f"SSL certificate file not found: {sslrootcert}")
-            
-            conn = psycopg2.connect(
-                host=host,
-                port=port,
-                dbname=dbname,
-                user=user,
-                password=password,
-                sslmode="verify-ca",
-                sslrootcert=sslrootcert
+    """
+    Open a single, unpooled connection. Meant for one-off scripts; request
+    handlers should depend on `get_db` instead.
+    Returns None if the connection cannot be established.
+    """
+    try:
+        params = connection_kwargs()
+        logger.info(f"Connecting to {params['host']}:{params['port']}/{params['dbname']} as {params['user']}")
+        conn = psycopg2.connect(**params)
+        conn.autocommit = True
+        return conn
+    except OperationalError as e:
+        logger.error(f"Database connection failed: {str(e)}")
+        return None
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free within the acquire timeout."""
+
+
+class DatabasePool:
+    """
+    Bounded pool of autocommit connections shared by the request threads.
+
+    Checkouts never sleep-and-retry: a request either gets a healthy connection,
+    waits at most `acquire_timeout` seconds for one to be returned, or fails.
+    Connections idle for longer than `ping_after` seconds are pinged on checkout;
+    dead ones are discarded and the next idle one tried, then a new one opened.
+    Every returned connection is kept open (the slots bound them to `maxconn`);
+    `minconn` are opened up front by `warm`.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, acquire_timeout=2.0, ping_after=30.0, prepare=True, prepared_max=256):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.ping_after = ping_after
+        self.prepare = prepare
+        self.prepared_max = prepared_max
+        self._params = None
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # Keyed on the connection itself: id() of a closed connection can be reused by a new one
+        self._last_used = weakref.WeakKeyDictionary()
+        self._prepared = weakref.WeakKeyDictionary()
+        # metrics
+        self._checkouts = 0
+        self._in_use = 0
+        self._timeouts = 0
+        self._connect_failures = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            minconn=int(os.getenv(pool_min_key, 1)),
+            maxconn=int(os.getenv(pool_max_key, 10)),
+            acquire_timeout=float(os.getenv(pool_timeout_key, 2.0)),
+            ping_after=float(os.getenv(pool_ping_key, 30.0)),
+            prepare=os.getenv(prepare_key, "1") != "0",
+            prepared_max=int(os.getenv(prepared_max_key, 256)),
+        )
+
+    def _connect(self):
+        if self._params is None:
+            params = connection_kwargs()
+            logger.info(
+                f"Opening connection pool ({self.minconn}-{self.maxconn}) to "
+                f"{params['host']}:{params['port']}/{params['dbname']} as {params['user']}"
             )
-            conn.autocommit = True
-            
-            logger.info("Database connection successful!")
-            return conn
-
-        except OperationalError as e:
-            logger.error(f"Database connection attempt {attempt} failed: {str(e)}")
-            if attempt < max_retries:
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-                retry_delay *= 2
+            self._params = params
+        conn = psycopg2.connect(**self._params)
+        conn.autocommit = True
+        return conn
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(conn)
+        if last_used is None or time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        # Most recently returned first; bounded by the idle connections, then a new one
+        while True:
+            with self._idle_lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._healthy(conn):
+                conn.autocommit = True
+                return conn
+            logger.warning("Discarding unhealthy pooled connection")
+            with self._stats_lock:
+                self._discarded += 1
+            self._discard(conn)
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._stats_lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available within {self.acquire_timeout}s")
+        waited = time.monotonic() - start
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            with self._stats_lock:
+                self._connect_failures += 1
+            raise
+        with self._stats_lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn):
+        try:
+            broken = conn.closed or conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            if broken:
+                with self._stats_lock:
+                    self._discarded += 1
+                self._discard(conn)
             else:
-                logger.error("All database connection attempts failed")
+                self._last_used[conn] = time.monotonic()
+                with self._idle_lock:
+                    self._idle.append(conn)
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def warm(self):
+        """Open and check `minconn` connections so the first requests don't pay for connecting."""
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def _discard(self, conn):
+        self._last_used.pop(conn, None)
+        self._prepared.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def prepared_statements(self, conn):
+        """Names of the statements prepared on `conn`, least recently used first."""
+        return self._prepared.setdefault(conn, OrderedDict())
+
+    def stats(self):
+        with self._stats_lock:
+            checkouts = self._checkouts
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "connect_failures": self._connect_failures,
+                "discarded": self._discarded,
+                "wait_avg_ms": round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+    def close(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+db_pool = DatabasePool.from_env()
+
+
+class PreparedStatement:
+    """
+    A `%s`-parameterized query as a named server-side prepared statement.
+    The name is derived from the query text, so equal queries share it.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.name = "stmt_" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:20]
+        count = 0
+
+        def placeholder(match):
+            nonlocal count
+            if match.group(0) == "%%":
+                return "%"
+            count += 1
+            return f"${count}"
+
+        self.definition = f"PREPARE {self.name} AS " + re.sub(r"%%|%s", placeholder, query)
+        self.execute_sql = f"EXECUTE {self.name}" + (f" ({', '.join(['%s'] * count)})" if count else "")
+
+
+_statements = OrderedDict()
+_statements_lock = threading.Lock()
+
+
+def prepared_statement(query):
+    """Cached PreparedStatement for `query`."""
+    with _statements_lock:
+        statement = _statements.get(query)
+        if statement is None:
+            statement = _statements[query] = PreparedStatement(query)
+            if len(_statements) > 1024:
+                _statements.popitem(last=False)
+        else:
+            _statements.move_to_end(query)
+        return statement
+
+
+def execute_prepared(cur, query, params=()):
+    """
+    Execute `query` on a pooled connection's cursor as a server-side prepared
+    statement, preparing it on first use per connection, so repeated queries
+    skip parsing and planning. Falls back to a plain execute when disabled
+    (e.g. behind a transaction-mode connection pooler).
+    """
+    if not db_pool.prepare:
+        cur.execute(query, tuple(params))
+        return
+    statement = prepared_statement(query)
+    prepared = db_pool.prepared_statements(cur.connection)
+    if statement.name in prepared:
+        prepared.move_to_end(statement.name)
+    else:
+        try:
+            cur.execute(statement.definition)
+        except psycopg2.errors.DuplicatePreparedStatement:
+            pass
+        prepared[statement.name] = True
+        if len(prepared) > db_pool.prepared_max:
+            cur.execute(f"DEALLOCATE {prepared.popitem(last=False)[0]}")
+    try:
+        cur.execute(statement.execute_sql, tuple(params))
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Prepared statements were dropped server-side (DISCARD, reconnect); prepare again
+        cur.execute(statement.definition)
+        cur.execute(statement.execute_sql, tuple(params))
+
 
-    return None
+def get_db():
+    """FastAPI dependency yielding a pooled connection for the duration of a request."""
+    try:
+        conn = db_pool.getconn()
+    except PoolTimeout as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail="Database busy, please retry")
+    except OperationalError as e:
+        logger.error(f"Database connection failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Database connection failed")
+    try:
+        yield conn
+    finally:
+        db_pool.putconn(conn)
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Two-sided 95% Student t quantiles for 1..30 degrees of freedom; normal beyond
+T_975 = np.array([
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+])
+
+
+def t_quantile(dof):
+    dof = np.asarray(dof)
+    return np.where(dof > len(T_975), 1.96, T_975[np.clip(dof, 1, len(T_975)) - 1])
+
+
+def fit_curves(segments):
+    """
+    Fit price = initial_price * exp(-rate * age) to each segment's yearly
+    medians, all segments at once.
+
+    `segments` is a list of yearly rows (dicts with year, median_price and
+    listing_count, as PriceCube.yearly returns). Age counts back from the
+    segment's newest year. The fit is least squares on log prices, weighted by
+    the listings behind each year, so a year with a single listing pulls less
+    than a well-populated one. Returns per segment None (fewer than two years)
+    or the curve with its 95% confidence band for the mean price per year; the
+    band needs three years and is null with two.
+    """
+    counts = [len(rows) for rows in segments]
+    width = max(counts, default=0)
+    curves = [None] * len(segments)
+    fit = [i for i, n in enumerate(counts) if n >= 2]
+    if not fit:
+        return curves
+
+    # Padded (segment, year) matrices; padding has zero weight
+    shape = (len(fit), width)
+    years = np.zeros(shape)
+    log_price = np.zeros(shape)
+    weight = np.zeros(shape)
+    for row_index, i in enumerate(fit):
+        rows = segments[i]
+        years[row_index, :len(rows)] = [r["year"] for r in rows]
+        log_price[row_index, :len(rows)] = np.log([r["median_price"] for r in rows])
+        weight[row_index, :len(rows)] = [r["listing_count"] for r in rows]
+    points = np.array([counts[i] for i in fit], dtype=float)
+    age = np.where(weight > 0, years.max(axis=1, keepdims=True) - years, 0.0)
+    # Normalized so the weights of a segment sum to its number of years
+    weight = weight * (points / weight.sum(axis=1))[:, None]
+
+    mean_age = (weight * age).sum(axis=1) / points
+    mean_log = (weight * log_price).sum(axis=1) / points
+    centered = np.where(weight > 0, age - mean_age[:, None], 0.0)
+    sxx = (weight * centered ** 2).sum(axis=1)
+    sxy = (weight * centered * (log_price - mean_log[:, None])).sum(axis=1)
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    intercept = mean_log - slope * mean_age
+
+    fitted = intercept[:, None] + slope[:, None] * age
+    residual = np.where(weight > 0, log_price - fitted, 0.0)
+    sse = (weight * residual ** 2).sum(axis=1)
+    sst = (weight * (log_price - mean_log[:, None]) ** 2).sum(axis=1)
+    dof = points - 2
+    sigma = np.sqrt(np.divide(sse, dof, out=np.zeros_like(sse), where=dof > 0))
+    standard_error = sigma[:, None] * np.sqrt(1 / points[:, None] + np.divide(
+        centered ** 2, sxx[:, None], out=np.zeros_like(centered), where=sxx[:, None] > 0))
+    margin = t_quantile(dof.astype(int))[:, None] * standard_error
+
+    for row_index, i in enumerate(fit):
+        n = counts[i]
+        banded = dof[row_index] > 0
+        curves[i] = {
+            "initial_price": round(float(np.exp(intercept[row_index])), 2),
+            "annual_depreciation_rate": round(float((1 - np.exp(slope[row_index])) * 100), 2),
+            "r_squared": round(float(1 - sse[row_index] / sst[row_index]), 4) if sst[row_index] > 0 else None,
+            "points": [
+                {
+                    "year": int(years[row_index, j]),
+                    "age": int(age[row_index, j]),
+                    "fitted_price": round(float(np.exp(fitted[row_index, j])), 2),
+                    "lower": round(float(np.exp(fitted[row_index, j] - margin[row_index, j])), 2) if banded else None,
+                    "upper": round(float(np.exp(fitted[row_index, j] + margin[row_index, j])), 2) if banded else None,
+                }
+                for j in range(n)
+            ],
+        }
+    return curves
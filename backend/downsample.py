@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Indices of the `threshold` points Largest-Triangle-Three-Buckets keeps out
+    of the series (x, y), `x` ascending. The first and last points are always
+    kept; in between, each bucket contributes the point forming the largest
+    triangle with the previously kept point and the next bucket's average, so
+    spikes survive where averaging would flatten them.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # threshold - 2 buckets over the points between the first and the last
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        # Twice the triangle areas; the factor doesn't change the argmax
+        areas = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        keep[i + 1] = a
+    return keep
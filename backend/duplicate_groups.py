@@ -0,0 +1,592 @@
+"""
+Cross-site duplicate detection: listings of the same car, posted on several
+sites or reposted under a new ad_id, share listings.duplicate_group_id
+(migrations/007).
+
+    python duplicate_groups.py            # recompute every group
+    python duplicate_groups.py --check    # count listings whose group would change, change nothing
+
+Each listing gets a MinHash signature of its normalized title and, when it
+has one, of its Dubizzle description. The title signature is cut into BANDS
+bands and each band is hashed with the listing's blocking key (brand, model,
+year, and its mileage and price cells) into an LSH bucket, so only listings
+of the same spec at about the same mileage and price can collide. Listings
+sharing a bucket are compared on their signatures, mileage and price, and
+matching pairs are merged into groups named after their smallest ad_id.
+
+The API extends the groups on each ingest tick from the listings changed
+since the stored watermark, matching them against the buckets stored in
+listing_minhash. As with contributor_stats.py, a rebuild is only needed for
+changes the watermark can't see: a re-scraped listing whose title or price
+no longer matches its group stays in it until then (the refresh counts and
+logs these as stale members).
+
+/api/analytics reads the groups: price spreads take one price per group,
+and the listing counts report how many distinct cars they cover.
+"""
+import io
+import os
+import re
+import sys
+import time
+import zlib
+import logging
+import numpy as np
+from database_connection_service.db_connection import get_connection
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+
+logger = logging.getLogger(__name__)
+
+MINHASH_TABLE = "listing_minhash"
+STATE_TABLE = "duplicate_groups_state"
+# Without fastupdate: a GIN pending list would be scanned on every probe of the incremental refresh
+BUCKETS_INDEX = f"""
+    CREATE INDEX IF NOT EXISTS idx_listing_minhash_buckets
+    ON {MINHASH_TABLE} USING GIN (buckets) WITH (fastupdate = off)
+"""
+
+# Character shingles of the normalized text; NUM_PERM hash functions cut into
+# BANDS bands of NUM_PERM // BANDS rows, so titles 40% alike (Jaccard) share a
+# bucket 94% of the time and 20% alike ones half the time. Blocking keeps
+# buckets small, so a low threshold is affordable: a title with a few words
+# added on one site still matches
+SHINGLE = 4
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SEED = 1
+
+# A pair is a duplicate when its titles are SIMILARITY alike, its descriptions
+# (if both have one) DESCRIPTION_SIMILARITY alike, and its mileages and prices
+# (if both known) within the tolerances. Blocking cells are twice the tolerance
+# wide on two grids offset by half a cell, so values within the tolerance / 2
+# always share a cell
+SIMILARITY = 0.4
+DESCRIPTION_SIMILARITY = 0.3
+MILEAGE_TOLERANCE = 1000.0
+PRICE_TOLERANCE = 0.05  # difference of log prices, about 5%
+BUCKETS = 4 * BANDS
+
+# Buckets with more listings than this (a dealer's identical stock ads) are not compared
+MAX_BUCKET = 200
+PAIR_CHUNK = 1_000_000
+
+SOURCE_QUERY = """
+    SELECT l.ad_id, l.brand, l.model, l.year, l.mileage, l.price::float8, l.title, dd.description
+    FROM listings l
+    LEFT JOIN dubizzle_details dd ON dd.ad_id = l.ad_id
+"""
+CANDIDATES_QUERY = f"""
+    WITH matched AS MATERIALIZED (
+        -- One GIN probe per bucket: a single `buckets && <every bucket>` is a scan rechecking each row against all of them
+        SELECT DISTINCT h.ad_id
+        FROM unnest(%s::bigint[]) AS b(bucket)
+        CROSS JOIN LATERAL (SELECT ad_id FROM {MINHASH_TABLE} WHERE buckets @> ARRAY[b.bucket]) h
+    )
+    SELECT m.ad_id, m.signature, m.description_signature, m.buckets, l.mileage, l.price::float8, l.duplicate_group_id
+    FROM matched
+    JOIN {MINHASH_TABLE} m ON m.ad_id = matched.ad_id
+    JOIN listings l ON l.ad_id = m.ad_id
+"""
+UPSERT_MINHASH = f"""
+    INSERT INTO {MINHASH_TABLE} (ad_id, signature, description_signature, buckets)
+    VALUES (%s, %s, %s, %s::bigint[])
+    ON CONFLICT (ad_id) DO UPDATE
+      SET signature = EXCLUDED.signature, description_signature = EXCLUDED.description_signature,
+          buckets = EXCLUDED.buckets
+"""
+ASSIGN_GROUPS = """
+    UPDATE listings l SET duplicate_group_id = g.group_id
+    FROM unnest(%s::text[], %s::text[]) AS g(ad_id, group_id)
+    WHERE l.ad_id = g.ad_id AND l.duplicate_group_id IS DISTINCT FROM g.group_id
+"""
+RENAME_GROUPS = """
+    UPDATE listings l SET duplicate_group_id = g.group_id
+    FROM unnest(%s::text[], %s::text[]) AS g(old_id, group_id)
+    WHERE l.duplicate_group_id = g.old_id
+"""
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+EMPTY = np.iinfo(np.uint32).max
+_rng = np.random.default_rng(SEED)
+_A = _rng.integers(0, np.iinfo(np.uint64).max, NUM_PERM, dtype=np.uint64, endpoint=True) | np.uint64(1)
+_B = _rng.integers(0, np.iinfo(np.uint64).max, NUM_PERM, dtype=np.uint64, endpoint=True)
+
+# Arabic: drop diacritics and tatweel, unify alef/yeh/teh marbuta forms and the digits
+_ARABIC = str.maketrans({
+    **{chr(c): None for c in range(0x064B, 0x0653)}, "ـ": None,
+    "أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ة": "ه",
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+})
+_NON_WORD = re.compile(r"[\W_]+")
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def normalize(text):
+    """Lowercased words of `text` separated by single spaces, padded to a shingle; '' when it has none."""
+    if not text:
+        return ""
+    text = _NON_WORD.sub(" ", text.lower().translate(_ARABIC)).strip()
+    return text.ljust(SHINGLE) if text else ""
+
+
+def _mix(h, *values):
+    for value in values:
+        h = (h ^ np.asarray(value).astype(np.uint64)) * FNV_PRIME
+    return h
+
+
+def minhash(texts):
+    """(len(texts), NUM_PERM) uint32 signatures of normalized texts, and which texts had any shingle."""
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    counts = np.maximum(lengths - SHINGLE + 1, 0)
+    present = counts > 0
+    signatures = np.full((len(texts), NUM_PERM), EMPTY, dtype=np.uint32)
+    if not present.any():
+        return signatures, present
+    codepoints = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+    # Start of every shingle in the joined text, text by text
+    shingle_offsets = np.cumsum(counts) - counts
+    starts = (np.repeat(np.cumsum(lengths) - lengths, counts)
+              + np.arange(counts.sum()) - np.repeat(shingle_offsets, counts))
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    for i in range(SHINGLE):
+        hashes = _mix(hashes, codepoints[starts + i])
+    offsets = shingle_offsets[present]
+    for k in range(NUM_PERM):
+        # Multiply-shift: the high 32 bits of a * x + b
+        permuted = (_A[k] * hashes + _B[k]) >> np.uint64(32)
+        signatures[present, k] = np.minimum.reduceat(permuted, offsets)
+    return signatures, present
+
+
+def _cells(values, width):
+    """Cell of each value on two grids offset by half a cell; -1 where unknown."""
+    known = ~np.isnan(values)
+    scaled = np.where(known, values, 0.0) / width
+    return [np.where(known, np.floor(scaled + offset), -1).astype(np.int64) for offset in (0.0, 0.5)]
+
+
+def lsh_buckets(keys, signatures, mileage, price):
+    """(n, BUCKETS) int64 buckets: each band of each signature under each pair of mileage and price grids."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_price = np.log(price)
+    columns = []
+    for m, mileage_cell in enumerate(_cells(mileage, 2 * MILEAGE_TOLERANCE)):
+        for p, price_cell in enumerate(_cells(log_price, 2 * PRICE_TOLERANCE)):
+            blocked = _mix(keys ^ FNV_OFFSET, mileage_cell, price_cell)
+            for band in range(BANDS):
+                salt = (2 * m + p) * BANDS + band
+                columns.append(_mix(blocked, np.full(len(keys), salt), *signatures[:, band * ROWS:(band + 1) * ROWS].T))
+    return np.column_stack(columns).view(np.int64)
+
+
+def candidate_pairs(buckets, restrict=None):
+    """
+    Row pairs (i < j) sharing a bucket, as two arrays. With `restrict` (a
+    boolean per row) only pairs with a restricted row are kept.
+    """
+    n = len(buckets)
+    flat = buckets.ravel()
+    rows = np.repeat(np.arange(n), buckets.shape[1])
+    order = np.argsort(flat)
+    flat, rows = flat[order], rows[order]
+    starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]]) if len(flat) else np.zeros(0, np.int64)
+    sizes = np.diff(np.r_[starts, len(flat)])
+    codes = []
+    # Buckets of the same size are expanded together
+    for size in np.flatnonzero(np.bincount(sizes[(sizes > 1) & (sizes <= MAX_BUCKET)], minlength=2)):
+        block = rows[starts[sizes == size][:, None] + np.arange(size)]
+        i, j = np.triu_indices(size, 1)
+        a, b = block[:, i].ravel(), block[:, j].ravel()
+        keep = a != b
+        if restrict is not None:
+            keep &= restrict[a] | restrict[b]
+        a, b = a[keep], b[keep]
+        codes.append(np.minimum(a, b) * n + np.maximum(a, b))
+    skipped = int((sizes > MAX_BUCKET).sum())
+    if skipped:
+        logger.info(f"{skipped} LSH bucket(s) over {MAX_BUCKET} listings not compared")
+    codes = np.sort(np.concatenate(codes)) if codes else np.zeros(0, np.int64)
+    codes = codes[np.r_[True, codes[1:] != codes[:-1]]] if len(codes) else codes
+    return codes // max(n, 1), codes % max(n, 1)
+
+
+class Fingerprints:
+    """Signatures, buckets, mileage and price of a set of listings, row-aligned with `ad_ids`."""
+
+    __slots__ = ("ad_ids", "signatures", "descriptions", "has_description", "buckets", "mileage", "price", "group_ids")
+
+    def __init__(self, ad_ids, signatures, descriptions, has_description, buckets, mileage, price, group_ids=None):
+        self.ad_ids = ad_ids
+        self.signatures = signatures
+        self.descriptions = descriptions
+        self.has_description = has_description
+        self.buckets = buckets
+        self.mileage = mileage
+        self.price = price
+        self.group_ids = group_ids
+
+    def __len__(self):
+        return len(self.ad_ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From SOURCE_QUERY rows; listings without a usable title are left out."""
+        titles = [normalize(row[6]) for row in rows]
+        signatures, present = minhash(titles)
+        keep = np.flatnonzero(present)
+        rows = [rows[i] for i in keep]
+        descriptions, has_description = minhash([normalize(row[7]) for row in rows])
+        keys = np.array([
+            zlib.crc32(f"{(brand or '').strip().lower()}|{(model or '').strip().lower()}|{year}".encode())
+            for _, brand, model, year, *_ in rows
+        ], dtype=np.uint64)
+        mileage = np.array([np.nan if row[4] is None else row[4] for row in rows], dtype=np.float64)
+        price = np.array([np.nan if not row[5] or row[5] <= 0 else row[5] for row in rows], dtype=np.float64)
+        signatures = signatures[keep]
+        return cls([row[0] for row in rows], signatures, descriptions, has_description,
+                   lsh_buckets(keys, signatures, mileage, price), mileage, price)
+
+    @classmethod
+    def from_stored(cls, rows):
+        """From CANDIDATES_QUERY rows."""
+        n = len(rows)
+        signatures = np.frombuffer(b"".join(bytes(row[1]) for row in rows), dtype=np.uint32).reshape(n, NUM_PERM)
+        descriptions = np.full((n, NUM_PERM), EMPTY, dtype=np.uint32)
+        has_description = np.array([row[2] is not None for row in rows], dtype=bool)
+        for i in np.flatnonzero(has_description):
+            descriptions[i] = np.frombuffer(bytes(rows[i][2]), dtype=np.uint32)
+        return cls(
+            [row[0] for row in rows], signatures, descriptions, has_description,
+            np.array([row[3] for row in rows], dtype=np.int64).reshape(n, BUCKETS),
+            np.array([np.nan if row[4] is None else row[4] for row in rows], dtype=np.float64),
+            np.array([np.nan if not row[5] or row[5] <= 0 else row[5] for row in rows], dtype=np.float64),
+            [row[6] for row in rows],
+        )
+
+    @staticmethod
+    def concat(parts):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return Fingerprints([], np.zeros((0, NUM_PERM), np.uint32), np.zeros((0, NUM_PERM), np.uint32),
+                                np.zeros(0, bool), np.zeros((0, BUCKETS), np.int64), np.zeros(0), np.zeros(0))
+        return Fingerprints(
+            [ad_id for p in parts for ad_id in p.ad_ids],
+            *(np.concatenate([getattr(p, name) for p in parts])
+              for name in ("signatures", "descriptions", "has_description", "buckets", "mileage", "price")),
+        )
+
+    def stored_rows(self):
+        """(ad_id, signature, description signature or None, buckets) per listing, for listing_minhash."""
+        for i, ad_id in enumerate(self.ad_ids):
+            description = self.descriptions[i].tobytes() if self.has_description[i] else None
+            yield ad_id, self.signatures[i].tobytes(), description, self.buckets[i].tolist()
+
+    def duplicate_pairs(self, restrict=None):
+        """
+        Candidate pairs that pass the similarity, mileage and price checks, as
+        two row arrays, closest (in mileage and price) first.
+        """
+        first, second = candidate_pairs(self.buckets, restrict)
+        matched_first, matched_second, distances = [], [], []
+        for start in range(0, len(first), PAIR_CHUNK):
+            i, j = first[start:start + PAIR_CHUNK], second[start:start + PAIR_CHUNK]
+            similar = (self.signatures[i] == self.signatures[j]).mean(axis=1) >= SIMILARITY
+            both = self.has_description[i] & self.has_description[j]
+            similar &= ~both | ((self.descriptions[i] == self.descriptions[j]).mean(axis=1) >= DESCRIPTION_SIMILARITY)
+            mileage = np.abs(self.mileage[i] - self.mileage[j]) / MILEAGE_TOLERANCE
+            price = np.abs(np.log(self.price[i]) - np.log(self.price[j])) / PRICE_TOLERANCE
+            with np.errstate(invalid="ignore"):
+                # NaN (unknown) differences compare False, so they never rule a pair out
+                similar &= ~(mileage > 1) & ~(price > 1)
+            matched_first.append(i[similar])
+            matched_second.append(j[similar])
+            distances.append(np.nan_to_num(mileage[similar]) + np.nan_to_num(price[similar]))
+        if not matched_first:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        order = np.argsort(np.concatenate(distances), kind="stable")
+        return np.concatenate(matched_first)[order], np.concatenate(matched_second)[order]
+
+
+def merge_groups(first, second, names, mileage=None, log_price=None):
+    """
+    Groups of the nodes `names` joined by the links (first[k], second[k]),
+    taken in order; {name: smallest name in its group} for groups of two or
+    more. With `mileage` and `log_price` per node (NaN when unknown), a link is
+    skipped when the merged group would span more than the tolerances, so a
+    chain of near neighbours can't pull different cars into one group.
+    """
+    parent = list(range(len(names)))
+    bounded = mileage is not None
+    if bounded:
+        # Unknown values span (inf, -inf), which widens nothing
+        mileage_low = np.where(np.isnan(mileage), np.inf, mileage).tolist()
+        mileage_high = np.where(np.isnan(mileage), -np.inf, mileage).tolist()
+        price_low = np.where(np.isnan(log_price), np.inf, log_price).tolist()
+        price_high = np.where(np.isnan(log_price), -np.inf, log_price).tolist()
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b in zip(first, second):
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            continue
+        if bounded:
+            low_m, high_m = min(mileage_low[ra], mileage_low[rb]), max(mileage_high[ra], mileage_high[rb])
+            low_p, high_p = min(price_low[ra], price_low[rb]), max(price_high[ra], price_high[rb])
+            if high_m - low_m > MILEAGE_TOLERANCE or high_p - low_p > PRICE_TOLERANCE:
+                continue
+        # The smallest name stays the root, so roots are the group ids
+        if names[rb] < names[ra]:
+            ra, rb = rb, ra
+        parent[rb] = ra
+        if bounded:
+            mileage_low[ra], mileage_high[ra], price_low[ra], price_high[ra] = low_m, high_m, low_p, high_p
+    roots = np.array([find(x) for x in range(len(names))], dtype=np.int64)
+    grouped = np.flatnonzero(np.bincount(roots, minlength=len(names))[roots] > 1)
+    return {names[x]: names[roots[x]] for x in grouped.tolist()}
+
+
+def compute_groups(fingerprints):
+    """{ad_id: duplicate_group_id} for every listing with at least one duplicate."""
+    first, second = fingerprints.duplicate_pairs()
+    return merge_groups(first.tolist(), second.tolist(), fingerprints.ad_ids,
+                        fingerprints.mileage, np.log(fingerprints.price))
+
+
+class DuplicateGroups:
+    """
+    Extends the duplicate groups from newly scraped listings.
+
+    Like contributor_stats, the watermark lives in the database: whichever
+    worker locks it first matches the new listings, the others find nothing
+    left to do. New listings are only compared with the listings sharing a
+    bucket with them, looked up through listing_minhash's GIN index. Groups
+    grow in arrival order, so near the tolerances they can come out slightly
+    different from a rebuild's. Groups only grow: a re-read member that no
+    longer pairs with any other member of its group is left in it and counted
+    in `stale_members` until the next rebuild.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.refreshes = 0
+        self.listings_matched = 0
+        self.groups_changed = 0
+        self.stale_members = 0
+        self.last_refresh_ms = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(enabled=os.getenv("DUPLICATE_GROUPS_REFRESH", "1") != "0")
+
+    async def refresh(self):
+        """Fingerprint the listings changed since the watermark and merge them into groups; returns listings regrouped."""
+        start = time.perf_counter()
+        async with adb.transaction() as conn:
+            cur = await conn.execute(f"SELECT watermark FROM {STATE_TABLE} FOR UPDATE")
+            row = await cur.fetchone()
+            if row is None or row[0] is None:
+                # Never built: `python duplicate_groups.py` fingerprints everything first
+                return 0
+            since = row[0]
+            cur = await conn.execute("SELECT MAX(changed_at) FROM listings")
+            until = (await cur.fetchone())[0]
+            if until is None:
+                return 0
+            # Matching a listing again is idempotent, so late rows are caught by re-reading
+            cur = await conn.execute(f"{SOURCE_QUERY} WHERE l.changed_at > %s AND l.changed_at <= %s",
+                                     (reread_from(since), until))
+            new = Fingerprints.from_rows(await cur.fetchall())
+            changed = stale = 0
+            if len(new):
+                async with conn.cursor() as cur:
+                    await cur.executemany(UPSERT_MINHASH, list(new.stored_rows()))
+                cur = await conn.execute(CANDIDATES_QUERY, (np.unique(new.buckets).tolist(),))
+                candidates = Fingerprints.from_stored(await cur.fetchall())
+                new_ids = set(new.ad_ids)
+                is_new = np.array([ad_id in new_ids for ad_id in candidates.ad_ids], dtype=bool)
+                first, second = candidates.duplicate_pairs(restrict=is_new)
+                stale = len(self._stale(candidates, is_new, first, second))
+                changed = await self._merge(conn, candidates, is_new, first, second)
+            await conn.execute(f"UPDATE {STATE_TABLE} SET watermark = %s", (until,))
+        self.refreshes += 1
+        self.listings_matched += len(new)
+        self.groups_changed += changed
+        self.stale_members += stale
+        self.last_refresh_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"Duplicate groups refreshed up to {until}: {len(new)} listings matched, {changed} regrouped")
+        if stale:
+            logger.warning(f"{stale} re-scraped listing(s) no longer match their duplicate group; "
+                           f"`python duplicate_groups.py` regroups them")
+        return changed
+
+    @staticmethod
+    def _stale(candidates, is_new, first, second):
+        """Re-read listings already in a group that no longer pair with another member of it."""
+        group_ids = candidates.group_ids
+        paired = set()
+        for a, b in zip(first.tolist(), second.tolist()):
+            if group_ids[a] and group_ids[a] == group_ids[b]:
+                paired.update((a, b))
+        return [candidates.ad_ids[i] for i in np.flatnonzero(is_new) if group_ids[i] and i not in paired]
+
+    @staticmethod
+    async def _merge(conn, candidates, is_new, first, second):
+        ad_ids = candidates.ad_ids
+        if not len(first):
+            return 0
+        # Candidates already in a group link to the group's name first, so groups
+        # bridged by a new listing merge under the smallest name
+        names = list(ad_ids)
+        index = {ad_id: i for i, ad_id in enumerate(names)}
+        group_first, group_second = [], []
+        for i, group_id in enumerate(candidates.group_ids):
+            if group_id:
+                if group_id not in index:
+                    index[group_id] = len(names)
+                    names.append(group_id)
+                group_first.append(i)
+                group_second.append(index[group_id])
+        unknown = np.full(len(names) - len(ad_ids), np.nan)
+        group_of = merge_groups(group_first + first.tolist(), group_second + second.tolist(), names,
+                                np.r_[candidates.mileage, unknown], np.r_[np.log(candidates.price), unknown])
+        roots = {group_of[ad_ids[i]] for i in np.flatnonzero(is_new) if ad_ids[i] in group_of}
+        if not roots:
+            return 0
+        members = [(ad_id, group_of[ad_id]) for ad_id in ad_ids if group_of.get(ad_id) in roots]
+        renamed = [(old, group_of[old]) for old in {g for g in candidates.group_ids if g}
+                   if group_of[old] in roots and group_of[old] != old]
+        cur = await conn.execute(ASSIGN_GROUPS, ([a for a, _ in members], [g for _, g in members]))
+        changed = cur.rowcount
+        if renamed:
+            cur = await conn.execute(RENAME_GROUPS, ([o for o, _ in renamed], [g for _, g in renamed]))
+            changed += cur.rowcount
+        return changed
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback."""
+        if self.enabled:
+            await self.refresh()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "refreshes": self.refreshes,
+            "listings_matched": self.listings_matched,
+            "groups_changed": self.groups_changed,
+            "stale_members": self.stale_members,
+            "last_refresh_ms": self.last_refresh_ms,
+        }
+
+
+duplicate_groups = DuplicateGroups.from_env()
+
+
+def read_fingerprints(conn, batch_size):
+    """Fingerprints of every listing, read through a named (server-side) cursor in `conn`'s transaction."""
+    parts = []
+    with conn.cursor(name="duplicate_groups") as cur:
+        cur.itersize = batch_size
+        cur.execute(SOURCE_QUERY)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            parts.append(Fingerprints.from_rows(rows))
+    return Fingerprints.concat(parts)
+
+
+def _copy_rows(fingerprints):
+    buf = io.StringIO()
+    for ad_id, signature, description, buckets in fingerprints.stored_rows():
+        description = f"\\\\x{description.hex()}" if description is not None else "\\N"
+        buf.write(f"{ad_id.translate(_COPY_ESCAPES)}\t\\\\x{signature.hex()}\t{description}\t{{{','.join(map(str, buckets))}}}\n")
+    buf.seek(0)
+    return buf
+
+
+def rebuild(conn, batch_size, check=False):
+    """
+    Fingerprint and group every listing in one transaction; returns (listings,
+    listings in groups, listings whose group changed). With `check` nothing is
+    written.
+    """
+    conn.autocommit = False
+    with conn:
+        with conn.cursor() as cur:
+            # Holding the state row keeps the incremental refresh out until the rebuild commits
+            cur.execute(f"INSERT INTO {STATE_TABLE} (id) VALUES (true) ON CONFLICT (id) DO NOTHING")
+            cur.execute(f"SELECT 1 FROM {STATE_TABLE} FOR UPDATE")
+            cur.execute("SELECT MAX(changed_at) FROM listings")
+            watermark = cur.fetchone()[0]
+        start = time.perf_counter()
+        fingerprints = read_fingerprints(conn, batch_size)
+        read_seconds = time.perf_counter() - start
+        group_of = compute_groups(fingerprints)
+        logger.info(f"Fingerprinted {len(fingerprints)} listings in {read_seconds:.1f}s, grouped in "
+                    f"{time.perf_counter() - start - read_seconds:.1f}s")
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE new_duplicate_groups (ad_id TEXT PRIMARY KEY, group_id TEXT NOT NULL) ON COMMIT DROP")
+            cur.execute("INSERT INTO new_duplicate_groups SELECT * FROM unnest(%s::text[], %s::text[])",
+                        (list(group_of), list(group_of.values())))
+            cur.execute("""
+                SELECT COUNT(*) FROM listings l
+                LEFT JOIN new_duplicate_groups g ON g.ad_id = l.ad_id
+                WHERE l.duplicate_group_id IS DISTINCT FROM g.group_id
+            """)
+            changed = cur.fetchone()[0]
+            if check:
+                conn.rollback()
+                return len(fingerprints), len(group_of), changed
+            cur.execute(f"UPDATE {STATE_TABLE} SET watermark = %s", (watermark,))
+            # Bulk-loaded without the index, which is then built in one pass
+            cur.execute(f"TRUNCATE {MINHASH_TABLE}")
+            cur.execute("DROP INDEX IF EXISTS idx_listing_minhash_buckets")
+            for offset in range(0, len(fingerprints), batch_size):
+                part = Fingerprints(fingerprints.ad_ids[offset:offset + batch_size],
+                                    *(getattr(fingerprints, name)[offset:offset + batch_size]
+                                      for name in ("signatures", "descriptions", "has_description", "buckets", "mileage", "price")))
+                cur.copy_expert(f"COPY {MINHASH_TABLE} (ad_id, signature, description_signature, buckets) FROM STDIN",
+                                _copy_rows(part))
+            cur.execute(BUCKETS_INDEX)
+            cur.execute(f"ANALYZE {MINHASH_TABLE}")
+            cur.execute("""
+                UPDATE listings l SET duplicate_group_id = NULL
+                WHERE l.duplicate_group_id IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM new_duplicate_groups g WHERE g.ad_id = l.ad_id)
+            """)
+            cur.execute("""
+                UPDATE listings l SET duplicate_group_id = g.group_id
+                FROM new_duplicate_groups g
+                WHERE l.ad_id = g.ad_id AND l.duplicate_group_id IS DISTINCT FROM g.group_id
+            """)
+    return len(fingerprints), len(group_of), changed
+
+
+def main(argv):
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    try:
+        listings, grouped, changed = rebuild(conn, batch_size=20000, check="--check" in argv)
+        if "--check" in argv:
+            logger.info(f"{changed} listing(s) would change group ({grouped} of {listings} in groups)")
+        else:
+            logger.info(f"Rebuilt duplicate groups: {grouped} of {listings} listings in groups, {changed} changed")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
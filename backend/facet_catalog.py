@@ -0,0 +1,241 @@
+import logging
+import threading
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+
+logger = logging.getLogger(__name__)
+
+# Text columns of `listings` the search filters match against.
+TEXT_FACETS = [
+    'brand', 'model', 'trim', 'location_city', 'location_region',
+    'fuel_type', 'transmission_type', 'body_type', 'condition', 'color', 'website',
+]
+
+# Columns whose distinct values the filter-option endpoints list
+OPTION_COLUMNS = TEXT_FACETS + ['seller_type']
+
+# A canonical value that is contained in more distinct values than this is
+# matched with ILIKE instead of a long `= ANY` list.
+MAX_EQUALITY_VALUES = 64
+
+
+async def collated(values):
+    """`values` sorted by the database, so the order matches `ORDER BY column`."""
+    return await adb.fetch_column("SELECT v FROM unnest(%s::text[]) AS v ORDER BY v", (list(values),))
+
+
+def _has_wildcards(value):
+    return '%' in value or '_' in value or '\\' in value
+
+
+class FacetCatalog:
+    """
+    In-process copy of the distinct values of each text facet.
+
+    The search filters historically match text facets with `ILIKE '%value%'`,
+    which no B-tree index can serve. When the input is a canonical value (case
+    insensitively) the catalog already knows every value containing it, so the
+    same rows can be selected with an indexable `column = ANY(values)`. Partial
+    input, and anything while the catalog isn't loaded, keeps the ILIKE
+    predicate, which the trigram indexes serve.
+
+    It also serves the static filter-option endpoints (/makes, /models,
+    /locations, /filter-options, ...): the option lists are kept in the
+    database's collation order, with the brand/model pairs and the year range.
+
+    Loaded at startup and then extended from the rows scraped after its
+    `watermark` (the newest `changed_at` it has read) whenever the ingest
+    watcher reports new rows, so only new rows are read. Values that disappear
+    from the table are kept; matching them with equality is harmless.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._sorted = {}
+        self._models_by_brand = {}
+        self._years = (None, None)
+        self._lock = threading.Lock()
+        self.watermark = None
+        self.loaded = False
+
+    @staticmethod
+    def _bucket(known, values):
+        added = 0
+        for value in values:
+            if value:
+                bucket = known.setdefault(value.lower(), ())
+                if value not in bucket:
+                    known[value.lower()] = bucket + (value,)
+                    added += 1
+        return added
+
+    async def load(self):
+        """Read every facet from scratch."""
+        watermark = (await adb.fetch_one("SELECT MAX(changed_at) AS watermark FROM listings"))["watermark"]
+        *columns, (_, pairs), years = await adb.gather(
+            *(
+                adb.fetch_column(f"SELECT DISTINCT {column} FROM listings WHERE {column} IS NOT NULL AND {column} <> '' ORDER BY {column}")
+                for column in OPTION_COLUMNS
+            ),
+            adb.fetch("SELECT DISTINCT brand, model FROM listings WHERE brand IS NOT NULL AND model IS NOT NULL AND model <> ''"),
+            adb.fetch_one("SELECT MIN(year) AS min_year, MAX(year) AS max_year FROM listings"),
+        )
+        values, ordered = {}, {}
+        for column, column_values in zip(OPTION_COLUMNS, columns):
+            self._bucket(values.setdefault(column, {}), column_values)
+            ordered[column] = column_values
+        ordered['location'] = await collated(set(ordered['location_city']) | set(ordered['location_region']))
+        models_by_brand = {}
+        for brand, model in pairs:
+            models_by_brand.setdefault(brand, set()).add(model)
+        with self._lock:
+            self._values = values
+            self._sorted = ordered
+            self._models_by_brand = models_by_brand
+            self._years = (years["min_year"], years["max_year"])
+            self.watermark = watermark
+            self.loaded = True
+        logger.info(f"Facet catalog loaded: {self.stats()['values']}")
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback: add values first seen in rows scraped after our watermark."""
+        if not self.loaded:
+            await self.load()
+            return
+        # Rows are re-read from just before our watermark; merging is idempotent
+        since = self.watermark
+        cols, rows = await adb.fetch(
+            f"SELECT DISTINCT {', '.join(OPTION_COLUMNS)}, year FROM listings"
+            + (" WHERE changed_at > %s" if since is not None else ""),
+            (reread_from(since),) if since is not None else None,
+        )
+        index = {col: i for i, col in enumerate(cols)}
+        with self._lock:
+            values = dict(self._values)
+            models_by_brand = dict(self._models_by_brand)
+            min_year, max_year = self._years
+            ordered = dict(self._sorted)
+        changed = set()
+        for column in OPTION_COLUMNS:
+            known = dict(values.get(column, {}))
+            if self._bucket(known, {row[index[column]] for row in rows}):
+                values[column] = known
+                changed.add(column)
+        for row in rows:
+            brand, model, year = row[index['brand']], row[index['model']], row[index['year']]
+            if brand is not None and model and model not in models_by_brand.get(brand, ()):
+                models_by_brand[brand] = models_by_brand.get(brand, set()) | {model}
+            if year is not None:
+                min_year = year if min_year is None else min(min_year, year)
+                max_year = year if max_year is None else max(max_year, year)
+        for column in changed:
+            ordered[column] = await collated(v for bucket in values[column].values() for v in bucket)
+        if changed & {'location_city', 'location_region'}:
+            ordered['location'] = await collated(set(ordered['location_city']) | set(ordered['location_region']))
+        with self._lock:
+            self._values = values
+            self._sorted = ordered
+            self._models_by_brand = models_by_brand
+            self._years = (min_year, max_year)
+            self.watermark = max(since, watermark) if since is not None else watermark
+        if changed:
+            logger.info(f"Facet catalog: new values for {sorted(changed)}")
+
+    def equality_values(self, column, value):
+        """
+        Every known value of `column` that `ILIKE '%value%'` would match, when
+        `value` is itself a canonical value; None when the caller has to fall
+        back to ILIKE.
+        """
+        if not self.loaded or _has_wildcards(value):
+            return None
+        with self._lock:
+            known = self._values.get(column)
+            if not known or value.lower() not in known:
+                return None
+            needle = value.lower()
+            matches = [v for lowered, bucket in known.items() if needle in lowered for v in bucket]
+        if len(matches) > MAX_EQUALITY_VALUES:
+            return None
+        return sorted(matches)
+
+    def options(self, column):
+        """Distinct non-empty values of `column` (or 'location': cities and regions) in ORDER BY order; None until loaded."""
+        if not self.loaded:
+            return None
+        return self._sorted.get(column)
+
+    def models_for_brand(self, brand):
+        """Models of every brand matching `ILIKE '%brand%'`, in order; None if the caller must query."""
+        if not self.loaded or _has_wildcards(brand):
+            return None
+        needle = brand.lower()
+        with self._lock:
+            models = set()
+            for known_brand, brand_models in self._models_by_brand.items():
+                if needle in known_brand.lower():
+                    models |= brand_models
+            ordered = self._sorted['model']
+        return [model for model in ordered if model in models]
+
+    def brand_model_pairs(self, brand, model):
+        """(brand, model) pairs matching `brand ILIKE '%brand%' AND model ILIKE '%model%'`; None if the caller must query."""
+        if not self.loaded or not brand or not model or _has_wildcards(brand) or _has_wildcards(model):
+            return None
+        brand_needle, model_needle = brand.lower(), model.lower()
+        with self._lock:
+            return [
+                (known_brand, known_model)
+                for known_brand, brand_models in self._models_by_brand.items() if brand_needle in known_brand.lower()
+                for known_model in brand_models if model_needle in known_model.lower()
+            ]
+
+    def year_range(self):
+        """(min, max) year, or None until loaded."""
+        return self._years if self.loaded else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+                "values": {column: sum(len(b) for b in known.values()) for column, known in self._values.items()},
+                "brand_models": sum(len(models) for models in self._models_by_brand.values()),
+            }
+
+
+facet_catalog = FacetCatalog()
+
+
+async def option_values(column: str):
+    """facet_catalog.options(column), read from the table while the catalog isn't loaded."""
+    values = facet_catalog.options(column)
+    if values is not None:
+        return values
+    if column == 'location':
+        return await adb.fetch_column(
+            "SELECT DISTINCT location_city FROM listings WHERE location_city IS NOT NULL AND location_city <> '' "
+            "UNION SELECT DISTINCT location_region FROM listings WHERE location_region IS NOT NULL AND location_region <> '' "
+            "ORDER BY 1"
+        )
+    return await adb.fetch_column(f"SELECT DISTINCT {column} FROM listings WHERE {column} IS NOT NULL AND {column} <> '' ORDER BY {column}")
+
+
+async def brand_models(brand: str):
+    """Models of the brands matching `brand` anywhere, like `brand ILIKE '%brand%'`."""
+    models = facet_catalog.models_for_brand(brand)
+    if models is not None:
+        return models
+    return await adb.fetch_column(
+        "SELECT DISTINCT model FROM listings WHERE brand ILIKE %s AND model IS NOT NULL AND model <> '' ORDER BY model",
+        (f"%{brand}%",),
+    )
+
+
+async def year_range():
+    """(min, max) listing year; (None, None) for an empty table."""
+    years = facet_catalog.year_range()
+    if years is not None:
+        return years
+    row = await adb.fetch_one("SELECT MIN(year) AS min_year, MAX(year) AS max_year FROM listings WHERE year IS NOT NULL")
+    return row["min_year"], row["max_year"]
@@ -0,0 +1,90 @@
+from database_connection_service.async_db import adb
+from facet_catalog import collated
+from facet_engine import DYNAMIC_FACETS
+from filter_engine import DYNAMIC_FILTERS, dynamic_values
+
+# Grouping sets of the /facets query as (set name, grouped expression, excluded
+# filter group). Locations count listings whose city or region is the value:
+# city + region, minus the listings where both are that value.
+COUNT_SETS = [(key, f"l.{column}", group) for key, column, group in DYNAMIC_FACETS] + [
+    ('years', "l.year", 'year'),
+    ('location_city', "l.location_city", 'location'),
+    ('location_region', "l.location_region", 'location'),
+    ('location_both', "CASE WHEN l.location_city = l.location_region THEN l.location_city END", 'location'),
+]
+
+_ALL_GROUPED = (1 << len(COUNT_SETS)) - 1
+
+
+def facet_counts_query(current_filters: dict, contributor_filter=None):
+    """
+    One GROUPING SETS query counting listings per value of every facet, with
+    each facet's own filter group left out as in build_dynamic_filter_query.
+    Each set has its own `COUNT(*) FILTER (...)`; the WHERE clause keeps the
+    rows at least one of them can count, so the table is scanned once.
+    Returns (sql, params).
+    """
+    values = dynamic_values(current_filters)
+    contributor_filter = contributor_filter if values.get('seller') else None
+    compile_except = lambda exclude=(): DYNAMIC_FILTERS.compile(values, contributor_filter, exclude=exclude)
+    everything = compile_except()
+    active = DYNAMIC_FILTERS.active_groups(everything)
+
+    counts, params = [], []
+    for _, _, group in COUNT_SETS + [('total', None, None)]:
+        compiled = compile_except((group,)) if group in active else everything
+        counts.append(f"COUNT(*) FILTER (WHERE {compiled.sql})" if compiled.sql else "COUNT(*)")
+        params.extend(compiled.params)
+
+    # A row counts somewhere iff it passes every group but (at most) one
+    where = []
+    for group in sorted(active):
+        compiled = compile_except((group,))
+        if not compiled.sql:
+            where = []
+            break
+        where.append(f"({compiled.sql})")
+        params.extend(compiled.params)
+
+    exprs = [expr for _, expr, _ in COUNT_SETS]
+    sql = f"""
+        SELECT GROUPING({', '.join(exprs)}) AS grouping_id,
+               {', '.join(f'{expr} AS g{i}' for i, expr in enumerate(exprs))},
+               {', '.join(f'{count} AS n{i}' for i, count in enumerate(counts))}
+        FROM listings l
+        LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
+        {'WHERE ' + ' OR '.join(where) if where else ''}
+        GROUP BY GROUPING SETS ({', '.join(f'({expr})' for expr in exprs)}, ())
+        ORDER BY grouping_id, {', '.join(f'g{i}' for i in range(len(exprs)))}
+    """
+    return sql, params
+
+
+async def facet_counts(current_filters: dict, contributor_filter=None):
+    """The /facets response, computed by the database."""
+    sql, params = facet_counts_query(current_filters, contributor_filter)
+    _, rows = await adb.fetch(sql, params, prepare=True)
+    sets = {name: [] for name, _, _ in COUNT_SETS}
+    total = 0
+    width = len(COUNT_SETS)
+    for row in rows:
+        grouping_id = row[0]
+        if grouping_id == _ALL_GROUPED:
+            total = row[1 + 2 * width]
+            continue
+        i = next(i for i in range(width) if not grouping_id & (1 << (width - 1 - i)))
+        value, count = row[1 + i], row[1 + width + i]
+        if count and value is not None and value != '':
+            sets[COUNT_SETS[i][0]].append((value, count))
+
+    result = {"total": total}
+    for key, _, _ in DYNAMIC_FACETS:
+        result[key] = [{"value": value, "count": count} for value, count in sets[key]]
+    result["years"] = [{"value": value, "count": count} for value, count in sets['years']]
+    locations = {}
+    for name, sign in (('location_city', 1), ('location_region', 1), ('location_both', -1)):
+        for value, count in sets[name]:
+            locations[value] = locations.get(value, 0) + sign * count
+    order = await collated(locations) if locations else []
+    result["locations"] = [{"value": value, "count": locations[value]} for value in order if locations[value] > 0]
+    return result
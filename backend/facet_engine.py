@@ -0,0 +1,397 @@
+import os
+import re
+import time
+import logging
+import numpy as np
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+from contributor_index import contributor_index, KIND_FILTERS
+from facet_catalog import collated
+from filter_engine import DYNAMIC_FILTERS, dynamic_values
+
+logger = logging.getLogger(__name__)
+
+# /dynamic-filter-options facets as (response key, column, excluded filter group)
+DYNAMIC_FACETS = [
+    ('makes', 'brand', 'brand'),
+    ('models', 'model', 'model'),
+    ('trims', 'trim', 'trim'),
+    ('bodyTypes', 'body_type', 'body_type'),
+    ('transmissionTypes', 'transmission_type', 'transmission_type'),
+    ('colors', 'color', 'color'),
+    ('fuelTypes', 'fuel_type', 'fuel_type'),
+    ('sellerTypes', 'seller_type', 'seller_type'),
+    ('websites', 'website', 'website'),
+]
+
+# Text columns sharing one dictionary, ranked in the database's collation order
+FACET_COLUMNS = [column for _, column, _ in DYNAMIC_FACETS] + ['location_city', 'location_region']
+# Contributor columns, named like the contributor kinds (KIND_FILTERS); only ever filtered on
+CONTRIBUTOR_COLUMNS = {'seller': 'l.seller', 'agency_id': 'dd.agency_id', 'agency_name': 'dd.agency_name', 'seller_id': 'dd.seller_id'}
+NUMERIC_COLUMNS = ['year', 'price', 'mileage']
+
+SNAPSHOT_QUERY = f"""
+    SELECT l.ad_id, {', '.join(f'l.{c}' for c in FACET_COLUMNS)},
+           {', '.join(f'{expr} AS {c}' for c, expr in CONTRIBUTOR_COLUMNS.items())},
+           l.year, l.price::float8 AS price, l.mileage
+    FROM listings l
+    LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
+"""
+
+
+def ilike_matcher(value: str):
+    """Predicate on lower-cased strings equivalent to `ILIKE '%value%'`."""
+    if not any(ch in value for ch in '%_\\'):
+        needle = value.lower()
+        return lambda lowered: needle in lowered
+    pattern, escaped = [], False
+    for ch in f"%{value}%":
+        if escaped:
+            pattern.append(re.escape(ch))
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        else:
+            pattern.append('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch))
+    regex = re.compile(''.join(pattern), re.IGNORECASE | re.DOTALL)
+    return lambda lowered: regex.fullmatch(lowered) is not None
+
+
+class Dictionary:
+    """Strings <-> int32 codes; code 0 is NULL."""
+
+    def __init__(self):
+        self.values = [None]
+        self.lowered = [None]
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return 0
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            self.lowered.append(value.lower())
+        return code
+
+
+class _Store:
+    """One snapshot of the listings: a code or number array per column, one slot per listing."""
+
+    def __init__(self, capacity=1024):
+        self.facets = Dictionary()
+        self.contributors = Dictionary()
+        self.codes = {c: np.zeros(capacity, np.int32) for c in FACET_COLUMNS + list(CONTRIBUTOR_COLUMNS)}
+        self.numbers = {c: np.full(capacity, np.nan) for c in NUMERIC_COLUMNS}
+        # Distinct codes each text column holds, so pattern filters only test those
+        self.column_codes = {c: set() for c in FACET_COLUMNS + list(CONTRIBUTOR_COLUMNS)}
+        self.rank = np.zeros(1, np.int64)
+        self.slots = {}
+        self.size = 0
+        self.watermark = None
+        self.built = time.monotonic()
+
+    def _grow(self, needed):
+        capacity = len(self.numbers['year'])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for column, array in self.codes.items():
+            self.codes[column] = np.concatenate([array, np.zeros(capacity - len(array), np.int32)])
+        for column, array in self.numbers.items():
+            self.numbers[column] = np.concatenate([array, np.full(capacity - len(array), np.nan)])
+
+    def new_facet_values(self, cols, rows):
+        index = [cols.index(c) for c in FACET_COLUMNS]
+        return {row[i] for row in rows for i in index if row[i] is not None and row[i] not in self.facets.codes}
+
+    def upsert(self, cols, rows):
+        """Write rows (SNAPSHOT_QUERY columns) into their listing's slot, appending new listings."""
+        if not rows:
+            return
+        index = {c: i for i, c in enumerate(cols)}
+        slots = []
+        for row in rows:
+            slot = self.slots.get(row[0])
+            if slot is None:
+                slot = self.slots[row[0]] = self.size
+                self.size += 1
+            slots.append(slot)
+        self._grow(self.size)
+        slots = np.array(slots)
+        for column in self.codes:
+            dictionary = self.facets if column in FACET_COLUMNS else self.contributors
+            i = index[column]
+            codes = [dictionary.encode(row[i]) for row in rows]
+            self.codes[column][slots] = codes
+            self.column_codes[column].update(codes)
+        for column in NUMERIC_COLUMNS:
+            i = index[column]
+            self.numbers[column][slots] = np.array([row[i] for row in rows], dtype=float)
+
+    def set_order(self, ordered):
+        """Rank every facet value by its position in `ordered` (the collated values)."""
+        rank = np.zeros(len(self.facets.values), np.int64)
+        for position, value in enumerate(ordered, start=1):
+            rank[self.facets.codes[value]] = position
+        self.rank = rank
+
+    def nbytes(self):
+        return sum(a.nbytes for a in self.codes.values()) + sum(a.nbytes for a in self.numbers.values())
+
+
+class FacetEngine:
+    """
+    In-process columnar index answering /dynamic-filter-options and /facets.
+
+    Every listing (joined with its dubizzle_details row) has a slot in a set of
+    arrays: the text columns are dictionary-encoded into int32 codes, the
+    numeric ones are float arrays with NaN for NULL. A filter value selects a
+    set of dictionary values (an exact value, or every value matching ILIKE),
+    and its bitmap over the listings is a lookup-table gather on the code
+    column, i.e. the union of those values' bitmaps without storing one bitmap
+    per value. Each facet is then the AND of every filter group's bitmap except
+    its own, and its options are the codes present under that bitmap, in
+    collation order; for /facets, the histogram under that bitmap is the count.
+    All facets, the year range and the locations come from one pass, with the
+    same semantics as the SQL in build_dynamic_filter_query.
+
+    Built at startup with a streamed snapshot, then updated in place from the
+    rows scraped after its watermark on every ingest (new listings are appended,
+    re-scraped ones overwritten). Deleted listings are only dropped by the full
+    rebuild that happens every `rebuild_interval` seconds. `FACET_ENGINE=0`
+    turns it off and the endpoint queries the database as before.
+    """
+
+    def __init__(self, enabled=True, rebuild_interval=3600.0, batch_size=20000):
+        self.enabled = enabled
+        self.rebuild_interval = rebuild_interval
+        self.batch_size = batch_size
+        self._store = None
+        self.queries = 0
+        self.query_time = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("FACET_ENGINE", "1") != "0",
+            rebuild_interval=float(os.getenv("FACET_ENGINE_REBUILD_SECONDS", 3600)),
+            batch_size=int(os.getenv("FACET_ENGINE_BATCH_SIZE", 20000)),
+        )
+
+    @property
+    def loaded(self):
+        return self._store is not None
+
+    async def load(self):
+        """Build a fresh snapshot and swap it in."""
+        if not self.enabled:
+            return
+        start = time.monotonic()
+        store = _Store()
+        store.watermark = (await adb.fetch_one("SELECT MAX(changed_at) AS watermark FROM listings"))["watermark"]
+        async for cols, rows in adb.stream(SNAPSHOT_QUERY, batch_size=self.batch_size):
+            store.upsert(cols, rows)
+        store.set_order(await collated(store.facets.values[1:]))
+        self._store = store
+        logger.info(f"Facet engine loaded {store.size} listings in {time.monotonic() - start:.2f}s ({store.nbytes() / 1e6:.1f} MB)")
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback: fold in the rows scraped after our watermark."""
+        store = self._store
+        if not self.enabled:
+            return
+        if store is None or store.watermark is None or time.monotonic() - store.built > self.rebuild_interval:
+            await self.load()
+            return
+        cols, rows = await adb.fetch(SNAPSHOT_QUERY + " WHERE l.changed_at > %s", (reread_from(store.watermark),))
+        new_values = store.new_facet_values(cols, rows)
+        ordered = await collated(store.facets.values[1:] + list(new_values)) if new_values else None
+        if store is not self._store:
+            return
+        # No awaits from here on: requests never see codes without a rank
+        store.upsert(cols, rows)
+        if ordered is not None:
+            store.set_order(ordered)
+        store.watermark = max(store.watermark, watermark)
+        if rows:
+            logger.info(f"Facet engine: {len(rows)} listings updated, {len(new_values)} new values")
+
+    def _pattern_bitmap(self, store, dictionary, column, value):
+        matches = ilike_matcher(value)
+        table = np.zeros(len(dictionary.values), bool)
+        hits = [code for code in store.column_codes[column] if code and matches(dictionary.lowered[code])]
+        table[hits] = True
+        return table[store.codes[column][:store.size]]
+
+    def _equal_bitmap(self, store, dictionary, column, value):
+        code = dictionary.codes.get(value)
+        if code is None:
+            return np.zeros(store.size, bool)
+        return store.codes[column][:store.size] == code
+
+    def _contributor_bitmap(self, store, identifier, kind):
+        if kind in KIND_FILTERS:
+            return self._equal_bitmap(store, store.contributors, kind, identifier)
+        # Same as filters._broad_contributor_filter
+        return (
+            self._pattern_bitmap(store, store.contributors, 'seller', identifier)
+            | self._equal_bitmap(store, store.contributors, 'agency_id', identifier)
+            | self._pattern_bitmap(store, store.contributors, 'agency_name', identifier)
+            | self._equal_bitmap(store, store.contributors, 'seller_id', identifier)
+        )
+
+    def _bitmap(self, store, p, value):
+        if p.kind == 'text':
+            return self._pattern_bitmap(store, store.facets, p.column, str(value))
+        if p.kind == 'eq':
+            return self._equal_bitmap(store, store.facets, p.column, str(value))
+        numbers = store.numbers[p.column][:store.size]
+        if p.kind == 'gte':
+            return numbers >= value
+        if p.kind == 'lte':
+            return numbers <= value
+        if p.kind == 'is_new':
+            return (numbers == 0) | np.isnan(numbers) if value else numbers > 0
+        raise ValueError(f"Unsupported predicate kind {p.kind}")
+
+    def _ordered(self, store, codes):
+        """Facet codes without NULL and '', in collation order."""
+        codes = codes[codes != 0]
+        empty = store.facets.codes.get('')
+        if empty is not None:
+            codes = codes[codes != empty]
+        return codes[np.argsort(store.rank[codes], kind='stable')]
+
+    async def _evaluate(self, current_filters):
+        """
+        (store, bitmap of the listings matching every filter, function giving
+        the bitmap without one filter group), where None means all listings;
+        None when not loaded.
+        """
+        if self._store is None:
+            return None
+        values = dynamic_values(current_filters)
+        kind = None
+        if values.get('seller'):
+            try:
+                kind = await contributor_index.resolve_async(values['seller'])
+            except Exception as e:
+                logger.error(f"Error in contributor detection: {str(e)}")
+        store = self._store
+
+        # Bitmap per filter group, as DYNAMIC_FILTERS.compile would activate them
+        groups = {}
+        contributor = bool(values.get('seller'))
+        for p in DYNAMIC_FILTERS.predicates:
+            if p.kind == 'contributor':
+                bitmap = self._contributor_bitmap(store, values['seller'], kind) if contributor else None
+            else:
+                value = values.get(p.name)
+                if value is None or (p.skip_with_contributor and contributor):
+                    continue
+                bitmap = self._bitmap(store, p, value)
+            if bitmap is not None:
+                groups[p.group] = groups[p.group] & bitmap if p.group in groups else bitmap
+
+        everything = None
+        for bitmap in groups.values():
+            everything = bitmap if everything is None else everything & bitmap
+
+        def excluding(group):
+            if group not in groups:
+                return everything
+            bitmap = None
+            for other, other_bitmap in groups.items():
+                if other != group:
+                    bitmap = other_bitmap if bitmap is None else bitmap & other_bitmap
+            return bitmap
+
+        return store, everything, excluding
+
+    @staticmethod
+    def _select(array, store, bitmap):
+        array = array[:store.size]
+        return array if bitmap is None else array[bitmap]
+
+    def _histogram(self, store, column, bitmap):
+        return np.bincount(self._select(store.codes[column], store, bitmap), minlength=len(store.facets.values))
+
+    def _years(self, store, bitmap):
+        years = self._select(store.numbers['year'], store, bitmap)
+        return years[~np.isnan(years)]
+
+    async def options(self, current_filters: dict):
+        """The /dynamic-filter-options response for `current_filters`, or None when not loaded."""
+        evaluated = await self._evaluate(current_filters)
+        if evaluated is None:
+            return None
+        start = time.monotonic()
+        store, _, excluding = evaluated
+        values = store.facets.values
+
+        def present(column, bitmap):
+            return np.flatnonzero(self._histogram(store, column, bitmap))
+
+        result = {
+            key: [values[c] for c in self._ordered(store, present(column, excluding(group)))]
+            for key, column, group in DYNAMIC_FACETS
+        }
+        years = self._years(store, excluding('year'))
+        result['years'] = list(range(int(years.min()), int(years.max()) + 1)) if years.size and years.min() and years.max() else []
+        bitmap = excluding('location')
+        locations = np.union1d(present('location_city', bitmap), present('location_region', bitmap))
+        result['locations'] = [values[c] for c in self._ordered(store, locations)]
+
+        self.queries += 1
+        self.query_time += time.monotonic() - start
+        return result
+
+    async def counts(self, current_filters: dict):
+        """The /facets response (options with listing counts) for `current_filters`, or None when not loaded."""
+        evaluated = await self._evaluate(current_filters)
+        if evaluated is None:
+            return None
+        start = time.monotonic()
+        store, everything, excluding = evaluated
+        values = store.facets.values
+
+        def listed(histogram):
+            return [{"value": values[c], "count": int(histogram[c])} for c in self._ordered(store, np.flatnonzero(histogram))]
+
+        result = {"total": int(everything.sum()) if everything is not None else store.size}
+        for key, column, group in DYNAMIC_FACETS:
+            result[key] = listed(self._histogram(store, column, excluding(group)))
+        years, year_counts = np.unique(self._years(store, excluding('year')), return_counts=True)
+        result['years'] = [{"value": int(y), "count": int(n)} for y, n in zip(years, year_counts)]
+
+        # Listings whose city or region is the value, counted once
+        bitmap = excluding('location')
+        cities = self._select(store.codes['location_city'], store, bitmap)
+        regions = self._select(store.codes['location_region'], store, bitmap)
+        both = np.bincount(cities[cities == regions], minlength=len(values))
+        result['locations'] = listed(self._histogram(store, 'location_city', bitmap) + self._histogram(store, 'location_region', bitmap) - both)
+
+        self.queries += 1
+        self.query_time += time.monotonic() - start
+        return result
+
+    def stats(self):
+        store = self._store
+        return {
+            "enabled": self.enabled,
+            "loaded": store is not None,
+            "listings": store.size if store else 0,
+            "facet_values": len(store.facets.values) - 1 if store else 0,
+            "contributor_values": len(store.contributors.values) - 1 if store else 0,
+            "memory_mb": round(store.nbytes() / 1e6, 2) if store else 0.0,
+            "watermark": store.watermark.isoformat() if store and store.watermark else None,
+            "age_seconds": round(time.monotonic() - store.built, 1) if store else None,
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_time / self.queries * 1000, 3) if self.queries else 0.0,
+        }
+
+
+facet_engine = FacetEngine.from_env()
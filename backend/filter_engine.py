@@ -0,0 +1,189 @@
+import threading
+from facet_catalog import facet_catalog
+
+
+class Predicate:
+    """
+    One entry of a filter spec: the input value `name` that activates it, the
+    kind of SQL it compiles to, and the `group` it is excluded by (see
+    FilterEngine.compile).
+
+    Kinds:
+      contributor  the resolved contributor filter passed to compile()
+      text         facet text match: `= ANY(canonical values)` or ILIKE
+      text_any     OR of `text` over a list of values
+      eq, gte, lte plain comparisons
+      is_new       `mileage = 0 OR NULL` when true, `mileage > 0` when false
+    """
+
+    __slots__ = ("name", "kind", "column", "group", "skip_with_contributor")
+
+    def __init__(self, name, kind, column=None, group=None, skip_with_contributor=False):
+        self.name = name
+        self.kind = kind
+        self.column = column
+        self.group = group or name
+        self.skip_with_contributor = skip_with_contributor
+
+
+class CompiledFilter:
+    """`sql` is the AND of the active predicates ('' when none); `shape` identifies it."""
+
+    __slots__ = ("shape", "sql", "params")
+
+    def __init__(self, shape, sql, params):
+        self.shape = shape
+        self.sql = sql
+        self.params = params
+
+    @property
+    def where(self):
+        return f"WHERE {self.sql}" if self.sql else ""
+
+
+class FilterEngine:
+    """
+    Compiles filter values against a declarative spec.
+
+    The SQL only depends on the query's shape, i.e. which predicates are active
+    and which variant each compiled to (equality vs ILIKE, the contributor kind,
+    new vs used), so it is built once per shape and reused. Callers get
+    identical SQL text for identical shapes, which lets the statements be
+    prepared server-side.
+    """
+
+    MAX_SHAPES = 4096
+
+    def __init__(self, predicates, prefix="l."):
+        self.predicates = predicates
+        self.prefix = prefix
+        self._by_name = {p.name: p for p in predicates}
+        self._sql = {}
+        self._lock = threading.Lock()
+
+    def compile(self, values, contributor_filter=None, exclude=()):
+        """
+        Compile `values` (predicate name -> value, inactive ones absent) into a
+        CompiledFilter. Predicates whose group is in `exclude` are skipped.
+        """
+        shape, params = [], []
+        for p in self.predicates:
+            if p.group in exclude:
+                continue
+            if p.kind == "contributor":
+                if contributor_filter is not None:
+                    shape.append((p.name, contributor_filter["filter"]))
+                    params.extend(contributor_filter["params"])
+                continue
+            value = values.get(p.name)
+            if value is None or (p.skip_with_contributor and contributor_filter is not None):
+                continue
+            if p.kind == "text":
+                matches = facet_catalog.equality_values(p.column, str(value))
+                shape.append((p.name, matches is not None))
+                params.append(matches if matches is not None else f"%{value}%")
+            elif p.kind == "text_any":
+                variants = []
+                for item in value:
+                    matches = facet_catalog.equality_values(p.column, str(item))
+                    variants.append(matches is not None)
+                    params.append(matches if matches is not None else f"%{item}%")
+                shape.append((p.name, tuple(variants)))
+            elif p.kind == "is_new":
+                shape.append((p.name, bool(value)))
+            else:
+                shape.append((p.name, None))
+                params.append(value)
+        shape = tuple(shape)
+        sql = self._sql.get(shape)
+        if sql is None:
+            sql = " AND ".join(self._fragment(self._by_name[name], variant) for name, variant in shape)
+            with self._lock:
+                if len(self._sql) >= self.MAX_SHAPES:
+                    self._sql.clear()
+                self._sql[shape] = sql
+        return CompiledFilter(shape, sql, params)
+
+    def active_groups(self, compiled):
+        """Groups of the predicates `compiled` applies."""
+        return {self._by_name[name].group for name, _ in compiled.shape}
+
+    def _fragment(self, p, variant):
+        column = f"{self.prefix}{p.column}" if p.column else None
+        if p.kind == "contributor":
+            return f"({variant})"
+        if p.kind == "text":
+            return f"{column} = ANY(%s)" if variant else f"{column} ILIKE %s"
+        if p.kind == "text_any":
+            return "(" + " OR ".join(f"{column} = ANY(%s)" if v else f"{column} ILIKE %s" for v in variant) + ")"
+        if p.kind == "is_new":
+            return f"({column} = 0 OR {column} IS NULL)" if variant else f"{column} > 0"
+        op = {"eq": "=", "gte": ">=", "lte": "<="}[p.kind]
+        return f"{column} {op} %s"
+
+    def stats(self):
+        return {"shapes": len(self._sql)}
+
+
+# /search, /search/count and (without seller_type) the contributor searches
+SEARCH_FILTERS = FilterEngine([
+    Predicate("seller", "contributor"),
+    Predicate("brand", "text", "brand"),
+    Predicate("model", "text", "model"),
+    Predicate("trim", "text", "trim"),
+    Predicate("min_year", "gte", "year"),
+    Predicate("max_year", "lte", "year"),
+    Predicate("min_price", "gte", "price"),
+    Predicate("max_price", "lte", "price"),
+    Predicate("location_city", "text", "location_city"),
+    Predicate("location_region", "text", "location_region"),
+    Predicate("min_mileage", "gte", "mileage"),
+    Predicate("max_mileage", "lte", "mileage"),
+    Predicate("is_new", "is_new", "mileage"),
+    Predicate("fuel_type", "text", "fuel_type"),
+    Predicate("transmission_type", "text", "transmission_type"),
+    Predicate("body_type", "text", "body_type"),
+    Predicate("condition", "text", "condition"),
+    Predicate("color", "text", "color"),
+    Predicate("seller_type", "eq", "seller_type"),
+    Predicate("website", "text", "website"),
+    Predicate("websites", "text_any", "website"),
+    Predicate("min_post_date", "gte", "post_date"),
+    Predicate("max_post_date", "lte", "post_date"),
+])
+
+# /dynamic-filter-options; groups are the `exclude_field` names of each facet
+DYNAMIC_FILTERS = FilterEngine([
+    Predicate("seller", "contributor"),
+    Predicate("seller_type", "eq", "seller_type", skip_with_contributor=True),
+    Predicate("brand", "text", "brand"),
+    Predicate("model", "text", "model"),
+    Predicate("trim", "text", "trim"),
+    Predicate("body_type", "eq", "body_type"),
+    Predicate("transmission_type", "eq", "transmission_type"),
+    Predicate("color", "eq", "color"),
+    Predicate("fuel_type", "eq", "fuel_type"),
+    Predicate("min_year", "gte", "year", group="year"),
+    Predicate("max_year", "lte", "year", group="year"),
+    Predicate("min_price", "gte", "price", group="price"),
+    Predicate("max_price", "lte", "price", group="price"),
+    Predicate("location_city", "text", "location_city", group="location"),
+    Predicate("location_region", "text", "location_region", group="location"),
+    Predicate("is_new", "is_new", "mileage", group="condition"),
+])
+
+
+def search_values(search):
+    """Active filter values of a ListingSearch (None, '' and [] are inactive)."""
+    if search is None:
+        return {}
+    return {k: v for k, v in search.model_dump().items() if v is not None and v != "" and v != []}
+
+
+def dynamic_values(current_filters: dict):
+    """Active filter values of a /dynamic-filter-options body (falsy values are inactive)."""
+    values = {k: v for k, v in current_filters.items() if v or (k == "is_new" and v is not None)}
+    for key, cast in (("min_year", int), ("max_year", int), ("min_price", float), ("max_price", float)):
+        if key in values:
+            values[key] = cast(values[key])
+    return values
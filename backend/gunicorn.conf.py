@@ -0,0 +1,52 @@
+"""
+Production server settings: `gunicorn -c gunicorn.conf.py main:app`
+(run.py does this when APP_ENV=production).
+
+The app is imported once in the master and forked into the workers. Each
+worker opens its own database pools and warms its caches on startup, and only
+reports ready on /health/ready once that is done. SIGTERM drains: the workers
+fail readiness, wait DRAIN_SECONDS, then finish in-flight requests within
+`graceful_timeout`.
+
+Each worker holds up to aiven-pg-pool-max + aiven-pg-async-pool-max database
+connections, so size those for `workers` times the total against the server's
+connection limit.
+"""
+import os
+import math
+
+
+def container_cpus():
+    """CPUs this container may use: the cgroup CPU quota if set, else the affinity mask."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota is -1 when unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 0)) or container_cpus()
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Workers that miss their heartbeat this long are restarted; startup waits at most WARMUP_TIMEOUT_SECONDS
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("KEEPALIVE_SECONDS", 5))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -0,0 +1,161 @@
+import os
+import hashlib
+import logging
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from starlette.datastructures import Headers, MutableHeaders
+from ingest_watch import ingest_watcher
+from response_cache import CLOCK_PREFIXES, response_cache
+from valuation_model import valuation_model
+
+logger = logging.getLogger(__name__)
+
+# Paths that are never conditionally cached: live process state and the docs
+UNCACHED_PREFIXES = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json")
+
+# Responses that also carry the served valuation model's estimate
+MODEL_PREFIXES = ("/valuation",)
+
+
+class ConditionalCache:
+    """
+    HTTP validators for the read endpoints, derived from the data version.
+
+    The data only changes when the scrapers write, and every write is seen by
+    the ingest watcher. What it has published, once every in-memory index has
+    caught up, is the version: a GET's ETag hashes it with the URL (and
+    `release`, so a deploy that changes response shapes invalidates clients),
+    Last-Modified is the newest `listings.changed_at`. A request whose
+    If-None-Match / If-Modified-Since still matches gets a 304 before any query
+    runs. Until the watcher's first poll completes there is no version and
+    responses carry no validators. Responses under CLOCK_PREFIXES also change
+    with the clock, so their version is at least the start of the current
+    `response_cache.clock_ttl` period, and clients may reuse them no longer.
+    Those under MODEL_PREFIXES also change with the valuation model, whose
+    served version is part of their ETag, and they carry no Last-Modified.
+
+    Each worker polls its own watcher, so for up to one poll interval after a
+    write workers can disagree on the version and a client may see the ETag
+    change back and forth. Deletes, which don't touch changed_at, are not
+    seen, like in the other ingest-driven caches; a late row that doesn't move
+    the newest changed_at changes the ETag but not Last-Modified. `max_age` is
+    how long clients may reuse a response without asking.
+    """
+
+    def __init__(self, max_age=0, release=""):
+        self.max_age = max_age
+        self.release = release
+        self.cache_control = f"public, max-age={max_age}, must-revalidate"
+        self.clock_cache_control = f"public, max-age={min(max_age, int(response_cache.clock_ttl))}, must-revalidate"
+        self.not_modified = 0
+        self.validated = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_age=int(os.getenv("HTTP_CACHE_MAX_AGE", 0)),
+            release=os.getenv("APP_RELEASE", ""),
+        )
+
+    def applies(self, scope):
+        return (
+            scope["type"] == "http"
+            and scope["method"] in ("GET", "HEAD")
+            and not scope["path"].startswith(UNCACHED_PREFIXES)
+        )
+
+    @staticmethod
+    def version(scope, watermark):
+        if scope["path"].startswith(CLOCK_PREFIXES):
+            period = response_cache.clock_ttl
+            now = datetime.now(timezone.utc).timestamp()
+            started = datetime.fromtimestamp(now - now % period, timezone.utc).replace(tzinfo=None)
+            return max(watermark, started)
+        return watermark
+
+    def etag(self, scope, watermark, recent):
+        model = valuation_model.version() if scope["path"].startswith(MODEL_PREFIXES) else ""
+        key = f"{self.release}|{watermark.isoformat()}|{recent}|{model}|{scope['path']}?{scope['query_string'].decode('latin-1')}"
+        return f'W/"{hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]}"'
+
+    @staticmethod
+    def last_modified(watermark):
+        # changed_at is stored without a zone, as UTC
+        return format_datetime(watermark.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+    @staticmethod
+    def is_fresh(request_headers, etag, watermark):
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # Weak comparison, and If-None-Match takes precedence over If-Modified-Since
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or etag[2:] in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return watermark.replace(tzinfo=timezone.utc, microsecond=0) <= since
+        return False
+
+    def validators(self, scope, etag, watermark):
+        clock = scope["path"].startswith(CLOCK_PREFIXES)
+        headers = [
+            ("etag", etag),
+            ("cache-control", self.clock_cache_control if clock else self.cache_control),
+        ]
+        # A model swap doesn't move the watermark, so only the ETag can tell
+        if not scope["path"].startswith(MODEL_PREFIXES):
+            headers.insert(1, ("last-modified", self.last_modified(watermark)))
+        return headers
+
+    def stats(self):
+        published = ingest_watcher.published
+        return {
+            "version": published[0].isoformat() if published else None,
+            "max_age": self.max_age,
+            "validated": self.validated,
+            "not_modified": self.not_modified,
+        }
+
+
+conditional_cache = ConditionalCache.from_env()
+
+
+class ConditionalCacheMiddleware:
+    """ASGI middleware applying `conditional_cache` to successful GET/HEAD responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        published = ingest_watcher.published
+        if published is None or not conditional_cache.applies(scope):
+            await self.app(scope, receive, send)
+            return
+        watermark, recent = published
+        watermark = conditional_cache.version(scope, watermark)
+        etag = conditional_cache.etag(scope, watermark, recent)
+        validators = conditional_cache.validators(scope, etag, watermark)
+        if conditional_cache.is_fresh(Headers(scope=scope), etag, watermark):
+            conditional_cache.not_modified += 1
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in validators],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_validators(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                for name, value in validators:
+                    headers[name] = value
+                conditional_cache.validated += 1
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
@@ -0,0 +1,97 @@
+import os
+import asyncio
+import logging
+from datetime import timedelta
+from database_connection_service.async_db import adb
+
+logger = logging.getLogger(__name__)
+
+# A listing's changed_at is assigned when it is written but the row is only
+# visible once committed, so it can appear just below a watermark already
+# read. Refreshes re-read this far back and must be idempotent.
+OVERLAP = timedelta(seconds=float(os.getenv("INGEST_OVERLAP_SECONDS", 10)))
+
+# The newest change, and how many rows changed within OVERLAP of it: a row
+# committing late moves the count even when it doesn't move the maximum
+POLL_QUERY = """
+    WITH latest AS (SELECT MAX(changed_at) AS watermark FROM listings)
+    SELECT watermark, (SELECT COUNT(*) FROM listings WHERE changed_at > watermark - %s) AS recent
+    FROM latest
+"""
+
+
+def reread_from(watermark):
+    """Exclusive lower bound of the rows a refresh from `watermark` reads."""
+    return watermark - OVERLAP
+
+
+class IngestWatcher:
+    """
+    Polls the newest `listings.changed_at` and tells subscribers when the
+    scrapers have written new rows.
+
+    Subscribers are coroutines called as `callback(previous_watermark, watermark)`;
+    rows with `changed_at > reread_from(previous_watermark)` are the ones that
+    may have changed. `previous_watermark` is None on the first poll after
+    startup, and equals `watermark` when only late rows committed.
+
+    `published` is the (watermark, recent) pair every subscriber has finished
+    with; anything deriving a version from the data (HTTP validators) reads it
+    rather than `watermark`, which moves before the callbacks run.
+    """
+
+    def __init__(self, poll_interval=30.0):
+        self.poll_interval = poll_interval
+        self.watermark = None
+        self.recent = None
+        self.published = None
+        self.version = 0
+        self._subscribers = []
+        self._task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(poll_interval=float(os.getenv("INGEST_POLL_SECONDS", 30)))
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    async def poll_once(self):
+        row = await adb.fetch_one(POLL_QUERY, (OVERLAP,))
+        latest, recent = row["watermark"], row["recent"]
+        if latest is None or (latest, recent) == (self.watermark, self.recent):
+            return False
+        previous, self.watermark, self.recent = self.watermark, latest, recent
+        for callback in self._subscribers:
+            try:
+                await callback(previous, latest)
+            except Exception as e:
+                logger.error(f"Ingest subscriber {getattr(callback, '__qualname__', callback)} failed: {str(e)}")
+        self.published = (latest, recent)
+        self.version += 1
+        logger.info(f"Ingest watermark moved to {latest} (version {self.version})")
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"Ingest watermark poll failed: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ingest_watcher = IngestWatcher.from_env()
@@ -0,0 +1,139 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AppLifecycle:
+    """
+    Readiness of this worker process.
+
+    A worker starts out "starting", runs the registered warm-up steps (pools,
+    caches) and only then reports "ready". Required steps that fail are retried
+    every `retry_interval` seconds; optional ones are logged and skipped.
+    Startup waits at most `warmup_timeout` seconds for warm-up, after which the
+    worker serves with readiness failing until the steps finish.
+
+    On SIGTERM the worker turns "draining": readiness fails so the load
+    balancer stops sending it new requests, and `drain_seconds` later the
+    server's own graceful shutdown starts, which stops accepting connections
+    and waits for the requests in flight. Liveness stays up throughout.
+    """
+
+    def __init__(self, warmup_timeout=20.0, retry_interval=10.0, drain_seconds=5.0):
+        self.warmup_timeout = warmup_timeout
+        self.retry_interval = retry_interval
+        self.drain_seconds = drain_seconds
+        self.state = "starting"
+        self.results = {}
+        self._steps = []
+        self._started = time.monotonic()
+        self._ready_after = None
+        self._task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            warmup_timeout=float(os.getenv("WARMUP_TIMEOUT_SECONDS", 20)),
+            retry_interval=float(os.getenv("WARMUP_RETRY_SECONDS", 10)),
+            drain_seconds=float(os.getenv("DRAIN_SECONDS", 5)),
+        )
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def add_step(self, name, fn, required=False):
+        """Register a warm-up step; `fn` is a coroutine function or a blocking callable."""
+        self._steps.append((name, fn, required))
+
+    async def _run_step(self, name, fn):
+        start = time.monotonic()
+        error = None
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                await fn()
+            else:
+                await asyncio.to_thread(fn)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Warm-up step {name} failed: {error}")
+        result = {"ok": error is None, "ms": round((time.monotonic() - start) * 1000, 1)}
+        if error is not None:
+            result["error"] = error
+        self.results[name] = result
+        return error is None
+
+    async def warm_up(self):
+        """Run the steps that haven't succeeded yet; True once every required one has."""
+        ok = True
+        for name, fn, required in self._steps:
+            if self.results.get(name, {}).get("ok"):
+                continue
+            if not await self._run_step(name, fn) and required:
+                ok = False
+        if ok and self.state == "starting":
+            self.state = "ready"
+            self._ready_after = time.monotonic() - self._started
+            logger.info(f"Worker {os.getpid()} ready after {self._ready_after:.2f}s")
+        return ok
+
+    async def _warm_until_ready(self):
+        while self.state == "starting" and not await self.warm_up():
+            await asyncio.sleep(self.retry_interval)
+
+    async def start(self):
+        self._install_drain_handler()
+        self._task = asyncio.get_running_loop().create_task(self._warm_until_ready())
+        await asyncio.wait({self._task}, timeout=self.warmup_timeout)
+        if not self.ready:
+            logger.warning(f"Worker {os.getpid()} serving before warm-up finished; not ready yet")
+
+    def drain(self):
+        if self.state != "draining":
+            self.state = "draining"
+            logger.info(f"Worker {os.getpid()} draining")
+
+    async def stop(self):
+        self.drain()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _install_drain_handler(self):
+        # Wraps the server's SIGTERM handler; signals can only be set from the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+        if not callable(previous):
+            return
+        loop = asyncio.get_running_loop()
+
+        def handle_sigterm(signum, frame):
+            if self.state == "draining":
+                # A second SIGTERM shuts down without waiting out the drain delay
+                previous(signum, frame)
+                return
+            self.drain()
+            loop.call_soon_threadsafe(loop.call_later, self.drain_seconds, previous, signum, frame)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def status(self):
+        return {
+            "status": self.state,
+            "pid": os.getpid(),
+            "ready_after_seconds": round(self._ready_after, 3) if self._ready_after is not None else None,
+            "warmup": self.results,
+        }
+
+
+lifecycle = AppLifecycle.from_env()
@@ -0,0 +1,41 @@
+from decimal import Decimal
+import orjson
+from fastapi.responses import ORJSONResponse
+from database_connection_service.classes_input import Listing, ListingWithDetails
+
+# Response keys, in the order the pydantic models serialize them
+LISTING_FIELDS = tuple(Listing.model_fields)
+LISTING_WITH_DETAILS_FIELDS = tuple(ListingWithDetails.model_fields)
+
+
+def _default(value):
+    # NUMERIC columns (price) arrive as Decimal; the models expose them as float
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def listing_rows(cols, rows, fields=LISTING_FIELDS):
+    """
+    Map cursor rows onto the `Listing` JSON shape without building models.
+    Fields the query didn't select come out as null; extra columns are dropped.
+    """
+    index = {col: i for i, col in enumerate(cols)}
+    picks = [index.get(field) for field in fields]
+    if picks == list(range(len(fields))):
+        return [dict(zip(fields, row)) for row in rows]
+    return [{field: (row[i] if i is not None else None) for field, i in zip(fields, picks)} for row in rows]
+
+
+def listing_row(cols, row, fields=LISTING_FIELDS):
+    return listing_rows(cols, [row], fields)[0]
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    orjson response that also encodes Decimal. datetimes are written as ISO 8601,
+    like the models' validators do. Returning it skips response_model validation.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
@@ -1,6 +1,22 @@
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from database_connection_service.db_connection import get_connection
+from fastapi.responses import JSONResponse
+from database_connection_service.db_connection import get_db, db_pool, execute_prepared
+from database_connection_service.async_db import adb
+from contributor_index import contributor_index
+from contributor_stats import contributor_stats
+from duplicate_groups import duplicate_groups
+from count_service import count_service
+from facet_catalog import facet_catalog, option_values, brand_models, year_range
+from facet_engine import facet_engine, DYNAMIC_FACETS
+from facet_counts import facet_counts
+from price_cube import price_cube
+from comparables import comparables_index
+from valuation_model import valuation_model
+from ingest_watch import ingest_watcher
+from lifecycle import lifecycle
+from http_cache import ConditionalCacheMiddleware, conditional_cache
+from response_cache import ResponseCacheMiddleware, response_cache
 from database_connection_service.classes_input import (
     Listing, ListingSearch,
     DubizzleDetails, ListingSearchResponse,
@@ -10,8 +26,11 @@ from typing import List, Dict, Any
 from datetime import datetime
 import logging
 from routers.analytics import router as analytics_router
-from filters import build_contributor_filter, build_search_filters_for_contributor, build_search_filters, build_dynamic_filter_query
-from utils import format_db_row, fetch_list
+from filter_engine import SEARCH_FILTERS, DYNAMIC_FILTERS
+from filters import build_contributor_filter, build_contributor_filter_async, build_search_filters_for_contributor, build_search_filters, build_dynamic_filter_query
+from utils import fetch_list
+from pagination import order_by_clause, cursor_columns, seek_filter, split_page
+from listing_json import listing_rows, listing_row, FastJSONResponse
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +42,12 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Whole-response cache for search, listings and analytics, invalidated by the scrapers' NOTIFYs
+app.add_middleware(ResponseCacheMiddleware)
+
+# ETag/Last-Modified from the ingest watermark; outside the response cache so 304s skip it, inside CORS so CORS headers also reach them
+app.add_middleware(ConditionalCacheMiddleware)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -30,76 +55,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 def get_order_by_clause(sort_by: str = "post_date_desc"):
-    """Convert sort_by parameter to SQL ORDER BY clause"""
-    sort_mappings = {
-        "post_date_desc": "post_date DESC",
-        "post_date_asc": "post_date ASC",
-        # For Arabic, A-Z is ي to أ (descending), Z-A is أ to ي (ascending)
-        "title_az": "title COLLATE \"ar-x-icu\" DESC NULLS LAST",  # أ to ي (A-Z in Arabic)
-        "title_za": "title COLLATE \"ar-x-icu\" ASC NULLS LAST",   # ي to أ (Z-A in Arabic)
-        "year_desc": "year DESC NULLS LAST",
-        "year_asc": "year ASC NULLS LAST",
-        "verified_seller": "COALESCE(l.seller_type = 'business', false) DESC, post_date DESC",
-        "price_desc": "price DESC NULLS LAST",
-        "price_asc": "price ASC NULLS LAST"
-    }
-    
-    return sort_mappings.get(sort_by, "post_date DESC")
+    """Convert sort_by parameter to SQL ORDER BY clause (see pagination.SORT_KEYS)"""
+    return order_by_clause(sort_by)
+
+def cursor_headers(next_cursor):
+    return {"X-Next-Cursor": next_cursor} if next_cursor else None
 
 # Root endpoint
 @app.get("/", response_model=Dict[str, str])
 def root():
     return {"message": "Welcome to the Markaba API!"}
 
+@app.get("/health/live")
+async def liveness():
+    """The worker process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """200 once pools and caches are warm, 503 while starting up or draining"""
+    return JSONResponse(lifecycle.status(), status_code=200 if lifecycle.ready else 503)
+
+@app.get("/metrics/db-pool")
+def get_db_pool_metrics():
+    """Connection pool usage and checkout wait times"""
+    return {**db_pool.stats(), "async_pool": adb.stats()}
+
+@app.get("/metrics/caches")
+def get_cache_metrics():
+    """Hit/miss counters for the in-process caches"""
+    return {
+        "contributor_index": contributor_index.stats(),
+        "contributor_stats": contributor_stats.stats(),
+        "duplicate_groups": duplicate_groups.stats(),
+        "facet_catalog": facet_catalog.stats(),
+        "facet_engine": facet_engine.stats(),
+        "price_cube": price_cube.stats(),
+        "comparables_index": comparables_index.stats(),
+        "valuation_model": valuation_model.stats(),
+        "search_counts": count_service.stats(),
+        "filter_shapes": {"search": SEARCH_FILTERS.stats(), "dynamic": DYNAMIC_FILTERS.stats()},
+        "http_validators": conditional_cache.stats(),
+        "responses": response_cache.stats(),
+        "ingest_version": ingest_watcher.version,
+    }
+
+@app.on_event("shutdown")
+def close_db_pool():
+    db_pool.close()
+
 # Basic listing endpoints
 @app.get("/listings")
 def get_all_listings(
     limit: int = Query(10, ge=1, le=100),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
+    cursor: str = Query(None, description="Opaque cursor from a previous page (X-Next-Cursor header); overrides offset and page"),
+    exact: bool = Query(False, description="Count every match instead of capping very broad results"),
+    conn=Depends(get_db)
 ):
     if page is not None:
         offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
+    seek_clause, seek_params = ("", [])
+    if cursor:
+        seek_sql, seek_params = seek_filter("ad_id", cursor)
+        seek_clause, offset = f"WHERE {seek_sql} ", 0
     try:
         cur = conn.cursor()
         cur.execute(
             "SELECT ad_id, url, website, title, price, currency, brand, model,trim, year, mileage, mileage_unit, "
             "fuel_type, transmission_type, body_type, condition, color, seller, seller_type, "
-            "location_city, location_region, image_url, number_of_images, post_date "
-            "FROM listings ORDER BY ad_id LIMIT %s OFFSET %s",
-            (limit, offset)
+            "location_city, location_region, image_url, number_of_images, post_date" + cursor_columns("ad_id") + " "
+            "FROM listings l " + seek_clause + "ORDER BY " + order_by_clause("ad_id") + " LIMIT %s OFFSET %s",
+            (*seek_params, limit + 1, offset)
         )
-        rows = cur.fetchall()
         cols = [d[0] for d in cur.description]
-        items = [Listing(**format_db_row(dict(zip(cols, row)))) for row in rows]
-        # Get total count
-        cur.execute("SELECT COUNT(*) FROM listings")
-        total_count = cur.fetchone()[0]
+        rows, next_cursor = split_page(cur.fetchall(), limit, "ad_id")
+        items = listing_rows(cols, rows)
         if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
+            total_count, total_count_exact = count_service.count(cur, "FROM listings l", [], exact=exact)
+            page_num = None if cursor else (offset // limit) + 1 if limit else 1
+            return FastJSONResponse({
                 "items": items,
                 "total_count": total_count,
+                "total_count_exact": total_count_exact,
                 "page": page_num,
-                "items_per_page": limit
-            }
-        return items
+                "items_per_page": limit,
+                "next_cursor": next_cursor
+            }, headers=cursor_headers(next_cursor))
+        return FastJSONResponse(items, headers=cursor_headers(next_cursor))
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/listings/{ad_id}", response_model=Listing)
-def get_listing_by_id(ad_id: str):
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
+def get_listing_by_id(ad_id: str, conn=Depends(get_db)):
     try:
         cur = conn.cursor()
         cur.execute(
@@ -113,10 +167,9 @@ def get_listing_by_id(ad_id: str):
         if not row:
             raise HTTPException(status_code=404, detail=f"Listing {ad_id} not found")
         cols = [d[0] for d in cur.description]
-        return Listing(**format_db_row(dict(zip(cols, row))))
+        return FastJSONResponse(listing_row(cols, row))
     finally:
         cur.close()
-        conn.close()
 
 # Change /search from POST to GET and convert ListingSearch to query parameters
 @app.get("/search")
@@ -147,7 +200,10 @@ def search_listings(
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
     meta: bool = Query(False, description="Include pagination metadata in response"),
-    seller: str = Query(None, description="Seller filter (individual or agency)")
+    seller: str = Query(None, description="Seller filter (individual or agency)"),
+    cursor: str = Query(None, description="Opaque cursor from a previous page (X-Next-Cursor header); overrides offset and page"),
+    exact: bool = Query(False, description="Count every match instead of capping very broad results"),
+    conn=Depends(get_db)
 ):
     if page is not None:
         offset = (page - 1) * limit
@@ -162,9 +218,6 @@ def search_listings(
     elif is_new is not None:
         calculated_is_new = is_new
     
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
     try:
         cur = conn.cursor()
         # Build ListingSearch object from query params
@@ -180,39 +233,43 @@ def search_listings(
             seller=seller
         )
         
-        filters, params = build_search_filters(search)
-        
-        where_clause = " AND ".join(filters) if filters else "1=1"
+        compiled = build_search_filters(search, conn)
+        where_clause, params = compiled.sql or "1=1", compiled.params
+        page_clause, page_params = where_clause, list(params)
+        if cursor:
+            seek_sql, seek_params = seek_filter(search.sort_by, cursor)
+            page_clause, offset = f"{where_clause} AND {seek_sql}", 0
+            page_params.extend(seek_params)
         order_clause = get_order_by_clause(search.sort_by)
         query = (
             "SELECT l.ad_id, l.url, l.website, l.title, l.price, l.currency, l.brand, l.model, l.trim, l.year, l.mileage, l.mileage_unit, "
             "l.fuel_type, l.transmission_type, l.body_type, l.condition, l.color, "
             "l.seller, "
             "l.seller_type, "
-            "l.location_city, l.location_region, l.image_url, l.number_of_images, l.post_date, l.date_scraped "
-            "FROM listings l "
-            "WHERE " + where_clause + " ORDER BY " + order_clause + " LIMIT %s OFFSET %s"
+            "l.location_city, l.location_region, l.image_url, l.number_of_images, l.post_date, l.date_scraped" + cursor_columns(search.sort_by) + " "
+            "FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id "
+            "WHERE " + page_clause + " ORDER BY " + order_clause + " LIMIT %s OFFSET %s"
         )
-        params.extend([limit, offset])
-        cur.execute(query, tuple(params))
-        rows = cur.fetchall()
+        page_params.extend([limit + 1, offset])
+        execute_prepared(cur, query, page_params)
         cols = [d[0] for d in cur.description]
-        items = [Listing(**format_db_row(dict(zip(cols, row)))) for row in rows]
-        # Get total count
-        cur.execute(f"SELECT COUNT(*) FROM listings l WHERE {where_clause}", tuple(params[:-2]))
-        total_count = cur.fetchone()[0]
+        rows, next_cursor = split_page(cur.fetchall(), limit, search.sort_by)
+        items = listing_rows(cols, rows)
         if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
+            total_count, total_count_exact = count_service.count(
+                cur, f"FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id WHERE {where_clause}", params, exact=exact)
+            page_num = None if cursor else (offset // limit) + 1 if limit else 1
+            return FastJSONResponse({
                 "items": items,
                 "total_count": total_count,
+                "total_count_exact": total_count_exact,
                 "page": page_num,
-                "items_per_page": limit
-            }
-        return items
+                "items_per_page": limit,
+                "next_cursor": next_cursor
+            }, headers=cursor_headers(next_cursor))
+        return FastJSONResponse(items, headers=cursor_headers(next_cursor))
     finally:
         cur.close()
-        conn.close()
 
 # Change /search/count from POST to GET and convert ListingSearch to query parameters
 @app.get("/search/count")
@@ -238,7 +295,9 @@ def count_search_listings(
     location_region: str = Query(None),
     website: str = Query(None),
     sort_by: str = Query("post_date_desc"),
-    seller: str = Query(None)
+    seller: str = Query(None),
+    exact: bool = Query(False, description="Count every match instead of capping very broad results"),
+    conn=Depends(get_db)
 ):
     # Convert new mileage parameter to is_new for compatibility
     calculated_is_new = None
@@ -250,9 +309,6 @@ def count_search_listings(
     elif is_new is not None:
         calculated_is_new = is_new
     
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
     try:
         cur = conn.cursor()
         search = ListingSearch(
@@ -266,15 +322,13 @@ def count_search_listings(
             location_region=location_region, website=website, sort_by=sort_by,
             seller=seller
         )
-        filters, params = build_search_filters(search)
-        where_clause = " AND ".join(filters) if filters else "1=1"
-        query = f"SELECT COUNT(*) FROM listings l WHERE {where_clause}"
-        cur.execute(query, tuple(params))
-        total = cur.fetchone()[0]
-        return {"total": total}
+        compiled = build_search_filters(search, conn)
+        where_clause, params = compiled.sql or "1=1", compiled.params
+        total, total_exact = count_service.count(
+            cur, f"FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id WHERE {where_clause}", params, exact=exact)
+        return {"total": total, "exact": total_exact}
     finally:
         cur.close()
-        conn.close()
 
 # Enhanced Contributor Search Endpoints
 # Change /search/contributor from POST to GET and convert ListingSearch to query parameters
@@ -304,13 +358,13 @@ def search_contributor_listings(
     limit: int = Query(40, ge=1, le=100),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
+    cursor: str = Query(None, description="Opaque cursor from a previous page (X-Next-Cursor header); overrides offset and page"),
+    exact: bool = Query(False, description="Count every match instead of capping very broad results"),
+    conn=Depends(get_db)
 ):
     if page is not None:
         offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
     try:
         cur = conn.cursor()
         search = ListingSearch(
@@ -323,42 +377,47 @@ def search_contributor_listings(
             seller_type=seller_type, location_city=location_city,
             location_region=location_region, website=website, sort_by=sort_by
         ) if any([brand, model, trim, year, min_price, max_price, min_year, max_year, min_mileage, max_mileage, fuel_type, transmission_type, body_type, condition, color, seller_type, location_city, location_region, website, sort_by]) else None
-        contributor_filter = build_contributor_filter(seller_identifier)
-        additional_filters, additional_params = build_search_filters_for_contributor(search) if search else ([], [])
-        all_filters = [contributor_filter["filter"]] + additional_filters
-        all_params = contributor_filter["params"] + additional_params
-        where_clause = " AND ".join(all_filters)
+        contributor_filter = build_contributor_filter(seller_identifier, conn)
+        compiled = build_search_filters_for_contributor(search, contributor_filter)
+        where_clause, all_params = compiled.sql, compiled.params
+        page_clause, page_params = where_clause, list(all_params)
+        if cursor:
+            seek_sql, seek_params = seek_filter(sort_by, cursor)
+            page_clause, offset = f"{where_clause} AND {seek_sql}", 0
+            page_params.extend(seek_params)
         order_clause = get_order_by_clause(sort_by)
         query = (
             "SELECT l.ad_id, l.url, l.website, l.title, l.price, l.currency, l.brand, l.model, l.trim, l.year, l.mileage, l.mileage_unit, "
             "l.fuel_type, l.transmission_type, l.body_type, l.condition, l.color, l.seller, l.seller_type, "
-            "l.location_city, l.location_region, l.image_url, l.number_of_images, l.post_date "
-            "FROM listings l "
-            "WHERE " + where_clause + " ORDER BY " + order_clause + " LIMIT %s OFFSET %s"
+            "l.location_city, l.location_region, l.image_url, l.number_of_images, l.post_date" + cursor_columns(sort_by) + " "
+            "FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id "
+            "WHERE " + page_clause + " ORDER BY " + order_clause + " LIMIT %s OFFSET %s"
         )
-        all_params.extend([limit, offset])
-        cur.execute(query, tuple(all_params))
-        rows = cur.fetchall()
+        page_params.extend([limit + 1, offset])
+        execute_prepared(cur, query, page_params)
         cols = [d[0] for d in cur.description]
-        items = [Listing(**format_db_row(dict(zip(cols, row)))) for row in rows]
-        # Get total count
-        cur.execute(f"SELECT COUNT(*) FROM listings l WHERE {where_clause}", tuple(all_params[:-2]))
-        total_count = cur.fetchone()[0]
+        rows, next_cursor = split_page(cur.fetchall(), limit, sort_by)
+        items = listing_rows(cols, rows)
         if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
+            total_count, total_count_exact = count_service.count(
+                cur, f"FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id WHERE {where_clause}", all_params, exact=exact)
+            page_num = None if cursor else (offset // limit) + 1 if limit else 1
+            return FastJSONResponse({
                 "items": items,
                 "total_count": total_count,
+                "total_count_exact": total_count_exact,
                 "page": page_num,
-                "items_per_page": limit
-            }
-        return items
+                "items_per_page": limit,
+                "next_cursor": next_cursor
+            }, headers=cursor_headers(next_cursor))
+        return FastJSONResponse(items, headers=cursor_headers(next_cursor))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in contributor search: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to search contributor listings: {str(e)}")
     finally:
         cur.close()
-        conn.close()
 
 # Change /search/contributor/count from POST to GET and convert ListingSearch to query parameters
 @app.get("/search/contributor/count")
@@ -383,12 +442,12 @@ def count_contributor_listings_with_filters(
     location_city: str = Query(None),
     location_region: str = Query(None),
     website: str = Query(None),
-    sort_by: str = Query("post_date_desc")
+    sort_by: str = Query("post_date_desc"),
+    exact: bool = Query(False, description="Count every match instead of capping very broad results"),
+    conn=Depends(get_db)
 ):
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
     try:
+        cur = conn.cursor()
         search = ListingSearch(
             brand=brand, model=model, trim=trim, year=year,
             min_price=min_price, max_price=max_price,
@@ -399,23 +458,17 @@ def count_contributor_listings_with_filters(
             seller_type=seller_type, location_city=location_city,
             location_region=location_region, website=website, sort_by=sort_by
         ) if any([brand, model, trim, year, min_price, max_price, min_year, max_year, min_mileage, max_mileage, fuel_type, transmission_type, body_type, condition, color, seller_type, location_city, location_region, website, sort_by]) else None
-        contributor_filter = build_contributor_filter(seller_identifier)
-        additional_filters, additional_params = build_search_filters_for_contributor(search) if search else ([], [])
-        all_filters = [contributor_filter["filter"]] + additional_filters
-        all_params = contributor_filter["params"] + additional_params
-        where_clause = " AND ".join(all_filters)
-        query = f"SELECT COUNT(*) FROM listings l WHERE {where_clause}"
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(query, tuple(all_params))
-        total = cur.fetchone()[0]
-        return {"total": total}
+        contributor_filter = build_contributor_filter(seller_identifier, conn)
+        compiled = build_search_filters_for_contributor(search, contributor_filter)
+        where_clause, all_params = compiled.sql, compiled.params
+        total, total_exact = count_service.count(
+            cur, f"FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id WHERE {where_clause}", all_params, exact=exact)
+        return {"total": total, "exact": total_exact}
     except Exception as e:
         logger.error(f"Error counting contributor listings with filters: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to count contributor listings: {str(e)}")
     finally:
         cur.close()
-        conn.close()
 
 # Filter option endpoints
 # Helper for paginated meta response
@@ -429,113 +482,54 @@ def paginated_meta_response(items, total_count, limit, offset):
         "items_per_page": limit
     }
 
+def paginated_list(results, limit, offset, page, meta):
+    """One page of a fully materialized option list, optionally with pagination metadata"""
+    if page is not None:
+        offset = (page - 1) * limit
+    items = results[offset:offset+limit]
+    if meta:
+        return paginated_meta_response(items, len(results), limit, offset)
+    return items
+
 @app.get("/makes")
-def get_all_makes(
+async def get_all_makes(
     limit: int = Query(200, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT brand FROM listings WHERE brand IS NOT NULL AND brand <> '' ORDER BY brand")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("brand"), limit, offset, page, meta)
 
 @app.get("/models")
-def get_all_models(
+async def get_all_models(
     limit: int = Query(200, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT model FROM listings WHERE model IS NOT NULL AND model <> '' ORDER BY model")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("model"), limit, offset, page, meta)
 
 @app.get("/models/{brand}")
-def get_models_by_brand(brand: str,
+async def get_models_by_brand(brand: str,
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT DISTINCT model FROM listings WHERE brand ILIKE %s AND model IS NOT NULL AND model <> '' ORDER BY model",
-            (f"%{brand}%",)
-        )
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await brand_models(brand), limit, offset, page, meta)
 
 @app.get("/trims/{brand}/{model}")
 def get_trims_by_brand_model(brand: str, model: str, seller: str = Query(None, description="Filter trims by seller/agency"),
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
+    conn=Depends(get_db)
 ):
     if page is not None:
         offset = (page - 1) * limit
     if seller:
-        contributor_filter = build_contributor_filter(seller)
+        contributor_filter = build_contributor_filter(seller, conn)
         query = f"""
             SELECT DISTINCT l.trim 
             FROM listings l
@@ -545,9 +539,9 @@ def get_trims_by_brand_model(brand: str, model: str, seller: str = Query(None, d
             ORDER BY l.trim
         """
         params = [f"%{brand}%", f"%{model}%"] + contributor_filter['params']
-        results = fetch_list(query, params)
+        results = fetch_list(conn, query, params)
     else:
-        results = fetch_list(
+        results = fetch_list(conn, 
             "SELECT DISTINCT trim FROM listings WHERE brand ILIKE %s AND model ILIKE %s AND trim IS NOT NULL AND trim <> '' ORDER BY trim",
             (f"%{brand}%", f"%{model}%")
         )
@@ -564,41 +558,20 @@ def get_trims_by_brand_model(brand: str, model: str, seller: str = Query(None, d
     return items
 
 @app.get("/years")
-def get_year_range(
+async def get_year_range(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT MIN(year), MAX(year) FROM listings WHERE year IS NOT NULL")
-        min_year, max_year = cur.fetchone()
-        all_years = list(range(min_year, max_year + 1))
-        total_count = len(all_years)
-        items = all_years[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    min_year, max_year = await year_range()
+    all_years = list(range(min_year, max_year + 1)) if min_year is not None else []
+    return paginated_list(all_years, limit, offset, page, meta)
 
 @app.get("/years/{brand}/{model}", response_model=List[int])
-def get_years_by_brand_model(brand: str, model: str):
+def get_years_by_brand_model(brand: str, model: str, conn=Depends(get_db)):
     # Select all distinct years for the given brand and model, case-insensitive and trimmed
-    result = fetch_list(
+    result = fetch_list(conn, 
         "SELECT DISTINCT year FROM listings WHERE LOWER(TRIM(brand)) = LOWER(TRIM(%s)) AND LOWER(TRIM(model)) = LOWER(TRIM(%s)) AND year IS NOT NULL ORDER BY year DESC",
         [brand.strip(), model.strip()]
     )
@@ -607,237 +580,77 @@ def get_years_by_brand_model(brand: str, model: str):
     return years
 
 @app.get("/locations")
-def get_all_locations(
+async def get_all_locations(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT DISTINCT location_city FROM listings WHERE location_city IS NOT NULL AND location_city <> '' "
-            "UNION SELECT DISTINCT location_region FROM listings WHERE location_region IS NOT NULL AND location_region <> '' "
-            "ORDER BY 1"
-        )
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("location"), limit, offset, page, meta)
 
 @app.get("/fuel-types")
-def get_fuel_types(
+async def get_fuel_types(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT fuel_type FROM listings WHERE fuel_type IS NOT NULL AND fuel_type <> '' ORDER BY fuel_type")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("fuel_type"), limit, offset, page, meta)
 
 @app.get("/body-types")
-def get_body_types(
+async def get_body_types(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT body_type FROM listings WHERE body_type IS NOT NULL AND body_type <> '' ORDER BY body_type")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("body_type"), limit, offset, page, meta)
 
 @app.get("/transmission-types")
-def get_transmission_types(
+async def get_transmission_types(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT transmission_type FROM listings WHERE transmission_type IS NOT NULL AND transmission_type <> '' ORDER BY transmission_type")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("transmission_type"), limit, offset, page, meta)
 
 @app.get("/conditions")
-def get_conditions(
+async def get_conditions(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT condition FROM listings WHERE condition IS NOT NULL AND condition <> '' ORDER BY condition")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("condition"), limit, offset, page, meta)
 
 @app.get("/colors")
-def get_colors(
+async def get_colors(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT color FROM listings WHERE color IS NOT NULL AND color <> '' ORDER BY color")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("color"), limit, offset, page, meta)
 
 @app.get("/seller-types")
-def get_seller_types(
+async def get_seller_types(
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT DISTINCT seller_type FROM listings WHERE seller_type IS NOT NULL AND seller_type <> '' ORDER BY seller_type")
-        results = [row[0] for row in cur.fetchall()]
-        total_count = len(results)
-        items = results[offset:offset+limit]
-        if meta:
-            page_num = (offset // limit) + 1 if limit else 1
-            return {
-                "items": items,
-                "total_count": total_count,
-                "page": page_num,
-                "items_per_page": limit
-            }
-        return items
-    finally:
-        cur.close()
-        conn.close()
+    return paginated_list(await option_values("seller_type"), limit, offset, page, meta)
 
 @app.get("/websites")
-def get_websites(seller: str = Query(None, description="Filter websites by seller/agency"),
+async def get_websites(seller: str = Query(None, description="Filter websites by seller/agency"),
     limit: int = Query(100, ge=1),
     offset: int = Query(0, ge=0, description="Number of items to skip (overridden by page if provided)"),
     page: int = Query(None, ge=1, description="Page number (1-based, overrides offset if provided)"),
-    meta: bool = Query(False, description="Include pagination metadata in response")
+    meta: bool = Query(False, description="Include pagination metadata in response"),
 ):
-    if page is not None:
-        offset = (page - 1) * limit
     if seller:
-        contributor_filter = build_contributor_filter(seller)
+        contributor_filter = await build_contributor_filter_async(seller)
         query = f"""
             SELECT DISTINCT l.website 
             FROM listings l
@@ -846,87 +659,32 @@ def get_websites(seller: str = Query(None, description="Filter websites by selle
             AND ({contributor_filter['filter']})
             ORDER BY l.website
         """
-        results = fetch_list(query, contributor_filter['params'])
+        results = await adb.fetch_column(query, contributor_filter['params'])
     else:
-        results = fetch_list("SELECT DISTINCT website FROM listings WHERE website IS NOT NULL AND website <> '' ORDER BY website")
-    total_count = len(results)
-    items = results[offset:offset+limit]
-    if meta:
-        page_num = (offset // limit) + 1 if limit else 1
-        return {
-            "items": items,
-            "total_count": total_count,
-            "page": page_num,
-            "items_per_page": limit
-        }
-    return items
+        results = await option_values("website")
+    return paginated_list(results, limit, offset, page, meta)
 
 @app.get("/filter-options", response_model=Dict[str, Any])
-def get_all_filter_options():
-    """Get all filter options for the frontend in a single call"""
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    try:
-        cur = conn.cursor()
-        filter_options = {}
-        
-        # Get brands
-        cur.execute("SELECT DISTINCT brand FROM listings WHERE brand IS NOT NULL AND brand <> '' ORDER BY brand")
-        filter_options["brands"] = [row[0] for row in cur.fetchall()]
-        
-        # Get years
-        cur.execute("SELECT MIN(year), MAX(year) FROM listings WHERE year IS NOT NULL")
-        min_year, max_year = cur.fetchone()
-        filter_options["years"] = list(range(min_year, max_year + 1))
-        
-        # Get cities
-        cur.execute("SELECT DISTINCT location_city FROM listings WHERE location_city IS NOT NULL AND location_city <> '' ORDER BY location_city")
-        filter_options["cities"] = [row[0] for row in cur.fetchall()]
-        
-        # Get regions
-        cur.execute("SELECT DISTINCT location_region FROM listings WHERE location_region IS NOT NULL AND location_region <> '' ORDER BY location_region")
-        filter_options["regions"] = [row[0] for row in cur.fetchall()]
-        
-        # Get fuel types
-        cur.execute("SELECT DISTINCT fuel_type FROM listings WHERE fuel_type IS NOT NULL AND fuel_type <> '' ORDER BY fuel_type")
-        filter_options["fuel_types"] = [row[0] for row in cur.fetchall()]
-        
-        # Get body types
-        cur.execute("SELECT DISTINCT body_type FROM listings WHERE body_type IS NOT NULL AND body_type <> '' ORDER BY body_type")
-        filter_options["body_types"] = [row[0] for row in cur.fetchall()]
-        
-        # Get transmission types
-        cur.execute("SELECT DISTINCT transmission_type FROM listings WHERE transmission_type IS NOT NULL AND transmission_type <> '' ORDER BY transmission_type")
-        filter_options["transmission_types"] = [row[0] for row in cur.fetchall()]
-        
-        # Get conditions
-        cur.execute("SELECT DISTINCT condition FROM listings WHERE condition IS NOT NULL AND condition <> '' ORDER BY condition")
-        filter_options["conditions"] = [row[0] for row in cur.fetchall()]
-        
-        # Get colors
-        cur.execute("SELECT DISTINCT color FROM listings WHERE color IS NOT NULL AND color <> '' ORDER BY color")
-        filter_options["colors"] = [row[0] for row in cur.fetchall()]
-        
-        # Get seller types
-        cur.execute("SELECT DISTINCT seller_type FROM listings WHERE seller_type IS NOT NULL AND seller_type <> '' ORDER BY seller_type")
-        filter_options["seller_types"] = [row[0] for row in cur.fetchall()]
-        
-        # Get websites
-        cur.execute("SELECT DISTINCT website FROM listings WHERE website IS NOT NULL AND website <> '' ORDER BY website")
-        filter_options["websites"] = [row[0] for row in cur.fetchall()]
-        
-        return filter_options
-    finally:
-        cur.close()
-        conn.close()
+async def get_all_filter_options():
+    """Get all filter options for the frontend in a single call (served from the facet catalog)"""
+    min_year, max_year = await year_range()
+    return {
+        "brands": await option_values("brand"),
+        "years": list(range(min_year, max_year + 1)) if min_year is not None else [],
+        "cities": await option_values("location_city"),
+        "regions": await option_values("location_region"),
+        "fuel_types": await option_values("fuel_type"),
+        "body_types": await option_values("body_type"),
+        "transmission_types": await option_values("transmission_type"),
+        "conditions": await option_values("condition"),
+        "colors": await option_values("color"),
+        "seller_types": await option_values("seller_type"),
+        "websites": await option_values("website"),
+    }
 
 # Dubizzle details endpoints
 @app.get("/details/{ad_id}", response_model=DubizzleDetails)
-def get_details_by_ad_id(ad_id: str):
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
+def get_details_by_ad_id(ad_id: str, conn=Depends(get_db)):
     try:
         cur = conn.cursor()
         cur.execute(
@@ -943,183 +701,177 @@ def get_details_by_ad_id(ad_id: str):
         return DubizzleDetails(**dict(zip(cols, row)))
     finally:
         cur.close()
-        conn.close()
+
+# (response key, listings column, field excluded from the current filters)
+def _and_where(where_clause: str, condition: str) -> str:
+    return f"{where_clause} AND {condition}" if where_clause else f"WHERE {condition}"
 
 @app.post("/dynamic-filter-options")
-def get_dynamic_filter_options(current_filters: dict):
+async def get_dynamic_filter_options(current_filters: dict):
     """
     Get filter options that are available based on current filter selections.
     This ensures cascading filters - e.g., if you select Body Type "Pickup", 
     you only see makes that actually have pickup trucks available.
+    Answered by the in-process facet engine; until it has loaded, the facet
+    queries run concurrently on the async pool.
     """
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
-    
     try:
-        cur = conn.cursor()
-        result = {}
-        
-        # Get available makes based on current filters (excluding make filter)
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='brand')
-        query = f"""
-            SELECT DISTINCT l.brand 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.brand IS NOT NULL AND l.brand <> ''
-            ORDER BY l.brand
-        """
-        cur.execute(query, params)
-        result['makes'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available models based on current filters (excluding model filter)
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='model')
-        query = f"""
-            SELECT DISTINCT l.model 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.model IS NOT NULL AND l.model <> ''
-            ORDER BY l.model
-        """
-        cur.execute(query, params)
-        result['models'] = [row[0] for row in cur.fetchall()]
+        result = await facet_engine.options(current_filters)
+        if result is not None:
+            return result
+        return await query_dynamic_filter_options(current_filters)
 
-        # Get available trims based on current filters (excluding trim filter)
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='trim')
-        query = f"""
-            SELECT DISTINCT l.trim 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.trim IS NOT NULL AND l.trim <> ''
-            ORDER BY l.trim
-        """
-        cur.execute(query, params)
-        result['trims'] = [row[0] for row in cur.fetchall()]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting dynamic filter options: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get dynamic filter options: {str(e)}")
 
-        # Get available body types based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='body_type')
-        query = f"""
-            SELECT DISTINCT l.body_type 
+async def query_dynamic_filter_options(current_filters: dict):
+    """/dynamic-filter-options computed by the database, one query per facet."""
+    contributor_filter = None
+    if current_filters.get('seller'):
+        contributor_filter = await build_contributor_filter_async(current_filters['seller'])
+
+    queries = []
+    for _, column, exclude_field in DYNAMIC_FACETS:
+        where_clause, params = build_dynamic_filter_query(current_filters, contributor_filter, exclude_field=exclude_field)
+        queries.append(adb.fetch_column(f"""
+            SELECT DISTINCT l.{column}
             FROM listings l
             LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.body_type IS NOT NULL AND l.body_type <> ''
-            ORDER BY l.body_type
-        """
-        cur.execute(query, params)
-        result['bodyTypes'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available transmission types based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='transmission_type')
-        query = f"""
-            SELECT DISTINCT l.transmission_type 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.transmission_type IS NOT NULL AND l.transmission_type <> ''
-            ORDER BY l.transmission_type
-        """
-        cur.execute(query, params)
-        result['transmissionTypes'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available colors based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='color')
-        query = f"""
-            SELECT DISTINCT l.color 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.color IS NOT NULL AND l.color <> ''
-            ORDER BY l.color
-        """
-        cur.execute(query, params)
-        result['colors'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available fuel types based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='fuel_type')
-        query = f"""
-            SELECT DISTINCT l.fuel_type 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.fuel_type IS NOT NULL AND l.fuel_type <> ''
-            ORDER BY l.fuel_type
-        """
-        cur.execute(query, params)
-        result['fuelTypes'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available seller types based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='seller_type')
-        query = f"""
-            SELECT DISTINCT l.seller_type 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.seller_type IS NOT NULL AND l.seller_type <> ''
-            ORDER BY l.seller_type
-        """
-        cur.execute(query, params)
-        result['sellerTypes'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available websites based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='website')
-        query = f"""
-            SELECT DISTINCT l.website 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.website IS NOT NULL AND l.website <> ''
-            ORDER BY l.website
-        """
-        cur.execute(query, params)
-        result['websites'] = [row[0] for row in cur.fetchall()]
-        
-        # Get available years based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='year')
-        query = f"""
-            SELECT MIN(l.year), MAX(l.year) 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.year IS NOT NULL
-        """
-        cur.execute(query, params)
-        min_year, max_year = cur.fetchone()
-        if min_year and max_year:
-            result['years'] = list(range(min_year, max_year + 1))
-        else:
-            result['years'] = []
-        
-        # Get available locations based on current filters
-        where_clause, params = build_dynamic_filter_query(current_filters, exclude_field='location')
-        query = f"""
-            SELECT DISTINCT l.location_city 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.location_city IS NOT NULL AND l.location_city <> ''
-            UNION 
-            SELECT DISTINCT l.location_region 
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            {where_clause}
-            AND l.location_region IS NOT NULL AND l.location_region <> ''
-            ORDER BY 1
-        """
-        params_doubled = params + params  # Union requires params twice
-        cur.execute(query, params_doubled)
-        result['locations'] = [row[0] for row in cur.fetchall()]
-        
-        return result
-        
+            {_and_where(where_clause, f"l.{column} IS NOT NULL AND l.{column} <> ''")}
+            ORDER BY l.{column}
+        """, params, prepare=True))
+
+    # Get available years based on current filters
+    where_clause, params = build_dynamic_filter_query(current_filters, contributor_filter, exclude_field='year')
+    queries.append(adb.fetch(f"""
+        SELECT MIN(l.year), MAX(l.year)
+        FROM listings l
+        LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
+        {_and_where(where_clause, "l.year IS NOT NULL")}
+    """, params, prepare=True))
+
+    # Get available locations based on current filters
+    where_clause, params = build_dynamic_filter_query(current_filters, contributor_filter, exclude_field='location')
+    queries.append(adb.fetch_column(f"""
+        SELECT DISTINCT l.location_city
+        FROM listings l
+        LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
+        {_and_where(where_clause, "l.location_city IS NOT NULL AND l.location_city <> ''")}
+        UNION
+        SELECT DISTINCT l.location_region
+        FROM listings l
+        LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
+        {_and_where(where_clause, "l.location_region IS NOT NULL AND l.location_region <> ''")}
+        ORDER BY 1
+    """, params + params, prepare=True))  # Union requires params twice
+
+    *facet_values, (_, year_rows), locations = await adb.gather(*queries)
+
+    result = {key: values for (key, _, _), values in zip(DYNAMIC_FACETS, facet_values)}
+    min_year, max_year = year_rows[0]
+    if min_year and max_year:
+        result['years'] = list(range(min_year, max_year + 1))
+    else:
+        result['years'] = []
+    result['locations'] = locations
+    return result
+
+@app.post("/facets")
+async def get_facet_counts(current_filters: dict):
+    """
+    Every /dynamic-filter-options facet with the number of listings per option,
+    plus the total matching all filters. Takes the same filter dict; as for the
+    option lists, each facet is counted without its own filter.
+    """
+    try:
+        result = await facet_engine.counts(current_filters)
+        if result is not None:
+            return result
+        contributor_filter = None
+        if current_filters.get('seller'):
+            contributor_filter = await build_contributor_filter_async(current_filters['seller'])
+        return await facet_counts(current_filters, contributor_filter)
+
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error getting dynamic filter options: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to get dynamic filter options: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+        logger.error(f"Error getting facet counts: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get facet counts: {str(e)}")
+
+@app.get("/valuation")
+async def get_valuation(
+    brand: str = Query(...),
+    model: str = Query(...),
+    year: int = Query(..., ge=1900, le=2100),
+    mileage: int = Query(None, ge=0, description="Odometer reading in km"),
+    trim: str = Query(None),
+    city: str = Query(None),
+    k: int = Query(10, ge=1, le=100, description="Number of comparable listings to base the estimate on"),
+):
+    """
+    Estimated fair price and range of a car spec, from its nearest comparable listings.
+    `model_estimate` is the offline-trained segment model's price (train_valuation.py),
+    null when no model covers the brand/model.
+    """
+    try:
+        trim = trim.strip() if trim and trim.strip() else None
+        city = city.strip() if city and city.strip() else None
+        valuation = await comparables_index.value(brand, model, year, mileage, trim, city, k)
+        if valuation is None:
+            raise HTTPException(status_code=404, detail=f"No priced listings found for {brand} {model}")
+        return FastJSONResponse({
+            "brand": brand,
+            "model": model,
+            "trim": trim,
+            "year": year,
+            "mileage": mileage,
+            "city": city,
+            **valuation,
+            "model_estimate": valuation_model.predict(brand, model, year, mileage, trim),
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error valuing {brand} {model} {year}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get valuation: {str(e)}")
+
+# Warm-up before the worker reports ready; a failed optional step only costs the first requests
+lifecycle.add_step("db_pool", db_pool.warm, required=True)
+lifecycle.add_step("async_pool", adb.warm, required=True)
+# Serves the static filter options; until it loads they are queried and text filters use ILIKE
+lifecycle.add_step("facet_catalog", facet_catalog.load)
+# Serves /dynamic-filter-options; until it loads the endpoint queries the database
+lifecycle.add_step("facet_engine", facet_engine.load)
+# Serves /api/analytics/depreciation; until it loads the yearly statistics are queried
+lifecycle.add_step("price_cube", price_cube.load)
+# Serves /valuation; until it loads each valuation reads its brand/model from the database
+lifecycle.add_step("comparables_index", comparables_index.load)
+
+@app.on_event("startup")
+async def open_async_db():
+    await adb.open()
+    ingest_watcher.subscribe(contributor_index.refresh_since)
+    ingest_watcher.subscribe(facet_catalog.refresh_since)
+    ingest_watcher.subscribe(facet_engine.refresh_since)
+    ingest_watcher.subscribe(count_service.on_ingest)
+    ingest_watcher.subscribe(contributor_stats.refresh_since)
+    ingest_watcher.subscribe(duplicate_groups.refresh_since)
+    ingest_watcher.subscribe(price_cube.refresh_since)
+    ingest_watcher.subscribe(comparables_index.refresh_since)
+    # Last, so responses derived from the refreshed tables are dropped after them
+    ingest_watcher.subscribe(response_cache.on_ingest)
+    response_cache.start()
+    await lifecycle.start()
+    ingest_watcher.start()
+
+@app.on_event("shutdown")
+async def close_async_db():
+    await lifecycle.stop()
+    await ingest_watcher.stop()
+    await response_cache.stop()
+    await adb.close()
 
 app.include_router(analytics_router)
@@ -0,0 +1,74 @@
+"""
+Apply the SQL files in migrations/ that haven't been applied yet, in name order.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --list     # show applied / pending
+
+Statements run one at a time in autocommit mode so `CREATE INDEX CONCURRENTLY`
+works; each statement in a migration file must end with `;` at the end of a line.
+"""
+import os
+import sys
+import logging
+from database_connection_service.db_connection import get_connection
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def split_statements(sql):
+    statements, current = [], []
+    for line in sql.splitlines():
+        if line.strip().startswith("--") and not current:
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("\n".join(current).strip())
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def pending_migrations(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          name       TEXT PRIMARY KEY,
+          applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT name FROM schema_migrations")
+    applied = {row[0] for row in cur.fetchall()}
+    names = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql"))
+    return applied, [n for n in names if n not in applied]
+
+
+def main(argv):
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    try:
+        with conn.cursor() as cur:
+            applied, pending = pending_migrations(cur)
+            if "--list" in argv:
+                for name in sorted(applied):
+                    print(f"applied  {name}")
+                for name in pending:
+                    print(f"pending  {name}")
+                return
+            for name in pending:
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                    statements = split_statements(f.read())
+                logger.info(f"Applying {name} ({len(statements)} statements)")
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            logger.info(f"{len(pending)} migration(s) applied")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,17 @@
+-- Point lookups behind the contributor index (contributor_index.RESOLVE_KIND_QUERY)
+-- and the ingest watermark (MAX(date_scraped) / date_scraped > watermark).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dubizzle_details_agency_id
+    ON dubizzle_details (agency_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dubizzle_details_agency_name
+    ON dubizzle_details (agency_name);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dubizzle_details_seller_id
+    ON dubizzle_details (seller_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_seller
+    ON listings (seller);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_date_scraped
+    ON listings (date_scraped);
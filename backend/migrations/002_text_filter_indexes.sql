@@ -0,0 +1,28 @@
+-- Text facet filters (filter_engine): canonical values are matched
+-- with `column = ANY(...)` (B-tree), partial input with `ILIKE '%...%'` (trigram).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_brand_model_trim
+    ON listings (brand, model, trim);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_model
+    ON listings (model);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_location_city
+    ON listings (location_city);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_location_region
+    ON listings (location_region);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_brand_trgm
+    ON listings USING gin (brand gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_model_trgm
+    ON listings USING gin (model gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_trim_trgm
+    ON listings USING gin (trim gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_location_city_trgm
+    ON listings USING gin (location_city gin_trgm_ops);
@@ -0,0 +1,25 @@
+-- Keyset pagination (pagination.SORT_KEYS): one index per sort mode on the exact
+-- ORDER BY expressions with ad_id as the tie-breaker, so a cursor seek is an
+-- index range scan. ASC/DESC pairs on the same expression share an index
+-- (scanned backwards); /listings uses the primary key.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_post_date
+    ON listings ((COALESCE(post_date, 'infinity')), ad_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_verified_seller
+    ON listings ((COALESCE(seller_type = 'business', false)), (COALESCE(post_date, 'infinity')), ad_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_price_desc
+    ON listings ((COALESCE(price, '-Infinity'::numeric)), ad_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_price_asc
+    ON listings ((COALESCE(price, 'Infinity'::numeric)), ad_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_year_desc
+    ON listings ((COALESCE(year, -2147483648)), ad_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_year_asc
+    ON listings ((COALESCE(year, 2147483647)), ad_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_sort_title
+    ON listings ((title COLLATE "ar-x-icu"), ad_id);
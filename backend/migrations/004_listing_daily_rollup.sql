@@ -0,0 +1,20 @@
+-- Per website and post day: listing count and price sums, so the analytics
+-- stats read a few rollup rows instead of counting `listings`. The scraper
+-- pipelines apply each upsert's delta in the same statement; `day` is
+-- '-infinity' for listings without a post_date. Filled here once, repaired
+-- with `python daily_rollup.py`.
+
+CREATE TABLE IF NOT EXISTS listing_daily_rollup (
+  website    TEXT    NOT NULL,
+  day        DATE    NOT NULL,
+  listings   BIGINT  NOT NULL DEFAULT 0,
+  priced     BIGINT  NOT NULL DEFAULT 0,
+  price_sum  NUMERIC NOT NULL DEFAULT 0,
+  PRIMARY KEY (website, day)
+);
+
+INSERT INTO listing_daily_rollup (website, day, listings, priced, price_sum)
+SELECT website, COALESCE(post_date::date, '-infinity'), COUNT(*), COUNT(price), COALESCE(SUM(price), 0)
+FROM listings
+GROUP BY 1, 2
+ON CONFLICT (website, day) DO NOTHING;
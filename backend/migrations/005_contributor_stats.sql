@@ -0,0 +1,45 @@
+-- Leaderboard for /api/analytics/contributors: one row per contributor and
+-- website, keyed like the old GROUP BY with '' for missing parts. `seller` is
+-- '' for agency listings (no usable seller, keyed by the Dubizzle agency).
+-- Kept current by contributor_stats.py from listings scraped after
+-- contributor_stats_state.watermark; `python contributor_stats.py` rebuilds it.
+
+CREATE TABLE IF NOT EXISTS contributor_stats (
+  website          TEXT      NOT NULL,
+  seller           TEXT      NOT NULL,
+  agency_id        TEXT      NOT NULL,
+  agency_name      TEXT      NOT NULL,
+  total_listings   BIGINT    NOT NULL,
+  priced           BIGINT    NOT NULL,
+  price_sum        NUMERIC   NOT NULL,
+  first_post_date  TIMESTAMP,
+  last_post_date   TIMESTAMP,
+  PRIMARY KEY (website, seller, agency_id, agency_name)
+);
+
+CREATE INDEX IF NOT EXISTS idx_contributor_stats_top
+    ON contributor_stats (total_listings DESC);
+
+CREATE INDEX IF NOT EXISTS idx_contributor_stats_website_top
+    ON contributor_stats (website, total_listings DESC);
+
+CREATE TABLE IF NOT EXISTS contributor_stats_state (
+  id         BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+  watermark  TIMESTAMP
+);
+
+INSERT INTO contributor_stats_state (watermark)
+SELECT MAX(date_scraped) FROM listings
+ON CONFLICT (id) DO NOTHING;
+
+INSERT INTO contributor_stats
+SELECT l.website,
+       CASE WHEN l.seller IS NULL OR l.seller IN ('', 'N/A') THEN '' ELSE l.seller END,
+       COALESCE(dd.agency_id, ''),
+       COALESCE(dd.agency_name, ''),
+       COUNT(*), COUNT(l.price), COALESCE(SUM(l.price), 0), MIN(l.post_date), MAX(l.post_date)
+FROM listings l
+LEFT JOIN dubizzle_details dd ON dd.ad_id = l.ad_id
+WHERE NOT ((l.seller IS NULL OR l.seller IN ('', 'N/A')) AND COALESCE(dd.agency_name, '') = '')
+GROUP BY 1, 2, 3, 4
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,23 @@
+-- Deal scoring (scrapers: DealScoringPipeline): expected_price is the median
+-- price of the listing's brand/model/year segment, deal_score how far below it
+-- the listing is priced, in percent. The pipeline scores listings as they are
+-- scraped; existing rows are scored here once with the same definition
+-- (segments of at least 5 priced listings).
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS expected_price NUMERIC;
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS deal_score NUMERIC;
+
+UPDATE listings l
+SET expected_price = ROUND(s.median::numeric, 2),
+    deal_score = ROUND((100 * (s.median - l.price::float8) / s.median)::numeric, 2)
+FROM (
+    SELECT LOWER(TRIM(brand)) AS brand, LOWER(TRIM(model)) AS model, year,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY price) AS median
+    FROM listings
+    WHERE price > 0 AND brand IS NOT NULL AND model IS NOT NULL AND year IS NOT NULL
+    GROUP BY 1, 2, 3
+    HAVING COUNT(*) >= 5
+) s
+WHERE LOWER(TRIM(l.brand)) = s.brand AND LOWER(TRIM(l.model)) = s.model AND l.year = s.year
+  AND l.price > 0 AND l.expected_price IS NULL;
@@ -0,0 +1,29 @@
+-- Cross-site duplicate detection (duplicate_groups.py). Listings judged to be
+-- the same car share listings.duplicate_group_id, the smallest ad_id in their
+-- group; a listing without duplicates keeps NULL, so
+-- COALESCE(duplicate_group_id, ad_id) counts each car once. listing_minhash
+-- keeps every listing's MinHash signatures and LSH buckets so new listings are
+-- matched without recomputing the old ones. Both are filled by
+-- `python duplicate_groups.py`; until it has run the incremental refresh does
+-- nothing (duplicate_groups_state has no watermark).
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS duplicate_group_id TEXT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_duplicate_group
+    ON listings (duplicate_group_id) WHERE duplicate_group_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS listing_minhash (
+  ad_id                  TEXT     PRIMARY KEY REFERENCES listings(ad_id) ON DELETE CASCADE,
+  signature              BYTEA    NOT NULL,
+  description_signature  BYTEA,
+  buckets                BIGINT[] NOT NULL
+);
+
+-- fastupdate off: probes would otherwise also scan the GIN pending list
+CREATE INDEX IF NOT EXISTS idx_listing_minhash_buckets
+    ON listing_minhash USING GIN (buckets) WITH (fastupdate = off);
+
+CREATE TABLE IF NOT EXISTS duplicate_groups_state (
+  id         BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+  watermark  TIMESTAMP
+);
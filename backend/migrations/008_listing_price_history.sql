@@ -0,0 +1,22 @@
+-- Price history: a row per price a listing has been seen at. The scraper
+-- pipelines write one in the listing's upsert when the price differs from the
+-- stored one, stamped with the scrape's date_scraped. Seeded here with every
+-- listing's current price, so the first change after this has a price to
+-- compare with. Price-drop queries range-scan observed_at and look up the
+-- price before through the primary key.
+
+CREATE TABLE IF NOT EXISTS listing_price_history (
+  ad_id        TEXT      NOT NULL REFERENCES listings(ad_id) ON DELETE CASCADE,
+  observed_at  TIMESTAMP NOT NULL,
+  price        NUMERIC   NOT NULL,
+  PRIMARY KEY (ad_id, observed_at)
+);
+
+INSERT INTO listing_price_history (ad_id, observed_at, price)
+SELECT ad_id, COALESCE(date_scraped, now() AT TIME ZONE 'UTC'), price
+FROM listings
+WHERE price IS NOT NULL
+ON CONFLICT (ad_id, observed_at) DO NOTHING;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listing_price_history_observed_at
+    ON listing_price_history (observed_at);
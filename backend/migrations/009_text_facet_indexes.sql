@@ -0,0 +1,22 @@
+-- B-tree indexes for the text facets 002 left out, so the filter engine's
+-- `column = ANY(...)` on a canonical value (a color, fuel type, website, ...)
+-- is an index scan too. These columns have few distinct values, so partial
+-- input (ILIKE) is left to a sequential scan rather than more trigram indexes.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_fuel_type
+    ON listings (fuel_type);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_transmission_type
+    ON listings (transmission_type);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_body_type
+    ON listings (body_type);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_condition
+    ON listings (condition);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_color
+    ON listings (color);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_website
+    ON listings (website);
@@ -0,0 +1,19 @@
+-- The change feed of the API's incremental refreshes (ingest_watch and every
+-- watermark-driven index). date_scraped is the spider's clock at parse time,
+-- so rows buffered or written by a slower spider can commit below a MAX the
+-- API has already read. changed_at is assigned by the database when the row is
+-- written: on insert through the default, on a real change by the scraper
+-- upsert's `changed_at = DEFAULT`. Existing rows start from date_scraped, so
+-- stored watermarks carry over; a spider clock ahead of the database's is
+-- capped, or the feed would stall until it caught up.
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS changed_at TIMESTAMP;
+
+ALTER TABLE listings ALTER COLUMN changed_at SET DEFAULT (clock_timestamp() AT TIME ZONE 'UTC');
+
+UPDATE listings SET changed_at = LEAST(COALESCE(date_scraped, now() AT TIME ZONE 'UTC'), now() AT TIME ZONE 'UTC') WHERE changed_at IS NULL;
+
+ALTER TABLE listings ALTER COLUMN changed_at SET NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listings_changed_at
+    ON listings (changed_at);
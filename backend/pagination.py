@@ -0,0 +1,128 @@
+import json
+import base64
+import binascii
+from fastapi import HTTPException
+
+# Sort keys per `sort_by` mode, as (SQL expression, type to cast cursor values
+# back to, direction, nullable). Nullable keys are wrapped in COALESCE with a
+# sentinel that puts NULLs where the original ordering did, so they are never
+# NULL and the seek stays a single row comparison the expression indexes in
+# migrations/003 can serve. That is last for most modes, but first for
+# post_date_desc: the original `post_date DESC` is NULLS FIRST, and 'infinity'
+# sorts first descending. Titles have no such sentinel under the Arabic
+# collation and keep NULLs, which costs an extra OR in the seek.
+# `l.ad_id` is appended to every mode as the tie-breaker.
+SORT_KEYS = {
+    "post_date_desc": [("COALESCE(l.post_date, 'infinity')", "timestamp", "DESC", False)],
+    "post_date_asc": [("COALESCE(l.post_date, 'infinity')", "timestamp", "ASC", False)],
+    # For Arabic, A-Z is ي to أ (descending), Z-A is أ to ي (ascending)
+    "title_az": [("l.title COLLATE \"ar-x-icu\"", "text", "DESC", True)],
+    "title_za": [("l.title COLLATE \"ar-x-icu\"", "text", "ASC", True)],
+    "year_desc": [("COALESCE(l.year, -2147483648)", "int", "DESC", False)],
+    "year_asc": [("COALESCE(l.year, 2147483647)", "int", "ASC", False)],
+    "verified_seller": [
+        ("COALESCE(l.seller_type = 'business', false)", "boolean", "DESC", False),
+        ("COALESCE(l.post_date, 'infinity')", "timestamp", "DESC", False),
+    ],
+    "price_desc": [("COALESCE(l.price, '-Infinity'::numeric)", "numeric", "DESC", False)],
+    "price_asc": [("COALESCE(l.price, 'Infinity'::numeric)", "numeric", "ASC", False)],
+    # /listings
+    "ad_id": [],
+}
+
+DEFAULT_SORT = "post_date_desc"
+
+CURSOR_COLUMN_PREFIX = "_cursor_"
+
+
+def sort_keys(sort_by: str):
+    """Resolved sort mode and its keys, tie-breaker included."""
+    if sort_by not in SORT_KEYS:
+        sort_by = DEFAULT_SORT
+    keys = SORT_KEYS[sort_by]
+    direction = keys[-1][2] if keys else "ASC"
+    return sort_by, keys + [("l.ad_id", "text", direction, False)]
+
+
+def order_by_clause(sort_by: str) -> str:
+    """ORDER BY body for `sort_by`; NULLS LAST keys are already non-NULL."""
+    _, keys = sort_keys(sort_by)
+    return ", ".join(
+        f"{expr} {direction}" + (" NULLS LAST" if nullable else "")
+        for expr, _, direction, nullable in keys
+    )
+
+
+def cursor_columns(sort_by: str) -> str:
+    """Extra SELECT columns carrying each row's sort key, exactly, as text."""
+    _, keys = sort_keys(sort_by)
+    return "".join(f", ({expr})::text AS {CURSOR_COLUMN_PREFIX}{i}" for i, (expr, _, _, _) in enumerate(keys))
+
+
+def encode_cursor(sort_by: str, values) -> str:
+    payload = json.dumps({"s": sort_by, "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(sort_by: str, cursor: str):
+    sort_by, keys = sort_keys(sort_by)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = payload["k"]
+        cursor_sort = payload["s"]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort_by or not isinstance(values, list) or len(values) != len(keys):
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sort order")
+    if values[-1] is None or any(v is None for v, key in zip(values, keys) if not key[3]):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return keys, values
+
+
+def _row_comparison(keys, values):
+    op = "<" if keys[0][2] == "DESC" else ">"
+    exprs = ", ".join(expr for expr, _, _, _ in keys)
+    placeholders = ", ".join(f"%s::{cast}" for _, cast, _, _ in keys)
+    return f"({exprs}) {op} ({placeholders})", list(values)
+
+
+def _seek(keys, values):
+    """Predicate selecting the rows that sort after `values`."""
+    expr, cast, direction, nullable = keys[0]
+    value = values[0]
+    tail_uniform = all(k[2] == direction and not k[3] for k in keys[1:])
+    if value is not None and tail_uniform:
+        # Rows with a NULL head fail the row comparison; with NULLS LAST they still come after
+        condition, params = _row_comparison(keys, values)
+        if nullable:
+            condition = f"({condition} OR {expr} IS NULL)"
+        return condition, params
+    op = "<" if direction == "DESC" else ">"
+    rest, rest_params = _seek(keys[1:], values[1:])
+    if value is None:
+        # Only nullable keys can be NULL, and those are NULLS LAST
+        return f"({expr} IS NULL AND {rest})", rest_params
+    condition = f"({expr} {op} %s::{cast} OR ({expr} = %s::{cast} AND {rest})"
+    if nullable:
+        condition += f" OR {expr} IS NULL"
+    return condition + ")", [value, value] + rest_params
+
+
+def seek_filter(sort_by: str, cursor: str):
+    """WHERE condition and params continuing after `cursor` in `sort_by` order."""
+    keys, values = decode_cursor(sort_by, cursor)
+    return _seek(keys, values)
+
+
+def split_page(rows, limit: int, sort_by: str):
+    """
+    Split rows fetched with `LIMIT limit + 1` and cursor_columns() into (the
+    page's rows, cursor for the next page or None). The cursor columns are the
+    trailing columns of each row.
+    """
+    sort_by, keys = sort_keys(sort_by)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort_by, list(rows[-1][-len(keys):]))
+    return rows, next_cursor
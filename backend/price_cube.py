@@ -0,0 +1,293 @@
+import os
+import time
+import logging
+import numpy as np
+from database_connection_service.async_db import adb
+from ingest_watch import reread_from
+from facet_engine import Dictionary, ilike_matcher
+
+logger = logging.getLogger(__name__)
+
+# Segment dimensions besides year; each is dictionary-encoded
+TEXT_DIMENSIONS = ['brand', 'model', 'trim', 'website']
+
+# Log-spaced price bins shared by every cell; prices outside are counted in the end bins
+PRICE_EDGES = np.geomspace(1e3, 1e7, 129)
+PERCENTILES = {'p10_price': 0.1, 'median_price': 0.5, 'p90_price': 0.9}
+
+# Listings the depreciation analysis counts have a positive price and a year;
+# other rows come back with a NULL price so a re-scrape can take them out
+SNAPSHOT_QUERY = """
+    SELECT ad_id, brand, model, trim, website, year,
+           CASE WHEN price > 0 AND year IS NOT NULL THEN price::float8 END AS price
+    FROM listings
+"""
+
+
+def price_bins(prices):
+    return np.clip(np.searchsorted(PRICE_EDGES, prices, side='right') - 1, 0, len(PRICE_EDGES) - 2)
+
+
+class _Cube:
+    """
+    One snapshot: every counted listing's cell and price (a slot per listing),
+    and per cell its dimension codes, year and statistics.
+    """
+
+    def __init__(self):
+        self.dictionaries = {d: Dictionary() for d in TEXT_DIMENSIONS}
+        self.slots = {}
+        self.slot_cell = np.full(1024, -1, np.int32)
+        self.slot_price = np.zeros(1024)
+        self.size = 0
+        self.cells = {}
+        self.cell_codes = {d: np.zeros(256, np.int32) for d in TEXT_DIMENSIONS}
+        self.cell_year = np.zeros(256, np.int32)
+        self.count = np.zeros(256, np.int64)
+        self.total = np.zeros(256)
+        self.low = np.zeros(256)
+        self.high = np.zeros(256)
+        self.hist = np.zeros((256, len(PRICE_EDGES) - 1), np.int32)
+        self.watermark = None
+        self.built = time.monotonic()
+
+    @staticmethod
+    def _grown(array, needed, fill=0):
+        capacity = len(array)
+        if needed <= capacity:
+            return array
+        while capacity < needed:
+            capacity *= 2
+        extra = np.full((capacity - len(array),) + array.shape[1:], fill, array.dtype)
+        return np.concatenate([array, extra])
+
+    def _cell(self, codes, year):
+        key = codes + (year,)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = len(self.cells)
+            if cell >= len(self.cell_year):
+                for d in TEXT_DIMENSIONS:
+                    self.cell_codes[d] = self._grown(self.cell_codes[d], cell + 1)
+                self.cell_year = self._grown(self.cell_year, cell + 1)
+                self.count = self._grown(self.count, cell + 1)
+                self.total = self._grown(self.total, cell + 1)
+                self.low = self._grown(self.low, cell + 1)
+                self.high = self._grown(self.high, cell + 1)
+                self.hist = self._grown(self.hist, cell + 1)
+            for d, code in zip(TEXT_DIMENSIONS, codes):
+                self.cell_codes[d][cell] = code
+            self.cell_year[cell] = year
+        return cell
+
+    def upsert(self, cols, rows):
+        """Move rows (SNAPSHOT_QUERY columns) into their cells; returns the cells whose members changed."""
+        index = {c: i for i, c in enumerate(cols)}
+        dims = [(self.dictionaries[d], index[d]) for d in TEXT_DIMENSIONS]
+        year_i, price_i = index['year'], index['price']
+        touched = set()
+        for row in rows:
+            slot = self.slots.get(row[0])
+            if slot is None:
+                slot = self.slots[row[0]] = self.size
+                self.size += 1
+                self.slot_cell = self._grown(self.slot_cell, self.size, -1)
+                self.slot_price = self._grown(self.slot_price, self.size)
+            old = int(self.slot_cell[slot])
+            if row[price_i] is None:
+                cell = -1
+            else:
+                cell = self._cell(tuple(dictionary.encode(row[i]) for dictionary, i in dims), row[year_i])
+                self.slot_price[slot] = row[price_i]
+            self.slot_cell[slot] = cell
+            touched.update(c for c in (old, cell) if c >= 0)
+        return touched
+
+    def recompute(self, cells=None):
+        """Rebuild the statistics of `cells` (all when None) from their members."""
+        slot_cell = self.slot_cell[:self.size]
+        n = len(self.cells)
+        if cells is None:
+            cells = np.arange(n)
+            members = np.flatnonzero(slot_cell >= 0)
+        else:
+            cells = np.fromiter(cells, np.int64, len(cells))
+            table = np.zeros(n, bool)
+            table[cells] = True
+            members = np.flatnonzero((slot_cell >= 0) & table[np.maximum(slot_cell, 0)])
+        owner, prices = slot_cell[members], self.slot_price[members]
+        self.count[cells] = 0
+        self.total[cells] = 0.0
+        self.low[cells] = np.inf
+        self.high[cells] = -np.inf
+        self.hist[cells] = 0
+        np.add.at(self.count, owner, 1)
+        np.add.at(self.total, owner, prices)
+        np.minimum.at(self.low, owner, prices)
+        np.maximum.at(self.high, owner, prices)
+        np.add.at(self.hist, (owner, price_bins(prices)), 1)
+
+    def nbytes(self):
+        arrays = [self.slot_cell, self.slot_price, self.cell_year, self.count, self.total, self.low, self.high, self.hist]
+        return sum(a.nbytes for a in arrays) + sum(a.nbytes for a in self.cell_codes.values())
+
+
+class PriceCube:
+    """
+    In-process make x model x trim x year x website price statistics behind
+    /api/analytics/depreciation.
+
+    Each cell holds the count, price sum, min, max and a histogram over
+    PRICE_EDGES of its listings. A query ORs the cells whose brand/model/trim/
+    website match the ILIKE filters, per year, so its cost depends on the
+    number of cells, not of listings. Count, average, min and max are exact;
+    the percentiles are interpolated inside the merged histogram's bin (bins
+    are 7.5% wide) and clamped to the exact min/max, so a single listing
+    reports its own price.
+
+    Loaded at startup, then on every ingest only the cells gaining or losing a
+    re-scraped listing are recomputed. Deleted listings are dropped by the full
+    rebuild every `rebuild_interval` seconds. `PRICE_CUBE=0` turns it off and
+    the endpoint queries the database.
+    """
+
+    def __init__(self, enabled=True, rebuild_interval=3600.0, batch_size=20000):
+        self.enabled = enabled
+        self.rebuild_interval = rebuild_interval
+        self.batch_size = batch_size
+        self._cube = None
+        self._matches = {}
+        self.queries = 0
+        self.query_time = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("PRICE_CUBE", "1") != "0",
+            rebuild_interval=float(os.getenv("PRICE_CUBE_REBUILD_SECONDS", 3600)),
+            batch_size=int(os.getenv("PRICE_CUBE_BATCH_SIZE", 20000)),
+        )
+
+    @property
+    def loaded(self):
+        return self._cube is not None
+
+    async def load(self):
+        """Build a fresh snapshot and swap it in."""
+        if not self.enabled:
+            return
+        start = time.monotonic()
+        cube = _Cube()
+        cube.watermark = (await adb.fetch_one("SELECT MAX(changed_at) AS watermark FROM listings"))["watermark"]
+        async for cols, rows in adb.stream(SNAPSHOT_QUERY + " WHERE price > 0 AND year IS NOT NULL", batch_size=self.batch_size):
+            cube.upsert(cols, rows)
+        cube.recompute()
+        self._cube = cube
+        self._matches = {}
+        logger.info(f"Price cube loaded {cube.size} listings into {len(cube.cells)} cells in {time.monotonic() - start:.2f}s ({cube.nbytes() / 1e6:.1f} MB)")
+
+    async def refresh_since(self, previous_watermark, watermark):
+        """Ingest-watcher callback: move the rows scraped after our watermark and recompute their cells."""
+        cube = self._cube
+        if not self.enabled:
+            return
+        if cube is None or cube.watermark is None or time.monotonic() - cube.built > self.rebuild_interval:
+            await self.load()
+            return
+        cols, rows = await adb.fetch(SNAPSHOT_QUERY + " WHERE changed_at > %s", (reread_from(cube.watermark),))
+        if cube is not self._cube:
+            return
+        # No awaits from here on: queries never see a half-updated cell
+        touched = cube.upsert(cols, rows)
+        if touched:
+            cube.recompute(touched)
+        cube.watermark = max(cube.watermark, watermark)
+        if rows:
+            logger.info(f"Price cube: {len(rows)} listings updated, {len(touched)} cells recomputed")
+
+    def _match_table(self, cube, dimension, value):
+        """Boolean table over `dimension`'s codes: the values matching ILIKE '%value%'."""
+        dictionary = cube.dictionaries[dimension]
+        key = (dimension, value, len(dictionary.values))
+        table = self._matches.get(key)
+        if table is None:
+            matches = ilike_matcher(value)
+            table = np.array([code != 0 and matches(lowered) for code, lowered in enumerate(dictionary.lowered)], bool)
+            if len(self._matches) > 1024:
+                self._matches.clear()
+            self._matches[key] = table
+        return table
+
+    def yearly(self, make: str, model: str, trim: str = None, websites=None):
+        """
+        Per-year statistics of the listings matching the filters, oldest year
+        first, as the dicts of the depreciation response; None when not loaded.
+        """
+        cube = self._cube
+        if cube is None:
+            return None
+        start = time.monotonic()
+        n = len(cube.cells)
+        mask = cube.count[:n] > 0
+        for dimension, value in (('brand', make), ('model', model), ('trim', trim)):
+            if value:
+                mask &= self._match_table(cube, dimension, value)[cube.cell_codes[dimension][:n]]
+        if websites:
+            codes = cube.cell_codes['website'][:n]
+            mask &= np.logical_or.reduce([self._match_table(cube, 'website', w)[codes] for w in websites])
+        cells = np.flatnonzero(mask)
+        if not cells.size:
+            return []
+
+        # Cells grouped by year, each year's statistics reduced over its run
+        cells = cells[np.argsort(cube.cell_year[cells], kind='stable')]
+        cell_years = cube.cell_year[cells]
+        starts = np.flatnonzero(np.r_[True, cell_years[1:] != cell_years[:-1]])
+        years = cell_years[starts]
+        count = np.add.reduceat(cube.count[cells], starts)
+        total = np.add.reduceat(cube.total[cells], starts)
+        low = np.minimum.reduceat(cube.low[cells], starts)
+        high = np.maximum.reduceat(cube.high[cells], starts)
+        hist = np.add.reduceat(cube.hist[cells].astype(np.int64), starts, axis=0)
+
+        cumulative = hist.cumsum(axis=1)
+        percentiles = {}
+        for name, q in PERCENTILES.items():
+            target = q * count
+            b = np.minimum((cumulative < target[:, None]).sum(axis=1), hist.shape[1] - 1)
+            rows = np.arange(len(years))
+            inside = hist[rows, b]
+            fraction = np.where(inside > 0, (target - (cumulative[rows, b] - inside)) / np.maximum(inside, 1), 0.5)
+            estimate = PRICE_EDGES[b] * (PRICE_EDGES[b + 1] / PRICE_EDGES[b]) ** fraction
+            percentiles[name] = np.clip(estimate, low, high)
+
+        self.queries += 1
+        self.query_time += time.monotonic() - start
+        return [
+            {
+                "year": int(years[i]),
+                "average_price": float(total[i] / count[i]),
+                "listing_count": int(count[i]),
+                "min_price": float(low[i]),
+                "max_price": float(high[i]),
+                **{name: round(float(values[i]), 2) for name, values in percentiles.items()},
+            }
+            for i in range(len(years))
+        ]
+
+    def stats(self):
+        cube = self._cube
+        return {
+            "enabled": self.enabled,
+            "loaded": cube is not None,
+            "listings": int((cube.slot_cell[:cube.size] >= 0).sum()) if cube else 0,
+            "cells": len(cube.cells) if cube else 0,
+            "memory_mb": round(cube.nbytes() / 1e6, 2) if cube else 0.0,
+            "watermark": cube.watermark.isoformat() if cube and cube.watermark else None,
+            "age_seconds": round(time.monotonic() - cube.built, 1) if cube else None,
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_time / self.queries * 1000, 3) if self.queries else 0.0,
+        }
+
+
+price_cube = PriceCube.from_env()
@@ -0,0 +1,430 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+import psycopg
+from psycopg.conninfo import make_conninfo
+from database_connection_service.db_connection import connection_kwargs
+
+logger = logging.getLogger(__name__)
+
+# Channel the scraper pipelines NOTIFY with the (website, brand) pairs they upserted
+NOTIFY_CHANNEL = "listings_upserted"
+
+# GET endpoints whose responses are cached
+CACHED_PREFIXES = ("/search", "/listings", "/api/analytics/")
+# Query parameters that restrict a response to some brands / websites
+BRAND_PARAMS = ("brand", "make")
+WEBSITE_PARAMS = ("website", "websites")
+# Response headers stored with a cached body
+KEPT_HEADERS = (b"content-type", b"x-next-cursor")
+# Served from state the API refreshes on the ingest tick (contributor_stats,
+# price_cube), which can lag the scrapers' NOTIFY; dropped again after each tick
+DERIVED_PREFIXES = ("/api/analytics/contributors", "/api/analytics/depreciation")
+# Responses that depend on the current time ("this month", "the last N days")
+# and change without any upsert; kept for `clock_ttl` only
+CLOCK_PREFIXES = ("/api/analytics/stats", "/api/analytics/price-drops")
+
+
+def request_key(path, query_string):
+    """Cache key: the path and its non-empty query parameters in a canonical order."""
+    params = sorted((k, v.strip()) for k, v in parse_qsl(query_string) if v.strip())
+    return hashlib.sha1(f"{path}?{urlencode(params)}".encode("utf-8")).hexdigest(), params
+
+
+def request_scope(path, params):
+    """
+    (brands, websites, path) of a response: the brands and websites it is
+    limited to, lower-cased, or None for a dimension the request doesn't
+    filter on.
+    """
+    brands = [v.lower() for k, v in params if k in BRAND_PARAMS]
+    websites = [w.strip().lower() for k, v in params if k in WEBSITE_PARAMS for w in v.split(",") if w.strip()]
+    return (brands or None, websites or None, path)
+
+
+def scope_matches(scope, pairs):
+    """
+    Whether upserting any of `pairs` can change a response limited to `scope`.
+    Filters match text anywhere in the value (ILIKE '%x%'), so a brand filter
+    "toy" is affected by an upsert of "Toyota".
+    """
+    brands, websites, _ = scope
+    for website, brand in pairs:
+        if brands is not None and (brand is None or not any(b in brand.lower() for b in brands)):
+            continue
+        if websites is not None and (website is None or not any(w in website.lower() for w in websites)):
+            continue
+        return True
+    return False
+
+
+def affected(scope, pairs=None, paths=None):
+    if paths is not None:
+        return scope[2].startswith(paths)
+    return pairs is None or scope_matches(scope, pairs)
+
+
+class _Entry:
+    __slots__ = ("headers", "body", "scope", "expires", "size")
+
+    def __init__(self, headers, body, scope, expires):
+        self.headers = headers
+        self.body = body
+        self.scope = scope
+        self.expires = expires
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+
+
+class ResponseCache:
+    """
+    Cache of whole GET responses, keyed by path plus normalized query string.
+
+    Two tiers: an in-process LRU bounded by `max_bytes` of stored responses,
+    and, when `redis_url` is set, a shared tier on a Redis-compatible server
+    so workers and replicas reuse each other's responses (bound its memory
+    with the server's maxmemory policy).
+
+    Entries are invalidated precisely: each remembers the brands and websites
+    its query is limited to, and the scraper pipelines NOTIFY `NOTIFY_CHANNEL`
+    with the (website, brand) pairs they upserted. Only entries those pairs
+    can affect are dropped; unfiltered responses go on any upsert. While the
+    LISTEN connection is down, any move of the ingest watermark clears the
+    cache instead. `ttl` bounds staleness from changes neither signal sees
+    (deletes, a listing changing brand), `clock_ttl` that of responses under
+    CLOCK_PREFIXES.
+
+    Every invalidation bumps a generation, per process and in Redis. A
+    response is only stored if no invalidation happened while it was being
+    computed, since it may have read the rows from before the upsert.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024, ttl=600.0, clock_ttl=60.0,
+                 redis_url=None, redis_prefix="markaba:rc:", reconnect_interval=5.0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.clock_ttl = clock_ttl
+        self.redis_url = redis_url
+        self.redis_prefix = redis_prefix
+        self.reconnect_interval = reconnect_interval
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._redis = None
+        self._listener = None
+        self.listening = False
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.stale_stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.invalidated = 0
+        self.shared_errors = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+            max_entry_bytes=int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024)),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", 600)),
+            clock_ttl=float(os.getenv("RESPONSE_CACHE_CLOCK_TTL", 60)),
+            redis_url=os.getenv("RESPONSE_CACHE_REDIS_URL") or None,
+            redis_prefix=os.getenv("RESPONSE_CACHE_REDIS_PREFIX", "markaba:rc:"),
+        )
+
+    @staticmethod
+    def applies(scope):
+        return scope["type"] == "http" and scope["method"] == "GET" and scope["path"].startswith(CACHED_PREFIXES)
+
+    def ttl_for(self, path):
+        return min(self.ttl, self.clock_ttl) if path.startswith(CLOCK_PREFIXES) else self.ttl
+
+    # local tier
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key, entry):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    # shared tier
+
+    def _shared(self):
+        if self.redis_url and self._redis is None:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(self.redis_url)
+        return self._redis
+
+    async def _get_shared(self, key):
+        client = self._shared()
+        if client is None:
+            return None
+        try:
+            raw = await client.get(self.redis_prefix + key)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared response cache read failed: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        meta, body = raw.split(b"\n", 1)
+        meta = json.loads(meta)
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in meta["headers"]]
+        scope = tuple(meta["scope"])
+        return _Entry(headers, body, scope, time.monotonic() + self.ttl_for(scope[2]))
+
+    async def _get_shared_generation(self):
+        client = self._shared()
+        if client is None:
+            return None
+        try:
+            return int(await client.get(self.redis_prefix + "generation") or 0)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared response cache read failed: {str(e)}")
+            return None
+
+    async def _put_shared(self, key, entry, generation):
+        client = self._shared()
+        if client is None or generation is None:
+            return
+        from redis.exceptions import WatchError
+        ttl = self.ttl_for(entry.scope[2])
+        generation_key = self.redis_prefix + "generation"
+        meta = json.dumps({
+            "headers": [(k.decode("latin-1"), v.decode("latin-1")) for k, v in entry.headers],
+            "scope": list(entry.scope),
+        }).encode("utf-8")
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                # Abort if another worker invalidated since the request started
+                await pipe.watch(generation_key)
+                if int(await pipe.get(generation_key) or 0) != generation:
+                    self.stale_stores += 1
+                    return
+                pipe.multi()
+                pipe.set(self.redis_prefix + key, meta + b"\n" + entry.body, ex=max(int(ttl), 1))
+                pipe.hset(self.redis_prefix + "scopes", key, json.dumps(list(entry.scope)))
+                pipe.zadd(self.redis_prefix + "expiry", {key: time.time() + ttl})
+                await pipe.execute()
+        except WatchError:
+            self.stale_stores += 1
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared response cache write failed: {str(e)}")
+
+    async def _invalidate_shared(self, pairs, paths):
+        client = self._shared()
+        if client is None:
+            return
+        scopes_key, expiry_key = self.redis_prefix + "scopes", self.redis_prefix + "expiry"
+        try:
+            await client.incr(self.redis_prefix + "generation")
+            expired = await client.zrangebyscore(expiry_key, "-inf", time.time())
+            if expired:
+                await client.hdel(scopes_key, *expired)
+                await client.zrem(expiry_key, *expired)
+            scopes = await client.hgetall(scopes_key)
+            victims = [
+                key for key, scope in scopes.items()
+                if affected(tuple(json.loads(scope)), pairs, paths)
+            ]
+            if victims:
+                await client.delete(*(self.redis_prefix + key.decode("utf-8") for key in victims))
+                await client.hdel(scopes_key, *victims)
+                await client.zrem(expiry_key, *victims)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared response cache invalidation failed: {str(e)}")
+
+    # lookups and invalidation
+
+    async def get(self, key):
+        entry = self._get_local(key)
+        if entry is not None:
+            self.local_hits += 1
+            return entry, "hit-local"
+        generation = self._generation
+        entry = await self._get_shared(key)
+        if entry is not None:
+            self.shared_hits += 1
+            if generation == self._generation:
+                self._put_local(key, entry)
+            return entry, "hit-shared"
+        self.misses += 1
+        return None, "miss"
+
+    async def generation(self):
+        """Token taken before computing a response and handed to `put`."""
+        return self._generation, await self._get_shared_generation()
+
+    async def put(self, key, headers, body, scope, generation):
+        """Store a response, unless the cache was invalidated since `generation` was taken."""
+        local_generation, shared_generation = generation
+        if local_generation != self._generation:
+            self.stale_stores += 1
+            return
+        headers = [(k, v) for k, v in headers if k.lower() in KEPT_HEADERS]
+        entry = _Entry(headers, body, scope, time.monotonic() + self.ttl_for(scope[2]))
+        if entry.size > self.max_entry_bytes:
+            return
+        self.stores += 1
+        self._put_local(key, entry)
+        await self._put_shared(key, entry, shared_generation)
+
+    async def invalidate(self, pairs=None, paths=None):
+        """
+        Drop the entries an upsert of `pairs` may have changed, or those under
+        the `paths` prefixes; everything when neither is given.
+        """
+        self.invalidations += 1
+        self._generation += 1
+        victims = [key for key, entry in self._entries.items() if affected(entry.scope, pairs, paths)]
+        for key in victims:
+            self._drop(key)
+        self.invalidated += len(victims)
+        await self._invalidate_shared(pairs, paths)
+        if victims:
+            logger.info(f"Response cache: {len(victims)} entries invalidated")
+
+    async def on_ingest(self, previous_watermark, watermark):
+        """
+        Ingest-watcher callback, subscribed after the refreshes of derived
+        tables. Without upsert notifications any new data may affect any entry.
+        """
+        if not self.listening:
+            await self.invalidate()
+        else:
+            await self.invalidate(paths=DERIVED_PREFIXES)
+
+    async def _on_notify(self, payload):
+        try:
+            pairs = [tuple(pair) for pair in json.loads(payload)["pairs"]]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed {NOTIFY_CHANNEL} payload")
+            await self.invalidate()
+            return
+        await self.invalidate(pairs)
+
+    async def _listen(self):
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(make_conninfo(**connection_kwargs()), autocommit=True)
+                async with conn:
+                    await conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    # Notifications sent while we weren't listening are lost
+                    await self.invalidate()
+                    self.listening = True
+                    async for notify in conn.notifies():
+                        await self._on_notify(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Response cache LISTEN failed: {str(e)}")
+            finally:
+                self.listening = False
+            await asyncio.sleep(self.reconnect_interval)
+
+    def start(self):
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "shared_tier": bool(self.redis_url),
+            "listening": self.listening,
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.local_hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "stale_stores": self.stale_stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "invalidated_entries": self.invalidated,
+            "shared_errors": self.shared_errors,
+        }
+
+
+response_cache = ResponseCache.from_env()
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving cacheable GETs from `response_cache` and storing 200 responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not response_cache.applies(scope):
+            await self.app(scope, receive, send)
+            return
+        key, params = request_key(scope["path"], scope["query_string"].decode("latin-1"))
+        entry, outcome = await response_cache.get(key)
+        if entry is not None:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": entry.headers + [
+                    (b"content-length", str(len(entry.body)).encode("latin-1")),
+                    (b"x-cache", outcome.encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": entry.body})
+            return
+
+        generation = await response_cache.generation()
+        start, chunks = {}, []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-cache", b"miss")]}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive, capture)
+        if start.get("status") == 200:
+            await response_cache.put(key, start.get("headers", []), b"".join(chunks),
+                                       request_scope(scope["path"], params), generation)
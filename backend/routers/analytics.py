@@ -1,61 +1,63 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Depends
 from typing import List, Dict, Any
-from database_connection_service.db_connection import get_connection
+from database_connection_service.db_connection import get_db
+from database_connection_service.async_db import adb
 import logging
+import numpy as np
+from datetime import datetime, timezone
 from filters import build_search_filters, build_dynamic_filter_query
 from utils import format_db_row
+from daily_rollup import ROLLUP_TABLE, rollup_filter
+from contributor_stats import leaderboard_query
+from downsample import lttb
+from pagination import order_by_clause, cursor_columns, seek_filter, split_page
+from listing_json import FastJSONResponse
+from price_cube import price_cube
+from facet_catalog import facet_catalog
+from depreciation import fit_curves
+from database_connection_service.classes_input import DepreciationBatch, AnalyticsBatch
 
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
 logger = logging.getLogger(__name__)
 
 @router.get("/stats")
 def get_analytics_stats(
-    websites: str = Query(None, description="Comma-separated list of websites to filter by")
+    websites: str = Query(None, description="Comma-separated list of websites to filter by"),
+    conn=Depends(get_db)
 ):
     """Get analytics statistics with optional website filtering"""
     try:
-        conn = get_connection()
-        if not conn:
-            raise HTTPException(status_code=500, detail="Database connection failed")
+        website_list = [w.strip() for w in websites.split(',') if w.strip()] if websites else []
+        where_clause, params = rollup_filter(website_list)
+
+        # A few rows per website and day instead of two scans of listings
         cursor = conn.cursor()
-        
-        filters = []
-        params = []
-        
-        # Handle website filtering
-        if websites:
-            website_list = [w.strip() for w in websites.split(',') if w.strip()]
-            if website_list:
-                placeholders = ', '.join(['%s'] * len(website_list))
-                filters.append(f"l.website IN ({placeholders})")
-                params.extend(website_list)
-        
-        where_clause = " AND ".join(filters) if filters else "1=1"
-        
-        total_query = f"""
-            SELECT COUNT(*) as total_listings
-            FROM listings l
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(r.listings), 0)::bigint AS total_listings,
+                   COALESCE(SUM(r.listings) FILTER (
+                       WHERE r.day >= date_trunc('month', CURRENT_DATE)::date
+                         AND r.day < (date_trunc('month', CURRENT_DATE) + interval '1 month')::date
+                   ), 0)::bigint AS listings_this_month
+            FROM {ROLLUP_TABLE} r
             WHERE {where_clause}
-        """
-        cursor.execute(total_query, params)
-        total_result = cursor.fetchone()
-        
-        month_query = f"""
-            SELECT COUNT(*) as listings_this_month
+        """, params)
+        total_listings, listings_this_month = cursor.fetchone()
+
+        # Listings beyond the first of their duplicate group (duplicate_groups.py), through its partial index
+        duplicates_where, duplicates_params = rollup_filter(website_list, alias="l")
+        cursor.execute(f"""
+            SELECT COUNT(*) - COUNT(DISTINCT l.duplicate_group_id)
             FROM listings l
-            WHERE {where_clause} AND EXTRACT(MONTH FROM l.post_date) = EXTRACT(MONTH FROM CURRENT_DATE) 
-            AND EXTRACT(YEAR FROM l.post_date) = EXTRACT(YEAR FROM CURRENT_DATE)
-        """
-        cursor.execute(month_query, params)
-        month_result = cursor.fetchone()
-        
+            WHERE l.duplicate_group_id IS NOT NULL AND {duplicates_where}
+        """, duplicates_params)
+        duplicates = cursor.fetchone()[0]
         cursor.close()
-        conn.close()
         
         return {
-            "total_listings": total_result[0] if total_result else 0,
-            "listings_this_month": month_result[0] if month_result else 0,
-            "applied_filters": {"websites": website_list if websites else []}
+            "total_listings": total_listings,
+            "unique_listings": total_listings - duplicates,
+            "listings_this_month": listings_this_month,
+            "applied_filters": {"websites": website_list}
         }
     except Exception as e:
         logger.error(f"Error fetching analytics stats: {str(e)}")
@@ -64,103 +66,17 @@ def get_analytics_stats(
 @router.get("/contributors")
 def get_top_contributors(
     limit: int = Query(20, ge=1, le=100),
-    websites: str = Query(None, description="Comma-separated list of websites to filter by")
+    websites: str = Query(None, description="Comma-separated list of websites to filter by"),
+    conn=Depends(get_db)
 ):
     """Get top contributors with seller statistics and optional filtering"""
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
     try:
         cur = conn.cursor()
-        
-        filters = []
-        params = []
-        
-        # Handle website filtering from query parameter
-        website_list = []
-        if websites:
-            website_list = [w.strip() for w in websites.split(',') if w.strip()]
-            if website_list:
-                placeholders = ', '.join(['%s'] * len(website_list))
-                filters.append(f"l.website IN ({placeholders})")
-                params.extend(website_list)
-                logger.info(f"Contributors endpoint - filtering by websites: {website_list}")
-        
-        # Check if we need to join dubizzle_details (for Dubizzle website or when showing all websites)
-        need_dubizzle_join = not website_list or any('dubizzle' in w.lower() for w in website_list)
-        
-        # Base filters for valid sellers - this is the key fix
-        if need_dubizzle_join:
-            # For Dubizzle, we want agency contributors OR individual sellers
-            base_filters = []  # No additional base filters, website filter is already applied above
-        else:
-            # For other websites, just filter by seller existence
-            base_filters = ["(l.seller IS NOT NULL AND l.seller != '')"]
-        
-        if filters:
-            base_filters.extend(filters)
-        
-        # Ensure we always have a valid WHERE clause
-        where_clause = " AND ".join(base_filters) if base_filters else "1=1"
-        logger.info(f"Contributors endpoint - WHERE clause: {where_clause}")
-        logger.info(f"Contributors endpoint - Parameters: {params}")
-        
-        # Build query with conditional JOIN
-        if need_dubizzle_join:
-            query = f"""
-            SELECT 
-                CASE 
-                    WHEN l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A'
-                    THEN COALESCE(dd.agency_name, 'Unknown Agency')
-                    ELSE l.seller
-                END as seller_name,
-                CASE 
-                    WHEN l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A'
-                    THEN COALESCE(dd.agency_id, 'unknown')
-                    ELSE l.seller
-                END as seller_id,
-                dd.agency_name,
-                l.website,
-                COUNT(*) as total_listings,
-                CASE 
-                    WHEN l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A'
-                    THEN 'agency'
-                    ELSE 'individual_seller'
-                END as contributor_type
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            WHERE {where_clause}
-            GROUP BY 
-                l.seller,
-                dd.agency_id,
-                dd.agency_name,
-                l.website
-            HAVING COUNT(*) > 0 
-                AND NOT (l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A') OR dd.agency_name IS NOT NULL
-            ORDER BY total_listings DESC
-            LIMIT %s
-            """
-        else:
-            query = f"""
-            SELECT 
-                l.seller as seller_name,
-                l.seller as seller_id,
-                NULL as agency_name,
-                l.website,
-                COUNT(*) as total_listings,
-                l.seller_type as contributor_type
-            FROM listings l
-            WHERE {where_clause}
-            GROUP BY 
-                l.seller,
-                l.website,
-                l.seller_type
-            HAVING COUNT(*) > 0
-            ORDER BY total_listings DESC
-            LIMIT %s
-            """
-        params.append(limit)
-        cur.execute(query, tuple(params))
+        website_list = [w.strip() for w in websites.split(',') if w.strip()] if websites else []
+
+        # Top-K range reads of the precomputed leaderboard (contributor_stats.py)
+        query, params = leaderboard_query(website_list, limit)
+        cur.execute(query, params)
         rows = cur.fetchall()
         cols = [d[0] for d in cur.description]
         contributors = []
@@ -177,320 +93,526 @@ def get_top_contributors(
         raise HTTPException(status_code=500, detail=f"Failed to get contributors: {str(e)}")
     finally:
         cur.close()
-        conn.close()
+
+# Raw points of /contributor/{seller_identifier}/listings, by post date then ad_id
+CONTRIBUTOR_LISTINGS_SORT = "post_date_asc"
+
+CONTRIBUTOR_SCOPES = {
+    # contributor_type -> (name/id columns, FROM + WHERE for that contributor)
+    'individual_seller': (
+        "l.seller as seller_name, l.seller as seller_id",
+        "FROM listings l WHERE l.seller = %s",
+        "l.seller",
+    ),
+    'agency': (
+        "dd.agency_name as seller_name, dd.agency_id as seller_id",
+        "FROM listings l LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id "
+        "WHERE dd.agency_name = %s AND (l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A')",
+        "dd.agency_name, dd.agency_id",
+    ),
+}
+
+# date_trunc fields accepted as the contributor series' `bucket`
+SERIES_BUCKETS = ("day", "week", "month")
+
+# Equal-width time buckets per requested price_series point; each keeps its
+# cheapest and dearest listing, so LTTB picks among at most 4x `points` rows
+PRICE_BUCKETS_PER_POINT = 2
+
+async def _fetch_contributor_scope(contributor_type: str, seller_identifier: str, bucket: str, points: int):
+    """Summary, bucketed series, brand/model mix and bucketed price points for one contributor type, issued concurrently."""
+    name_cols, scope, group_by = CONTRIBUTOR_SCOPES[contributor_type]
+    summary_query = f"""
+    SELECT 
+        {name_cols},
+        '{contributor_type}' as contributor_type,
+        COUNT(*) as total_listings,
+        COUNT(DISTINCT COALESCE(l.duplicate_group_id, l.ad_id)) as unique_listings,
+        AVG(l.price) as average_price,
+        SUM(l.price) as total_value,
+        MIN(l.post_date) as first_listing_date,
+        MAX(l.post_date) as last_listing_date
+    {scope}
+    GROUP BY {group_by}
+    """
+    series_query = f"""
+    SELECT 
+        DATE_TRUNC(%s, l.post_date) as day,
+        COUNT(*) as listings_count,
+        AVG(l.price) as avg_price
+    {scope}
+    GROUP BY 1
+    ORDER BY 1
+    """
+    mix_query = f"""
+    SELECT 
+        l.brand,
+        l.model,
+        COUNT(*) as count
+    {scope}
+    GROUP BY l.brand, l.model
+    """
+    # (price, epoch) arrays compare price first: the cheapest listing (earliest on
+    # ties) and, through the negated epoch, the dearest, without sorting a bucket
+    price_query = f"""
+    WITH points AS (
+        SELECT extract(epoch FROM l.post_date)::float8 AS t, l.price::float8 AS price
+        {scope} AND l.post_date IS NOT NULL AND l.price IS NOT NULL
+    ),
+    bounds AS (
+        SELECT MIN(t) AS first, MAX(t) AS last FROM points
+    )
+    SELECT COUNT(*) AS n, MIN(ARRAY[p.price, p.t]) AS cheapest, MAX(ARRAY[p.price, -p.t]) AS dearest
+    FROM points p, bounds b
+    GROUP BY CASE WHEN b.last > b.first THEN width_bucket(p.t, b.first, b.last, %s) ELSE 1 END
+    """
+    params = (seller_identifier,)
+    return await adb.gather(
+        adb.fetch_one(summary_query, params),
+        adb.fetch_dicts(series_query, (bucket, seller_identifier)),
+        adb.fetch(mix_query, params),
+        adb.fetch(price_query, (seller_identifier, points * PRICE_BUCKETS_PER_POINT)),
+    )
+
+def _top_with_other(counts, top: int):
+    """The `top` largest (key, count) pairs, and the total count of the rest."""
+    ranked = sorted(counts.items(), key=lambda kv: (-kv[1], str(kv[0])))
+    return ranked[:top], sum(count for _, count in ranked[top:])
+
+def _price_series(rows, points: int):
+    """The price query's bucket rows as their listings' (post_date, price), downsampled to at most `points` with LTTB."""
+    kept = sorted({(t, price) for _, (price, t), _ in rows} | {(-negated, price) for _, _, (price, negated) in rows})
+    if not kept:
+        return []
+    x = np.fromiter((t for t, _ in kept), dtype=np.float64, count=len(kept))
+    y = np.fromiter((price for _, price in kept), dtype=np.float64, count=len(kept))
+    return [
+        {"post_date": datetime.fromtimestamp(x[i], timezone.utc).replace(tzinfo=None).isoformat(), "price": float(y[i])}
+        for i in lttb(x, y, points)
+    ]
 
 @router.get("/contributor/{seller_identifier}")
-def get_contributor_details(seller_identifier: str):
-    """Get detailed analytics for a specific contributor using seller name or agency name"""
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
+async def get_contributor_details(
+    seller_identifier: str,
+    bucket: str = Query("day", description="Time bucket of daily_distribution: day, week or month"),
+    points: int = Query(500, ge=3, le=5000, description="Maximum points in price_series"),
+    top: int = Query(10, ge=1, le=100, description="Brands/models listed before the 'Other' bucket"),
+):
+    """
+    Get detailed analytics for a specific contributor using seller name or agency name.
+    Series are aggregated server-side so the response size doesn't grow with the
+    contributor; the individual listings are paged by /contributor/{seller_identifier}/listings.
+    """
+    if bucket not in SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(SERIES_BUCKETS)}")
     try:
-        cur = conn.cursor()
+        # First try to find as individual seller, then as agency (Dubizzle)
+        summary, series_rows, (_, mix_rows), (_, price_rows) = await _fetch_contributor_scope('individual_seller', seller_identifier, bucket, points)
+        if not summary:
+            summary, series_rows, (_, mix_rows), (_, price_rows) = await _fetch_contributor_scope('agency', seller_identifier, bucket, points)
         
-        # First try to find as individual seller
-        query = """
-        SELECT 
-            l.seller as seller_name,
-            l.seller as seller_id,
-            'individual_seller' as contributor_type,
-            COUNT(*) as total_listings,
-            AVG(l.price) as average_price,
-            SUM(l.price) as total_value,
-            MIN(l.post_date) as first_listing_date,
-            MAX(l.post_date) as last_listing_date,
-            array_agg(l.post_date ORDER BY l.post_date) as all_post_dates,
-            array_agg(l.price ORDER BY l.post_date) as all_prices,
-            array_agg(l.brand ORDER BY l.post_date) as all_brands,
-            array_agg(l.model ORDER BY l.post_date) as all_models
-        FROM listings l
-        WHERE l.seller = %s
-        GROUP BY l.seller
-        """
-        cur.execute(query, (seller_identifier,))
-        row = cur.fetchone()
-        
-        # If not found as individual seller, try as agency (Dubizzle)
-        if not row:
-            query = """
-            SELECT 
-                dd.agency_name as seller_name,
-                dd.agency_id as seller_id,
-                'agency' as contributor_type,
-                COUNT(*) as total_listings,
-                AVG(l.price) as average_price,
-                SUM(l.price) as total_value,
-                MIN(l.post_date) as first_listing_date,
-                MAX(l.post_date) as last_listing_date,
-                array_agg(l.post_date ORDER BY l.post_date) as all_post_dates,
-                array_agg(l.price ORDER BY l.post_date) as all_prices,
-                array_agg(l.brand ORDER BY l.post_date) as all_brands,
-                array_agg(l.model ORDER BY l.post_date) as all_models
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            WHERE dd.agency_name = %s AND (l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A')
-            GROUP BY dd.agency_name, dd.agency_id
-            """
-            cur.execute(query, (seller_identifier,))
-            row = cur.fetchone()
-        
-        if not row:
+        if not summary:
             raise HTTPException(status_code=404, detail=f"Contributor '{seller_identifier}' not found")
         
-        cols = [d[0] for d in cur.description]
-        contributor_data = format_db_row(dict(zip(cols, row)))
+        contributor_data = format_db_row(summary)
+        daily_data = [format_db_row(row) for row in series_rows]
         
-        # For daily and brand queries, we need to use the same logic
-        if contributor_data['contributor_type'] == 'individual_seller':
-            # Individual seller daily query
-            daily_query = """
-            SELECT 
-                DATE_TRUNC('day', l.post_date) as day,
-                COUNT(*) as listings_count,
-                AVG(l.price) as avg_price
-            FROM listings l
-            WHERE l.seller = %s
-            GROUP BY DATE_TRUNC('day', l.post_date)
-            ORDER BY day
-            """
-            cur.execute(daily_query, (seller_identifier,))
-            daily_rows = cur.fetchall()
-            daily_cols = [d[0] for d in cur.description]
-            daily_data = [format_db_row(dict(zip(daily_cols, row))) for row in daily_rows]
-            
-            # Individual seller brand query
-            brand_query = """
-            SELECT 
-                l.brand,
-                COUNT(*) as count
-            FROM listings l
-            WHERE l.seller = %s
-            GROUP BY l.brand
-            ORDER BY count DESC
-            """
-            cur.execute(brand_query, (seller_identifier,))
-            brand_rows = cur.fetchall()
-        else:
-            # Agency daily query
-            daily_query = """
-            SELECT 
-                DATE_TRUNC('day', l.post_date) as day,
-                COUNT(*) as listings_count,
-                AVG(l.price) as avg_price
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            WHERE dd.agency_name = %s AND (l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A')
-            GROUP BY DATE_TRUNC('day', l.post_date)
-            ORDER BY day
-            """
-            cur.execute(daily_query, (seller_identifier,))
-            daily_rows = cur.fetchall()
-            daily_cols = [d[0] for d in cur.description]
-            daily_data = [format_db_row(dict(zip(daily_cols, row))) for row in daily_rows]
-            
-            # Agency brand query
-            brand_query = """
-            SELECT 
-                l.brand,
-                COUNT(*) as count
-            FROM listings l
-            LEFT JOIN dubizzle_details dd ON l.ad_id = dd.ad_id
-            WHERE dd.agency_name = %s AND (l.seller IS NULL OR l.seller = '' OR l.seller = 'N/A')
-            GROUP BY l.brand
-            ORDER BY count DESC
-            """
-            cur.execute(brand_query, (seller_identifier,))
-            brand_rows = cur.fetchall()
-        
-        # Process brand data  
-        brand_data = [{"brand": row[0], "count": row[1]} for row in brand_rows]
+        # Brand and model mix, largest first, the tail folded into "Other"
+        brand_counts, model_counts = {}, {}
+        for brand, model, count in mix_rows:
+            brand_counts[brand] = brand_counts.get(brand, 0) + count
+            model_counts[(brand, model)] = count
+        brands, other_brands = _top_with_other(brand_counts, top)
+        models, other_models = _top_with_other(model_counts, top)
+        brand_data = [{"brand": brand, "count": count} for brand, count in brands]
+        if other_brands:
+            brand_data.append({"brand": "Other", "count": other_brands})
+        model_data = [{"brand": brand, "model": model, "count": count} for (brand, model), count in models]
+        if other_models:
+            model_data.append({"brand": None, "model": "Other", "count": other_models})
+
         return {
             "contributor": contributor_data,
+            "bucket": bucket,
             "daily_distribution": daily_data,
-            "brand_distribution": brand_data
+            "price_series": _price_series(price_rows, points),
+            "price_points": sum(row[0] for row in price_rows),
+            "brand_distribution": brand_data,
+            "model_distribution": model_data
         }
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error getting contributor details: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get contributor details: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+
+@router.get("/contributor/{seller_identifier}/listings")
+async def get_contributor_listings(
+    seller_identifier: str,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: str = Query(None, description="Opaque cursor from the previous page (X-Next-Cursor)"),
+):
+    """A contributor's individual listings (post date, price, brand, model), oldest first, keyset-paginated"""
+    try:
+        # Same precedence as the detail endpoint: an individual seller, else an agency
+        is_seller = await adb.fetch_one("SELECT EXISTS (SELECT 1 FROM listings WHERE seller = %s) AS found", (seller_identifier,))
+        contributor_type = 'individual_seller' if is_seller["found"] else 'agency'
+        _, scope, _ = CONTRIBUTOR_SCOPES[contributor_type]
+        seek_sql, seek_params = seek_filter(CONTRIBUTOR_LISTINGS_SORT, cursor) if cursor else ("TRUE", [])
+        cols, rows = await adb.fetch(f"""
+        SELECT l.ad_id, l.post_date, l.price, l.brand, l.model{cursor_columns(CONTRIBUTOR_LISTINGS_SORT)}
+        {scope} AND {seek_sql}
+        ORDER BY {order_by_clause(CONTRIBUTOR_LISTINGS_SORT)}
+        LIMIT %s
+        """, [seller_identifier, *seek_params, limit + 1])
+        if not rows and not cursor:
+            raise HTTPException(status_code=404, detail=f"Contributor '{seller_identifier}' not found")
+        rows, next_cursor = split_page(rows, limit, CONTRIBUTOR_LISTINGS_SORT)
+        listings = [dict(zip(cols[:5], row[:5])) for row in rows]
+        return FastJSONResponse(
+            {"contributor_type": contributor_type, "listings": listings, "next_cursor": next_cursor},
+            headers={"X-Next-Cursor": next_cursor} if next_cursor else None,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting contributor listings: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get contributor listings: {str(e)}")
+
+async def _query_yearly_prices(make: str, model: str, trim: str = None, website_list=None):
+    """Per-year price statistics from the database, for when the price cube isn't loaded"""
+    where_conditions = [
+        "brand ILIKE %s",
+        "model ILIKE %s",
+        "price IS NOT NULL",
+        "price > 0",
+        "year IS NOT NULL"
+    ]
+    params = [f"%{make}%", f"%{model}%"]
+    if trim:
+        where_conditions.append("trim ILIKE %s")
+        params.append(f"%{trim}%")
+    if website_list:
+        where_conditions.append("(" + " OR ".join(["website ILIKE %s"] * len(website_list)) + ")")
+        params.extend([f"%{w}%" for w in website_list])
+    where_clause = " AND ".join(where_conditions)
+    yearly_query = f"""
+    SELECT 
+        year,
+        AVG(price)::float8 as average_price,
+        COUNT(*) as listing_count,
+        MIN(price)::float8 as min_price,
+        MAX(price)::float8 as max_price,
+        percentile_cont(0.1) WITHIN GROUP (ORDER BY price) as p10_price,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY price) as median_price,
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY price) as p90_price
+    FROM listings 
+    WHERE {where_clause}
+    GROUP BY year
+    ORDER BY year
+    """
+    return await adb.fetch_dicts(yearly_query, params)
+
+async def _yearly_prices(make: str, model: str, trim: str = None, website_list=None):
+    """Per-year price statistics with at least the listings a depreciation point needs"""
+    yearly = price_cube.yearly(make, model, trim, website_list)
+    if yearly is None:
+        yearly = await _query_yearly_prices(make, model, trim, website_list)
+    return _enough_listings(yearly, trim)
+
+def _enough_listings(yearly, trim: str = None):
+    min_listings = 1 if trim else 3
+    return [row for row in yearly if row["listing_count"] >= min_listings]
+
+def _split_websites(websites: str):
+    return [w.strip() for w in websites.split(",") if w.strip()] if websites else []
+
+def _depreciation_summary(yearly_data, curve):
+    """The depreciation response fields derived from a segment's yearly statistics"""
+    prices = [float(item['average_price']) for item in yearly_data]
+    years = [item['year'] for item in yearly_data]
+    if len(prices) < 2:
+        raise HTTPException(status_code=400, detail="Insufficient data for depreciation analysis")
+    highest_price = max(prices)
+    current_price = prices[-1]
+    oldest_year = years[0]
+    newest_year = years[-1]
+    total_depreciation = ((highest_price - current_price) / highest_price) * 100 if highest_price > 0 else 0
+    years_span = newest_year - oldest_year
+    annual_depreciation = total_depreciation / years_span if years_span > 0 else 0
+    return {
+        "yearly_data": yearly_data,
+        "current_avg_price": current_price,
+        "highest_avg_price": highest_price,
+        "total_depreciation_percentage": round(total_depreciation, 2),
+        "annual_depreciation_rate": round(annual_depreciation, 2),
+        "analysis_period": f"{oldest_year} - {newest_year}",
+        "data_points": len(yearly_data),
+        "curve": curve
+    }
 
 @router.get("/depreciation")
-def get_depreciation_analysis(
+async def get_depreciation_analysis(
     make: str = Query(...),
     model: str = Query(...),
     trim: str = Query(None),
-    websites: str = Query(None, description="Comma-separated list of websites to filter by")
+    websites: str = Query(None, description="Comma-separated list of websites to filter by"),
 ):
-    """Get depreciation analysis for a specific make and model with optional trim and websites"""
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
+    """
+    Get depreciation analysis for a specific make and model with optional trim and websites.
+    Yearly statistics come from the in-process price cube; `curve` is an exponential
+    fit of the yearly medians with a 95% confidence band.
+    """
     try:
-        cur = conn.cursor()
-        # Build the WHERE clause with optional trim and websites filter
-        where_conditions = [
-            "brand ILIKE %s",
-            "model ILIKE %s",
-            "price IS NOT NULL",
-            "price > 0",
-            "year IS NOT NULL"
-        ]
-        params = [f"%{make}%", f"%{model}%"]
-        if trim and trim.strip():
-            where_conditions.append("trim ILIKE %s")
-            params.append(f"%{trim}%")
-        if websites:
-            website_list = [w.strip() for w in websites.split(",") if w.strip()]
-            if website_list:
-                where_conditions.append("(" + " OR ".join(["website ILIKE %s"] * len(website_list)) + ")")
-                params.extend([f"%{w}%" for w in website_list])
-        where_clause = " AND ".join(where_conditions)
-        min_listings = 1 if trim and trim.strip() else 3
-        yearly_query = f"""
-        SELECT 
-            year,
-            AVG(price) as average_price,
-            COUNT(*) as listing_count,
-            MIN(price) as min_price,
-            MAX(price) as max_price
-        FROM listings 
-        WHERE {where_clause}
-        GROUP BY year
-        HAVING COUNT(*) >= {min_listings}
-        ORDER BY year
-        """
-        cur.execute(yearly_query, tuple(params))
-        yearly_rows = cur.fetchall()
-        if not yearly_rows:
-            trim_text = f" {trim}" if trim and trim.strip() else ""
+        trim_filter = trim.strip() if trim and trim.strip() else None
+        yearly_data = await _yearly_prices(make, model, trim_filter, _split_websites(websites))
+        if not yearly_data:
+            trim_text = f" {trim}" if trim_filter else ""
             raise HTTPException(status_code=404, detail=f"No sufficient data found for {make} {model}{trim_text}")
-        yearly_cols = [d[0] for d in cur.description]
-        yearly_data = [format_db_row(dict(zip(yearly_cols, row))) for row in yearly_rows]
-        prices = [float(item['average_price']) for item in yearly_data]
-        years = [item['year'] for item in yearly_data]
-        if len(prices) < 2:
-            raise HTTPException(status_code=400, detail="Insufficient data for depreciation analysis")
-        highest_price = max(prices)
-        current_price = prices[-1]
-        oldest_year = years[0]
-        newest_year = years[-1]
-        total_depreciation = ((highest_price - current_price) / highest_price) * 100 if highest_price > 0 else 0
-        years_span = newest_year - oldest_year
-        annual_depreciation = total_depreciation / years_span if years_span > 0 else 0
         return {
             "make": make,
             "model": model,
             "trim": trim,
-            "yearly_data": yearly_data,
-            "current_avg_price": current_price,
-            "highest_avg_price": highest_price,
-            "total_depreciation_percentage": round(total_depreciation, 2),
-            "annual_depreciation_rate": round(annual_depreciation, 2),
-            "analysis_period": f"{oldest_year} - {newest_year}",
-            "data_points": len(yearly_data)
+            **_depreciation_summary(yearly_data, fit_curves([yearly_data])[0])
         }
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error getting depreciation analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get depreciation analysis: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+
+@router.post("/depreciation/batch")
+async def get_depreciation_curves(request: DepreciationBatch):
+    """Depreciation curves for many make/model/trim segments, fitted together in one pass"""
+    try:
+        website_list = _split_websites(request.websites)
+        segments = [
+            (s.make, s.model, s.trim.strip() if s.trim and s.trim.strip() else None)
+            for s in request.segments
+        ]
+        if price_cube.loaded:
+            yearly = [await _yearly_prices(make, model, trim, website_list) for make, model, trim in segments]
+        else:
+            rows = await _batch_segment_stats([(make, model, trim, None) for make, model, trim in segments],
+                                              website_list, bins=1, yearly=True)
+            yearly = [_batch_yearly(row, trim) for (_, _, trim), row in zip(segments, rows)]
+        curves = fit_curves(yearly)
+        return {
+            "results": [
+                {
+                    "make": make,
+                    "model": model,
+                    "trim": trim,
+                    "data_points": len(rows),
+                    "analysis_period": f"{rows[0]['year']} - {rows[-1]['year']}" if rows else None,
+                    "curve": curve
+                }
+                for (make, model, trim), rows, curve in zip(segments, yearly, curves)
+            ]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting depreciation curves: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get depreciation curves: {str(e)}")
+
+# Listings of a price-spread segment are paged cheapest first
+PRICE_SPREAD_SORT = "price_asc"
+
+# Quartiles, Tukey fences (1.5 x IQR) and an equal-width histogram over [min, max]
+# in one pass over the segment; `matched` is materialized once for all three. A
+# car listed several times (duplicate_groups.py) counts once, at its latest post
+PRICE_SPREAD_STATS = """
+WITH segment AS (
+    SELECT ad_id, price::float8 AS price, COALESCE(duplicate_group_id, ad_id) AS car, post_date FROM listings WHERE {where}
+),
+matched AS (
+    SELECT DISTINCT ON (car) price FROM segment ORDER BY car, post_date DESC NULLS LAST, ad_id
+),
+stats AS (
+    SELECT (SELECT COUNT(*) FROM segment) AS total_listings,
+           COUNT(*) AS unique_listings,
+           AVG(price) AS average_price,
+           stddev_pop(price) AS standard_deviation,
+           MIN(price) AS min_price,
+           MAX(price) AS max_price,
+           percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY price) AS quartiles
+    FROM matched
+),
+fences AS (
+    SELECT quartiles[1] - 1.5 * (quartiles[3] - quartiles[1]) AS lower_fence,
+           quartiles[3] + 1.5 * (quartiles[3] - quartiles[1]) AS upper_fence
+    FROM stats
+)
+SELECT s.*, f.*, o.*, h.*
+FROM stats s, fences f,
+LATERAL (
+    SELECT COUNT(*) FILTER (WHERE m.price < f.lower_fence) AS low_outliers,
+           COUNT(*) FILTER (WHERE m.price > f.upper_fence) AS high_outliers
+    FROM matched m
+) o,
+LATERAL (
+    SELECT array_agg(bin ORDER BY bin) AS bins, array_agg(n ORDER BY bin) AS bin_counts
+    FROM (
+        SELECT CASE WHEN s.max_price > s.min_price
+                    THEN LEAST(width_bucket(m.price, s.min_price, s.max_price, %s), %s) ELSE 1 END AS bin,
+               COUNT(*) AS n
+        FROM matched m
+        GROUP BY 1
+    ) b
+) h
+"""
+
+def _price_spread_where(make: str, model: str, year: int, trim: str = None, website_list=None):
+    where_conditions = [
+        "brand ILIKE %s",
+        "model ILIKE %s",
+        "year = %s",
+        "price IS NOT NULL",
+        "price > 0"
+    ]
+    params = [f"%{make}%", f"%{model}%", year]
+    if trim:
+        where_conditions.append("trim ILIKE %s")
+        params.append(f"%{trim}%")
+    if website_list:
+        where_conditions.append("(" + " OR ".join(["website ILIKE %s"] * len(website_list)) + ")")
+        params.extend([f"%{w}%" for w in website_list])
+    return " AND ".join(where_conditions), params
+
+def _histogram(stats, bins: int):
+    counts = np.zeros(bins, dtype=np.int64)
+    counts[np.asarray(stats["bins"]) - 1] = stats["bin_counts"]
+    if stats["max_price"] == stats["min_price"]:
+        bins = 1
+    edges = np.linspace(stats["min_price"], stats["max_price"], bins + 1)
+    return [
+        {"lower": round(float(edges[i]), 2), "upper": round(float(edges[i + 1]), 2), "count": int(counts[i])}
+        for i in range(bins)
+    ]
+
+def _spread_summary(stats, bins: int):
+    """The price-spread response fields derived from a PRICE_SPREAD_STATS row"""
+    mean_price = stats["average_price"]
+    std_dev = stats["standard_deviation"]
+    q1, median_price, q3 = stats["quartiles"]
+    return {
+        "average_price": round(mean_price, 2),
+        "median_price": round(median_price, 2),
+        "min_price": stats["min_price"],
+        "max_price": stats["max_price"],
+        "standard_deviation": round(std_dev, 2),
+        "coefficient_of_variation": round((std_dev / mean_price) * 100 if mean_price > 0 else 0, 2),
+        "q1_price": round(q1, 2),
+        "q3_price": round(q3, 2),
+        "iqr": round(q3 - q1, 2),
+        "outlier_fences": {"lower": round(stats["lower_fence"], 2), "upper": round(stats["upper_fence"], 2)},
+        "outlier_count": {"low": stats["low_outliers"], "high": stats["high_outliers"]},
+        "histogram": _histogram(stats, bins),
+    }
 
 @router.get("/price-spread")
-def get_price_spread_analysis(
+async def get_price_spread_analysis(
     make: str = Query(...),
     model: str = Query(...),
     year: int = Query(...),
     trim: str = Query(None),
-    websites: str = Query(None, description="Comma-separated list of websites to filter by")
+    websites: str = Query(None, description="Comma-separated list of websites to filter by"),
+    bins: int = Query(20, ge=1, le=100, description="Number of equal-width histogram bins"),
+    limit: int = Query(100, ge=1, le=500, description="Listings per page, cheapest first"),
+    cursor: str = Query(None, description="Opaque cursor from the previous page (X-Next-Cursor)"),
 ):
-    """Get price spread analysis for a specific make, model, year with optional trim and websites"""
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
+    """
+    Get price spread analysis for a specific make, model, year with optional trim and websites.
+    The distribution (quartiles, standard deviation, histogram, outlier fences) is computed
+    in the database over the whole segment, one price per car (`unique_listings`);
+    `listings` is one keyset-paginated page of every listing, each flagged when outside
+    the 1.5 x IQR fences.
+    """
     try:
-        cur = conn.cursor()
-        where_conditions = [
-            "brand ILIKE %s",
-            "model ILIKE %s",
-            "year = %s",
-            "price IS NOT NULL",
-            "price > 0"
-        ]
-        params = [f"%{make}%", f"%{model}%", year]
-        if trim and trim.strip():
-            where_conditions.append("trim ILIKE %s")
-            params.append(f"%{trim}%")
-        if websites:
-            website_list = [w.strip() for w in websites.split(",") if w.strip()]
-            if website_list:
-                where_conditions.append("(" + " OR ".join(["website ILIKE %s"] * len(website_list)) + ")")
-                params.extend([f"%{w}%" for w in website_list])
-        where_clause = " AND ".join(where_conditions)
-        listings_query = f"""
-        SELECT 
-            ad_id,
-            url,
-            title,
-            price,
-            mileage,
-            location_city,
-            seller,
-            post_date
-        FROM listings 
-        WHERE {where_clause}
-        ORDER BY price
-        """
-        cur.execute(listings_query, tuple(params))
-        listings_rows = cur.fetchall()
-        if not listings_rows:
-            trim_text = f" {trim}" if trim and trim.strip() else ""
+        trim_filter = trim.strip() if trim and trim.strip() else None
+        where_clause, params = _price_spread_where(make, model, year, trim_filter, _split_websites(websites))
+        seek_sql, seek_params = seek_filter(PRICE_SPREAD_SORT, cursor) if cursor else ("TRUE", [])
+        stats, (cols, rows) = await adb.gather(
+            adb.fetch_one(PRICE_SPREAD_STATS.format(where=where_clause), [*params, bins, bins]),
+            adb.fetch(f"""
+            SELECT l.ad_id, l.url, l.title, l.price, l.mileage, l.location_city, l.seller, l.post_date{cursor_columns(PRICE_SPREAD_SORT)}
+            FROM listings l
+            WHERE {where_clause} AND {seek_sql}
+            ORDER BY {order_by_clause(PRICE_SPREAD_SORT)}
+            LIMIT %s
+            """, [*params, *seek_params, limit + 1]),
+        )
+        if not stats["total_listings"]:
+            trim_text = f" {trim}" if trim_filter else ""
             raise HTTPException(status_code=404, detail=f"No data found for {make} {model}{trim_text} {year}")
-        listings_cols = [d[0] for d in cur.description]
-        listings_data = [format_db_row(dict(zip(listings_cols, row))) for row in listings_rows]
-        prices = [float(item['price']) for item in listings_data]
-        mean_price = sum(prices) / len(prices)
-        median_price = prices[len(prices) // 2] if len(prices) % 2 == 1 else (prices[len(prices) // 2 - 1] + prices[len(prices) // 2]) / 2
-        min_price = min(prices)
-        max_price = max(prices)
-        variance = sum((x - mean_price) ** 2 for x in prices) / len(prices)
-        std_dev = variance ** 0.5
-        coeff_variation = (std_dev / mean_price) * 100 if mean_price > 0 else 0
-        return {
-            "make": make,
-            "model": model,
-            "trim": trim,
-            "year": year,
-            "total_listings": len(listings_data),
-            "listings": listings_data,
-            "average_price": round(mean_price, 2),
-            "median_price": round(median_price, 2),
-            "min_price": min_price,
-            "max_price": max_price,
-            "standard_deviation": round(std_dev, 2),
-            "coefficient_of_variation": round(coeff_variation, 2)
-        }
+        rows, next_cursor = split_page(rows, limit, PRICE_SPREAD_SORT)
+        lower_fence, upper_fence = stats["lower_fence"], stats["upper_fence"]
+        listings = []
+        for row in rows:
+            listing = dict(zip(cols[:8], row[:8]))
+            price = float(listing["price"])
+            listing["outlier"] = "low" if price < lower_fence else "high" if price > upper_fence else None
+            listings.append(listing)
+        return FastJSONResponse(
+            {
+                "make": make,
+                "model": model,
+                "trim": trim,
+                "year": year,
+                "total_listings": stats["total_listings"],
+                "unique_listings": stats["unique_listings"],
+                "listings": listings,
+                "next_cursor": next_cursor,
+                **_spread_summary(stats, bins),
+            },
+            headers={"X-Next-Cursor": next_cursor} if next_cursor else None,
+        )
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error getting price spread analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get price spread analysis: {str(e)}")
-    finally:
-        cur.close()
-        conn.close()
+
+# Drops are history rows below the row before them, found through the primary
+# key; the time window is a range scan of observed_at, newest first
+PRICE_DROPS = """
+    SELECT h.ad_id, l.url, l.title, l.website, l.brand, l.model, l.year,
+           p.price AS previous_price, h.price, p.price - h.price AS drop_amount,
+           ROUND(100 * (p.price - h.price) / p.price, 2) AS drop_percent, h.observed_at
+    FROM listing_price_history h
+    CROSS JOIN LATERAL (
+        SELECT b.price FROM listing_price_history b
+        WHERE b.ad_id = h.ad_id AND b.observed_at < h.observed_at
+        ORDER BY b.observed_at DESC
+        LIMIT 1
+    ) p
+    JOIN listings l ON l.ad_id = h.ad_id
+    WHERE h.observed_at >= (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+      AND h.price < p.price AND {where}
+    ORDER BY h.observed_at DESC, h.ad_id
+    LIMIT %s
+"""
+
+@router.get("/price-drops")
+async def get_price_drops(
+    days: int = Query(7, ge=1, le=365, description="How far back to look"),
+    websites: str = Query(None, description="Comma-separated list of websites to filter by"),
+    limit: int = Query(100, ge=1, le=500),
+):
+    """Price drops recorded in the last `days` days, newest first; a listing that dropped twice is listed twice"""
+    try:
+        website_list = _split_websites(websites)
+        where_clause, params = ("l.website = ANY(%s)", [website_list]) if website_list else ("TRUE", [])
+        price_drops = await adb.fetch_dicts(PRICE_DROPS.format(where=where_clause), [days, *params, limit])
+        return FastJSONResponse({"days": days, "websites": website_list, "price_drops": price_drops})
+    except Exception as e:
+        logger.error(f"Error getting price drops: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get price drops: {str(e)}")
 
 @router.get("/years")
-def get_years(make: str = Query(...), model: str = Query(...)):
+def get_years(make: str = Query(...), model: str = Query(...), conn=Depends(get_db)):
     """Get the range of years for a specific make and model"""
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database connection failed")
     try:
         cur = conn.cursor()
         query = """
@@ -518,4 +640,199 @@ def get_years(make: str = Query(...), model: str = Query(...)):
         raise HTTPException(status_code=500, detail=f"Failed to get years: {str(e)}")
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+
+# Year range and price spread of every batch segment in one statement. Each
+# segment's brand/model patterns are first resolved to the exact (brand, model)
+# pairs they match ({pairs}: from the facet catalog, else by ILIKE over the
+# distinct pairs), so listings are joined on equality and read once however
+# many segments ask. `counted` applies the trim and website filters, which the
+# year range (like /years) ignores. `yearly` holds each segment's per-year price
+# statistics as _query_yearly_prices computes them (one float8 row per year, see
+# _batch_yearly), for when the price cube isn't loaded; its %s turns it off otherwise.
+# As in PRICE_SPREAD_STATS, the spread takes one price per car.
+BATCH_SEGMENT_STATS = """
+WITH segments (idx, trim, year) AS (
+    SELECT * FROM unnest(%s::int[], %s::text[], %s::int[])
+),
+segment_pairs (idx, brand, model) AS (
+    {pairs}
+),
+matched AS MATERIALIZED (
+    SELECT s.idx, l.year, l.price::float8 AS price, l.ad_id, COALESCE(l.duplicate_group_id, l.ad_id) AS car, l.post_date,
+           l.price > 0 AND (s.trim IS NULL OR l.trim ILIKE s.trim) AND {websites} AS counted,
+           l.year = s.year AS in_year
+    FROM segments s
+    JOIN segment_pairs p USING (idx)
+    JOIN listings l ON l.brand = p.brand AND l.model = p.model
+),
+spread_counts AS (
+    SELECT idx, COUNT(*) AS total_listings FROM matched WHERE counted AND in_year GROUP BY idx
+),
+spread_rows AS (
+    SELECT DISTINCT ON (idx, car) idx, price
+    FROM matched
+    WHERE counted AND in_year
+    ORDER BY idx, car, post_date DESC NULLS LAST, ad_id
+),
+years AS (
+    SELECT idx, MIN(year) AS min_year, MAX(year) AS max_year FROM matched GROUP BY idx
+),
+yearly AS (
+    SELECT idx, array_agg(ARRAY[year, average_price, listing_count, min_price, max_price,
+                                percentiles[1], percentiles[2], percentiles[3]] ORDER BY year) AS yearly
+    FROM (
+        SELECT idx, year, AVG(price) AS average_price, COUNT(*) AS listing_count,
+               MIN(price) AS min_price, MAX(price) AS max_price,
+               percentile_cont(ARRAY[0.1, 0.5, 0.9]) WITHIN GROUP (ORDER BY price) AS percentiles
+        FROM matched
+        WHERE %s AND counted AND year IS NOT NULL
+        GROUP BY idx, year
+    ) y
+    GROUP BY idx
+),
+stats AS (
+    SELECT idx,
+           COUNT(*) AS unique_listings,
+           AVG(price) AS average_price,
+           stddev_pop(price) AS standard_deviation,
+           MIN(price) AS min_price,
+           MAX(price) AS max_price,
+           percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY price) AS quartiles
+    FROM spread_rows
+    GROUP BY idx
+),
+fences AS (
+    SELECT idx,
+           quartiles[1] - 1.5 * (quartiles[3] - quartiles[1]) AS lower_fence,
+           quartiles[3] + 1.5 * (quartiles[3] - quartiles[1]) AS upper_fence
+    FROM stats
+),
+outliers AS (
+    SELECT r.idx,
+           COUNT(*) FILTER (WHERE r.price < f.lower_fence) AS low_outliers,
+           COUNT(*) FILTER (WHERE r.price > f.upper_fence) AS high_outliers
+    FROM spread_rows r JOIN fences f USING (idx)
+    GROUP BY r.idx
+),
+histograms AS (
+    SELECT idx, array_agg(bin ORDER BY bin) AS bins, array_agg(n ORDER BY bin) AS bin_counts
+    FROM (
+        SELECT r.idx,
+               CASE WHEN p.max_price > p.min_price
+                    THEN LEAST(width_bucket(r.price, p.min_price, p.max_price, %s), %s) ELSE 1 END AS bin,
+               COUNT(*) AS n
+        FROM spread_rows r JOIN stats p USING (idx)
+        GROUP BY 1, 2
+    ) b
+    GROUP BY idx
+)
+SELECT s.idx, y.min_year, y.max_year,
+       COALESCE(c.total_listings, 0) AS total_listings, COALESCE(p.unique_listings, 0) AS unique_listings, p.average_price, p.standard_deviation,
+       p.min_price, p.max_price, p.quartiles, f.lower_fence, f.upper_fence,
+       o.low_outliers, o.high_outliers, h.bins, h.bin_counts, v.yearly
+FROM segments s
+LEFT JOIN years y USING (idx)
+LEFT JOIN yearly v USING (idx)
+LEFT JOIN spread_counts c USING (idx)
+LEFT JOIN stats p USING (idx)
+LEFT JOIN fences f USING (idx)
+LEFT JOIN outliers o USING (idx)
+LEFT JOIN histograms h USING (idx)
+ORDER BY s.idx
+"""
+
+async def _batch_segment_stats(segments, website_list, bins: int, yearly: bool):
+    """BATCH_SEGMENT_STATS rows for (make, model, trim, year) segments, in order"""
+    resolved = [facet_catalog.brand_model_pairs(make, model) for make, model, _, _ in segments]
+    if all(pairs is not None for pairs in resolved):
+        pairs_sql = "SELECT * FROM unnest(%s::int[], %s::text[], %s::text[])"
+        flat = [(idx, brand, model) for idx, pairs in enumerate(resolved) for brand, model in pairs]
+        pairs_params = [[p[0] for p in flat], [p[1] for p in flat], [p[2] for p in flat]]
+    else:
+        pairs_sql = """
+        SELECT s.idx, b.brand, b.model
+        FROM unnest(%s::int[], %s::text[], %s::text[]) AS s(idx, make, model)
+        JOIN (SELECT DISTINCT brand, model FROM listings) b ON b.brand ILIKE s.make AND b.model ILIKE s.model
+        """
+        pairs_params = [list(range(len(segments))), [f"%{s[0]}%" for s in segments], [f"%{s[1]}%" for s in segments]]
+    params = [
+        list(range(len(segments))),
+        [f"%{trim}%" if trim else None for _, _, trim, _ in segments],
+        [year for _, _, _, year in segments],
+        *pairs_params,
+    ]
+    if website_list:
+        websites_sql = "(" + " OR ".join(["l.website ILIKE %s"] * len(website_list)) + ")"
+        params.extend([f"%{w}%" for w in website_list])
+    else:
+        websites_sql = "TRUE"
+    params.extend([yearly, bins, bins])
+    return await adb.fetch_dicts(BATCH_SEGMENT_STATS.format(pairs=pairs_sql, websites=websites_sql), params)
+
+def _batch_yearly(row, trim: str = None):
+    """A BATCH_SEGMENT_STATS row's `yearly` as _query_yearly_prices rows"""
+    return _enough_listings([
+        {"year": int(year), "average_price": average, "listing_count": int(count), "min_price": low,
+         "max_price": high, "p10_price": p10, "median_price": median, "p90_price": p90}
+        for year, average, count, low, high, p10, median, p90 in row["yearly"] or []
+    ], trim)
+
+def _segment_error(status_code: int, detail: str):
+    return {"error": {"status_code": status_code, "detail": detail}}
+
+@router.post("/batch")
+async def get_batch_analytics(request: AnalyticsBatch):
+    """
+    Depreciation, price spread and year range for many segments in one round trip.
+    Year ranges and spreads come from one set-based query over all segments (the
+    spread without its listings; page those with /price-spread), depreciation from
+    the price cube, or from the same query while the cube isn't loaded. A segment that can't be answered carries its own `error`
+    instead of failing the request.
+    """
+    try:
+        website_list = _split_websites(request.websites)
+        segments = [
+            (s.make, s.model, s.trim.strip() if s.trim and s.trim.strip() else None, s.year)
+            for s in request.segments
+        ]
+        stats_rows = await _batch_segment_stats(segments, website_list, request.bins, yearly=not price_cube.loaded)
+        if price_cube.loaded:
+            yearly = [await _yearly_prices(make, model, trim, website_list) for make, model, trim, _ in segments]
+        else:
+            yearly = [_batch_yearly(row, trim) for (_, _, trim, _), row in zip(segments, stats_rows)]
+        curves = fit_curves(yearly)
+
+        results = []
+        for (make, model, trim, year), stats, yearly_data, curve in zip(segments, stats_rows, yearly, curves):
+            result = {
+                "make": make,
+                "model": model,
+                "trim": trim,
+                "year": year,
+                "years": {"min_year": stats["min_year"], "max_year": stats["max_year"]},
+            }
+            trim_text = f" {trim}" if trim else ""
+            if not yearly_data:
+                result["depreciation"] = _segment_error(404, f"No sufficient data found for {make} {model}{trim_text}")
+            else:
+                try:
+                    result["depreciation"] = _depreciation_summary(yearly_data, curve)
+                except HTTPException as e:
+                    result["depreciation"] = _segment_error(e.status_code, e.detail)
+            if year is None:
+                result["price_spread"] = None
+            elif not stats["total_listings"]:
+                result["price_spread"] = _segment_error(404, f"No data found for {make} {model}{trim_text} {year}")
+            else:
+                result["price_spread"] = {
+                    "total_listings": stats["total_listings"],
+                    "unique_listings": stats["unique_listings"],
+                    **_spread_summary(stats, request.bins),
+                }
+            results.append(result)
+        return FastJSONResponse({"results": results})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting batch analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get batch analytics: {str(e)}")
@@ -1,5 +1,6 @@
 import uvicorn
 import os
+import sys
 
 if __name__ == "__main__":
     print("🚀 Starting Markaba Backend...")
@@ -23,5 +24,11 @@ if __name__ == "__main__":
     print(f"🔍 Database user: {os.environ.get('aiven-pg-user', 'NOT SET')}")
     print(f"🔍 SSL cert path: {os.environ.get('aiven-pg-sslrootcert', 'NOT SET')}")
     
+    if os.environ.get("APP_ENV", "development") == "production":
+        # Multi-worker server with warm-up and graceful drain (see gunicorn.conf.py)
+        print("🌟 Starting the application with gunicorn...")
+        sys.stdout.flush()
+        os.execvp("gunicorn", ["gunicorn", "-c", "gunicorn.conf.py", "main:app"])
+
     print("🌟 Starting the application...")
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,201 @@
+"""
+Train the per-segment valuation models /valuation reports as `model_estimate`.
+
+    python train_valuation.py [--workers N] [--min-listings 30] [--output DIR]
+
+Streams the priced listings (with CarSwitch's fair_value where it has one)
+through a server-side cursor, fits one model per brand/model in a process
+pool, then writes a new version under DIR (default: VALUATION_MODEL_DIR)
+and points DIR/CURRENT at it. Serving workers pick the new version up on
+their next check; older versions are left for rollback.
+
+Each segment is scored on a holdout (every listing whose ad_id hashes to
+fold 0 of HOLDOUT_FOLDS) before being refitted on all its listings.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import logging
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from database_connection_service.db_connection import get_connection
+from valuation_model import (
+    FEATURES, MILEAGE_UNIT, MANIFEST_FILE, COEFFICIENTS_FILE, TRIM_OFFSETS_FILE, CURRENT_FILE,
+    ValuationModel, segment_key, design, fit_segment, predict_log,
+)
+
+logger = logging.getLogger(__name__)
+
+TRAINING_QUERY = """
+    SELECT l.ad_id, l.brand, l.model, l.trim, l.year, l.mileage, l.price::float8, c.fair_value::float8
+    FROM listings l
+    LEFT JOIN carswitch_details c ON c.ad_id = l.ad_id
+    WHERE l.price > 0 AND l.brand IS NOT NULL AND l.model IS NOT NULL AND l.year IS NOT NULL
+"""
+HOLDOUT_FOLDS = 5
+
+
+class _Shard:
+    """One segment's training rows, accumulated while streaming."""
+
+    __slots__ = ("year", "mileage", "trim", "price", "fair_value", "holdout")
+
+    def __init__(self):
+        self.year, self.mileage, self.trim, self.price, self.fair_value, self.holdout = [], [], [], [], [], []
+
+    def add(self, ad_id, trim, year, mileage, price, fair_value):
+        self.year.append(year)
+        self.mileage.append(np.nan if mileage is None else mileage)
+        self.trim.append(trim.strip().lower() if trim and trim.strip() else None)
+        self.price.append(price)
+        self.fair_value.append(np.nan if not fair_value else fair_value)
+        self.holdout.append(zlib.crc32(ad_id.encode()) % HOLDOUT_FOLDS == 0)
+
+    def arrays(self):
+        trims = sorted({t for t in self.trim if t is not None})
+        codes = {t: i for i, t in enumerate(trims)}
+        return {
+            "year": np.array(self.year, dtype=np.float64),
+            "mileage": np.array(self.mileage, dtype=np.float64),
+            "trim": np.array([codes[t] if t is not None else -1 for t in self.trim], dtype=np.int64),
+            "trims": trims,
+            "price": np.array(self.price, dtype=np.float64),
+            "fair_value": np.array(self.fair_value, dtype=np.float64),
+            "holdout": np.array(self.holdout, dtype=bool),
+        }
+
+
+def stream_shards(conn, batch_size):
+    """Training rows per segment key, read through a named (server-side) cursor."""
+    shards = {}
+    rows = 0
+    # Named cursors need a transaction; the read is consistent as a bonus
+    conn.autocommit = False
+    with conn:
+        with conn.cursor(name="valuation_training") as cur:
+            cur.itersize = batch_size
+            cur.execute(TRAINING_QUERY)
+            for ad_id, brand, model, trim, year, mileage, price, fair_value in cur:
+                key = segment_key(brand, model)
+                shard = shards.get(key)
+                if shard is None:
+                    shard = shards[key] = _Shard()
+                shard.add(ad_id, trim, year, mileage, price, fair_value)
+                rows += 1
+    return shards, rows
+
+
+def _errors(predicted, actual):
+    ape = np.abs(predicted - actual) / actual
+    return {"mape": round(float(ape.mean() * 100), 2), "median_ape": round(float(np.median(ape) * 100), 2)}
+
+
+def train_segment(key, data, reference_year):
+    """Process-pool task: holdout metrics, then the model refitted on every row."""
+    start = time.perf_counter()
+    n_trims = len(data["trims"])
+    year, mileage, trim, price = data["year"], data["mileage"], data["trim"], data["price"]
+    holdout = data["holdout"]
+    metrics = {"listings": len(price), "holdout": int(holdout.sum())}
+    if holdout.any() and (~holdout).sum() > len(FEATURES):
+        train = ~holdout
+        coefficients, offsets = fit_segment(year[train], mileage[train], trim[train], n_trims, price[train], reference_year)
+        predicted = np.exp(predict_log(design(year[holdout], mileage[holdout], reference_year), trim[holdout], coefficients, offsets))
+        metrics.update(_errors(predicted, price[holdout]))
+    coefficients, offsets = fit_segment(year, mileage, trim, n_trims, price, reference_year)
+    # CarSwitch's own fair value as a sanity target (in-sample)
+    fair = ~np.isnan(data["fair_value"])
+    if fair.any():
+        predicted = np.exp(predict_log(design(year[fair], mileage[fair], reference_year), trim[fair], coefficients, offsets))
+        metrics["fair_value_listings"] = int(fair.sum())
+        metrics["fair_value_mape"] = _errors(predicted, data["fair_value"][fair])["mape"]
+    metrics["seconds"] = round(time.perf_counter() - start, 3)
+    return key, coefficients, offsets, data["trims"], metrics
+
+
+def write_artifacts(output, version, reference_year, results, training_seconds):
+    """Write `version` beside the others and point CURRENT at it; each step is an atomic rename."""
+    keys = sorted(results)
+    coefficients = np.array([results[k][0] for k in keys], dtype=np.float32).reshape(len(keys), len(FEATURES))
+    offsets = np.concatenate([results[k][1] for k in keys] or [np.zeros(0)]).astype(np.float32)
+    segments, start = {}, 0
+    for row, key in enumerate(keys):
+        _, segment_offsets, trims, metrics = results[key]
+        segments[key] = {"row": row, "trims": trims, "trim_offset": start, "metrics": metrics}
+        start += len(segment_offsets)
+    manifest = {
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "reference_year": reference_year,
+        "features": FEATURES,
+        "mileage_unit": MILEAGE_UNIT,
+        "training_seconds": training_seconds,
+        "segments": segments,
+    }
+    os.makedirs(output, exist_ok=True)
+    staging = os.path.join(output, f".{version}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    np.save(os.path.join(staging, COEFFICIENTS_FILE), coefficients)
+    np.save(os.path.join(staging, TRIM_OFFSETS_FILE), offsets)
+    with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+    os.replace(staging, os.path.join(output, version))
+    with open(os.path.join(output, f".{CURRENT_FILE}.tmp"), "w") as f:
+        f.write(version)
+    os.replace(os.path.join(output, f".{CURRENT_FILE}.tmp"), os.path.join(output, CURRENT_FILE))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Train the per-segment valuation models")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--min-listings", type=int, default=30, help="Segments with fewer listings get no model")
+    parser.add_argument("--output", default=ValuationModel.from_env().directory)
+    parser.add_argument("--batch-size", type=int, default=20000, help="Rows fetched per round trip")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    conn = get_connection()
+    if not conn:
+        sys.exit("Database connection failed")
+    try:
+        shards, rows = stream_shards(conn, args.batch_size)
+    finally:
+        conn.close()
+    read_seconds = time.perf_counter() - start
+    reference_year = max((max(s.year) for s in shards.values()), default=0)
+    trained = {k: s for k, s in shards.items() if len(s.price) >= args.min_listings}
+    logger.info(f"Read {rows} listings in {len(shards)} segments in {read_seconds:.1f}s; training {len(trained)} segments")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(train_segment, key, shard.arrays(), reference_year) for key, shard in trained.items()]
+        for future in as_completed(futures):
+            key, coefficients, offsets, trims, metrics = future.result()
+            results[key] = (coefficients, offsets, trims, metrics)
+    training_seconds = round(time.perf_counter() - start, 2)
+
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    write_artifacts(args.output, version, reference_year, results, training_seconds)
+
+    print(f"{'segment':<32} {'listings':>8} {'holdout':>7} {'mape%':>7} {'mdape%':>7} {'fair_mape%':>10} {'sec':>6}")
+    for key in sorted(results, key=lambda k: -results[k][3]["listings"]):
+        m = results[key][3]
+        print(f"{key:<32} {m['listings']:>8} {m['holdout']:>7} {m.get('mape', '-'):>7} {m.get('median_ape', '-'):>7} "
+              f"{m.get('fair_value_mape', '-'):>10} {m['seconds']:>6}")
+    scored = [m for _, _, _, m in results.values() if "mape" in m]
+    if scored:
+        overall = sum(m["mape"] * m["holdout"] for m in scored) / sum(m["holdout"] for m in scored)
+        logger.info(f"Holdout MAPE over {len(scored)} segments: {overall:.2f}%")
+    logger.info(f"Wrote valuation model {version} to {args.output} ({len(results)} segments) in {training_seconds}s "
+                f"(reading {read_seconds:.1f}s)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Per (brand, model) segment, log(price) is linear in these features plus an
+# offset per trim; the offsets are ridge-shrunk so a trim seen a few times
+# stays close to the segment's average
+FEATURES = ["intercept", "age", "age_squared", "mileage", "mileage_missing"]
+MILEAGE_UNIT = 100000.0
+MAX_MILEAGE = 500000.0
+BASE_RIDGE = 1e-3
+TRIM_RIDGE = 5.0
+# Training rows whose residual is further than this many robust sigmas are dropped before the refit
+OUTLIER_SIGMAS = 3.0
+
+MANIFEST_FILE = "manifest.json"
+COEFFICIENTS_FILE = "coefficients.npy"
+TRIM_OFFSETS_FILE = "trim_offsets.npy"
+CURRENT_FILE = "CURRENT"
+
+
+def segment_key(brand, model):
+    return f"{brand.strip().lower()}|{model.strip().lower()}"
+
+
+def design(year, mileage, reference_year):
+    """Feature matrix (FEATURES columns) for arrays of years and mileages (NaN when unknown)."""
+    age = reference_year - np.asarray(year, dtype=np.float64)
+    mileage = np.asarray(mileage, dtype=np.float64)
+    missing = np.isnan(mileage)
+    scaled = np.where(missing, 0.0, np.clip(mileage, 0.0, MAX_MILEAGE) / MILEAGE_UNIT)
+    return np.column_stack([np.ones_like(age), age, age ** 2, scaled, missing.astype(np.float64)])
+
+
+def _solve(features, trims, n_trims, log_price):
+    one_hot = np.zeros((len(trims), n_trims))
+    known = trims >= 0
+    one_hot[np.flatnonzero(known), trims[known]] = 1.0
+    a = np.hstack([features, one_hot])
+    penalty = np.r_[0.0, np.full(features.shape[1] - 1, BASE_RIDGE), np.full(n_trims, TRIM_RIDGE)]
+    beta = np.linalg.solve(a.T @ a + np.diag(penalty), a.T @ log_price)
+    return beta[:features.shape[1]], beta[features.shape[1]:]
+
+
+def fit_segment(year, mileage, trims, n_trims, price, reference_year):
+    """
+    Ridge least squares of log(price) for one segment; `trims` are codes in
+    [0, n_trims) or -1 for none. Fitted twice, the second time without the
+    rows the first fit puts more than OUTLIER_SIGMAS robust sigmas away.
+    Returns (coefficients over FEATURES, trim offsets).
+    """
+    features = design(year, mileage, reference_year)
+    log_price = np.log(price)
+    coefficients, offsets = _solve(features, trims, n_trims, log_price)
+    residual = log_price - predict_log(features, trims, coefficients, offsets)
+    sigma = 1.4826 * np.median(np.abs(residual - np.median(residual)))
+    keep = np.abs(residual) <= OUTLIER_SIGMAS * sigma if sigma > 0 else np.ones(len(price), bool)
+    if keep.sum() > len(FEATURES) and not keep.all():
+        coefficients, offsets = _solve(features[keep], trims[keep], n_trims, log_price[keep])
+    return coefficients, offsets
+
+
+def predict_log(features, trims, coefficients, offsets):
+    """log(price) for feature rows and trim codes (-1: no offset)."""
+    trim_offset = np.zeros(len(trims))
+    known = trims >= 0
+    trim_offset[known] = offsets[trims[known]]
+    return features @ coefficients + trim_offset
+
+
+class ValuationModel:
+    """
+    The per-segment models train_valuation.py writes, for /valuation.
+
+    `directory` holds one subdirectory per trained version and CURRENT, the
+    name of the one to serve. Nothing is read until the first prediction;
+    the coefficient arrays are then memory-mapped, so only the pages of the
+    segments asked about are touched. CURRENT is re-read at most every
+    `check_interval` seconds and a new version is swapped in on the next
+    prediction.
+    """
+
+    def __init__(self, directory, check_interval=60.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._version = None
+        self._manifest = None
+        self._coefficients = None
+        self._offsets = None
+        self._checked = None
+        self.predictions = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("VALUATION_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "valuation")),
+            check_interval=float(os.getenv("VALUATION_MODEL_CHECK_SECONDS", 60)),
+        )
+
+    def _current(self):
+        """The served version's manifest, loading a new CURRENT when due; None without one."""
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.check_interval:
+            return self._manifest
+        self._checked = now
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return self._manifest
+        if version != self._version:
+            path = os.path.join(self.directory, version)
+            try:
+                with open(os.path.join(path, MANIFEST_FILE)) as f:
+                    manifest = json.load(f)
+                coefficients = np.load(os.path.join(path, COEFFICIENTS_FILE), mmap_mode='r')
+                offsets = np.load(os.path.join(path, TRIM_OFFSETS_FILE), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load valuation model {version}: {e}")
+                return self._manifest
+            self._manifest, self._coefficients, self._offsets, self._version = manifest, coefficients, offsets, version
+            logger.info(f"Valuation model {version} loaded: {len(manifest['segments'])} segments")
+        return self._manifest
+
+    def version(self):
+        """The version the next prediction will use, loading a new CURRENT when due; None without one."""
+        self._current()
+        return self._version
+
+    def predict(self, brand: str, model: str, year: int, mileage: float = None, trim: str = None):
+        """The segment model's price for the spec with its holdout error, or None when there is no model for it."""
+        manifest = self._current()
+        if manifest is None:
+            return None
+        segment = manifest["segments"].get(segment_key(brand, model))
+        if segment is None:
+            return None
+        features = design([year], [np.nan if mileage is None else mileage], manifest["reference_year"])
+        coefficients = np.asarray(self._coefficients[segment["row"]], dtype=np.float64)
+        trims = segment["trims"]
+        start = segment["trim_offset"]
+        offsets = np.asarray(self._offsets[start:start + len(trims)], dtype=np.float64)
+        code = trims.index(trim.strip().lower()) if trim and trim.strip().lower() in trims else -1
+        log_price = predict_log(features, np.array([code]), coefficients, offsets)[0]
+        self.predictions += 1
+        return {
+            "price": round(float(np.exp(log_price)), 2),
+            "version": self._version,
+            "trim_known": code >= 0,
+            "holdout_mape": segment["metrics"].get("mape"),
+        }
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "version": self._version,
+            "segments": len(self._manifest["segments"]) if self._manifest else 0,
+            "predictions": self.predictions,
+        }
+
+
+valuation_model = ValuationModel.from_env()
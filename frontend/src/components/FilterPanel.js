@@ -6,7 +6,7 @@ import { getTransmissionType, getBodyType, getColor } from '../utils/mappings';
 import API_BASE_URL from '../config/api';
 import { FaBuilding, FaUser, FaChartBar, FaTimes } from 'react-icons/fa';
 
-const FilterPanel = ({ filters, onFilterChange, totalCount }) => {
+const FilterPanel = ({ filters, onFilterChange, totalCount, totalCountExact = true }) => {
 
   const [makes, setMakes] = useState([]);
   const [models, setModels] = useState([]);
@@ -377,7 +377,7 @@ const FilterPanel = ({ filters, onFilterChange, totalCount }) => {
       {totalCount !== undefined && (
           <div className="results-count">
             <span className="count-text">
-              {totalCount.toLocaleString()} {totalCount === 1 ? 'result' : 'results'} found
+              {totalCount.toLocaleString()}{totalCountExact ? '' : '+'} {totalCount === 1 ? 'result' : 'results'} found
             </span>
           </div>
         )}
@@ -17,6 +17,7 @@ const ListingsPage = () => {
   const [currentPage, setCurrentPage] = useState(1);
   const [totalPages, setTotalPages] = useState(1);
   const [totalCount, setTotalCount] = useState(0);
+  const [totalCountExact, setTotalCountExact] = useState(true);
   const listingsPerPage = 40;
   
   // Sort state
@@ -226,6 +227,7 @@ const ListingsPage = () => {
       setListings(response.data.items || []);
       setTotalPages(Math.ceil((response.data.total_count || 0) / listingsPerPage));
       setTotalCount(response.data.total_count || 0);
+      setTotalCountExact(response.data.total_count_exact !== false);
       setLoading(false);
     } catch (err) {
       setError('Error fetching listings. Please try again later.');
@@ -272,6 +274,7 @@ const ListingsPage = () => {
             filters={filters} 
             onFilterChange={handleFilterChange}
             totalCount={totalCount}
+            totalCountExact={totalCountExact}
           />
         </div>
         
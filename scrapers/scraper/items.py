@@ -94,6 +94,8 @@ class DubizzleItem(scrapy.Item):
     # ——— Timing ———
     post_date            = scrapy.Field()  # from JSON-LD or dataLayer
     date_scraped = scrapy.Field()
+    expected_price       = scrapy.Field()  # segment median price (DealScoringPipeline)
+    deal_score           = scrapy.Field()  # % below expected_price
 
 class OpenSooqItem(scrapy.Item):
 
@@ -125,6 +127,8 @@ class OpenSooqItem(scrapy.Item):
 
 
     date_scraped                = scrapy.Field()
+    expected_price              = scrapy.Field()  # segment median price (DealScoringPipeline)
+    deal_score                  = scrapy.Field()  # % below expected_price
 
     engine_size                 = scrapy.Field()
     body_type            = scrapy.Field()
@@ -163,6 +167,8 @@ class OpenSooqItem(scrapy.Item):
      # ——— Timing ———
     post_date            = scrapy.Field()  # from JSON-LD or dataLayer
     date_scraped         = scrapy.Field()
+    expected_price       = scrapy.Field()  # segment median price (DealScoringPipeline)
+    deal_score           = scrapy.Field()  # % below expected_price
 
     image_url            = scrapy.Field()  # first/thumb
     number_of_images     = scrapy.Field()  # count of photos
@@ -213,6 +219,8 @@ class CarSwitchItem(scrapy.Item):
     number_of_images   = scrapy.Field()  # int count of images
     post_date          = scrapy.Field()  # datetime of listing
     date_scraped       = scrapy.Field()  # datetime when scraped
+    expected_price     = scrapy.Field()  # segment median price (DealScoringPipeline)
+    deal_score         = scrapy.Field()  # % below expected_price
 
 
     # --- Extra Features ---
@@ -330,6 +338,8 @@ class SyarahItem():
     number_of_images   = scrapy.Field()  # int count of images
     post_date          = scrapy.Field()  # datetime of listing
     date_scraped       = scrapy.Field()  # datetime when scraped
+    expected_price     = scrapy.Field()  # segment median price (DealScoringPipeline)
+    deal_score         = scrapy.Field()  # % below expected_price
 
 
     is_sold            = scrapy.Field()
@@ -11,8 +11,12 @@ from scripts.utils import normalize_ar, normalize_en
 import os
 
 import json
+import math
+import time
+import numpy as np
 from flashtext import KeywordProcessor
 from rapidfuzz import process
+from twisted.internet import defer, task
 
 import psycopg2
 from scrapy.exceptions import NotConfigured
@@ -78,15 +82,57 @@ class BasePostgresPipeline:
         'post_date':        'TIMESTAMP',
         'date_scraped':     'TIMESTAMP',
         'trim':             'TEXT',
+        'expected_price':   'NUMERIC',   # set by DealScoringPipeline
+        'deal_score':       'NUMERIC',
     }
 
+    # Per website and post day counts/price sums behind the analytics stats;
+    # '-infinity' is the day of listings without a post_date
+    rollup_table = 'listing_daily_rollup'
+    rollup_schema = {
+        'website':   'TEXT NOT NULL',
+        'day':       'DATE NOT NULL',
+        'listings':  'BIGINT NOT NULL DEFAULT 0',
+        'priced':    'BIGINT NOT NULL DEFAULT 0',
+        'price_sum': 'NUMERIC NOT NULL DEFAULT 0',
+    }
+
+    # A row per price a listing has been seen at, written by the upsert when the
+    # price differs from the stored one; observed_at is the scrape that saw it
+    history_table = 'listing_price_history'
+    history_schema = {
+        'ad_id':       'TEXT NOT NULL REFERENCES listings(ad_id) ON DELETE CASCADE',
+        'observed_at': 'TIMESTAMP NOT NULL',
+        'price':       'NUMERIC NOT NULL',
+    }
+
+    # Not compared when deciding whether a re-scrape changed the listing: the
+    # scrape time, and the deal score derived from segment medians that move
+    # between crawls. They are written along with any scraped column that did change,
+    # so date_scraped is the scrape that last changed the listing or its details,
+    # not the last one that saw it.
+    change_ignored = ('date_scraped', 'expected_price', 'deal_score')
+
+    # Not scraped: assigned by the database when the listing is inserted or
+    # changes, so it orders writes by when they happened rather than by each
+    # spider's clock. The API's incremental refreshes read it as their change feed.
+    change_marker = 'changed_at'
+    change_marker_type = "TIMESTAMP NOT NULL DEFAULT (clock_timestamp() AT TIME ZONE 'UTC')"
+
     # Subclasses configure these
     detail_table = None          # e.g. 'dubizzle_details'
     detail_schema = None         # dict of detail columns -> SQL types
 
-    def __init__(self, conn_params):
+    # Bytes of pairs per NOTIFY payload; Postgres caps payloads at 8000 bytes
+    notify_max_bytes = 7500
+
+    def __init__(self, conn_params, notify_channel=None, notify_every=200):
         self.conn_params = conn_params
         self.conn = None
+        self.notify_channel = notify_channel
+        self.notify_every = notify_every
+        self.upserted = set()       # (website, brand) pairs not yet announced
+        self.pending = 0
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -101,7 +147,11 @@ class BasePostgresPipeline:
         )
         if not all(params.values()):
             raise NotConfigured(f"{cls.__name__}: incomplete Postgres settings")
-        return cls(params)
+        return cls(
+            params,
+            notify_channel=crawler.settings.get('POSTGRES_NOTIFY_CHANNEL'),
+            notify_every=crawler.settings.getint('POSTGRES_NOTIFY_EVERY', 200),
+        )
 
     def open_spider(self, spider):
         # Establish connection
@@ -114,8 +164,29 @@ class BasePostgresPipeline:
             core_cols = ",\n  ".join(f"{col} {typ}" for col, typ in self.core_schema.items())
             cur.execute(f"""
             CREATE TABLE IF NOT EXISTS {self.table} (
-              {core_cols}
+              {core_cols},
+              {self.change_marker} {self.change_marker_type}
+            );
+            CREATE INDEX IF NOT EXISTS idx_{self.table}_{self.change_marker}
+              ON {self.table} ({self.change_marker});
+            """)
+
+            rollup_cols = ",\n  ".join(f"{col} {typ}" for col, typ in self.rollup_schema.items())
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.rollup_table} (
+              {rollup_cols},
+              PRIMARY KEY (website, day)
+            );
+            """)
+
+            history_cols = ",\n  ".join(f"{col} {typ}" for col, typ in self.history_schema.items())
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.history_table} (
+              {history_cols},
+              PRIMARY KEY (ad_id, observed_at)
             );
+            CREATE INDEX IF NOT EXISTS idx_{self.history_table}_observed_at
+              ON {self.history_table} (observed_at);
             """)
 
             # Create detail table if provided
@@ -131,9 +202,36 @@ class BasePostgresPipeline:
 
     def close_spider(self, spider):
         if self.conn:
+            self.notify_upserted(spider)
             self.conn.close()
             spider.logger.info(f"{self.__class__.__name__}: connection closed.")
 
+    def notify_upserted(self, spider):
+        """
+        Tell the API which (website, brand) pairs were upserted since the last
+        call, so it only drops the cached responses those listings can change.
+        """
+        if not self.notify_channel or not self.upserted:
+            return
+        payloads, batch, size = [], [], 0
+        for pair in sorted(self.upserted, key=lambda p: (p[0] or '', p[1] or '')):
+            pair_size = len(json.dumps(pair).encode('utf-8')) + 2
+            if batch and size + pair_size > self.notify_max_bytes:
+                payloads.append(json.dumps({'pairs': batch}))
+                batch, size = [], 0
+            batch.append(pair)
+            size += pair_size
+        payloads.append(json.dumps({'pairs': batch}))
+        try:
+            with self.conn.cursor() as cur:
+                for payload in payloads:
+                    cur.execute("SELECT pg_notify(%s, %s)", (self.notify_channel, payload))
+        except psycopg2.Error as e:
+            # The API falls back to its TTL; never fail the crawl over it
+            spider.logger.warning(f"[DB] NOTIFY {self.notify_channel} failed: {e}")
+        self.upserted.clear()
+        self.pending = 0
+
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
 
@@ -148,28 +246,91 @@ class BasePostgresPipeline:
         else:
             detail_cols = detail_data = None
 
-        # Helper to create upsert SQL
-        def build_upsert(table, cols):
+        # Helper to create upsert SQL; an existing row is only rewritten when a
+        # column outside `ignored` differs, and then `touched` are reset to their default
+        def build_upsert(table, cols, ignored=(), touched=()):
             cols_list  = ", ".join(cols)
             vals_list  = ", ".join(f"%({c})s" for c in cols)
-            upd_clause = ", ".join(f"{c}=EXCLUDED.{c}" for c in cols if c != self.key_column)
+            upd_clause = ", ".join([f"{c}=EXCLUDED.{c}" for c in cols if c != self.key_column]
+                                   + [f"{c}=DEFAULT" for c in touched])
+            compared   = [c for c in cols if c != self.key_column and c not in ignored]
             return f"""
-            INSERT INTO {table} ({cols_list})
+            INSERT INTO {table} AS t ({cols_list})
             VALUES ({vals_list})
             ON CONFLICT ({self.key_column}) DO UPDATE
-              SET {upd_clause};
+              SET {upd_clause}
+              WHERE ({", ".join(f"t.{c}" for c in compared)})
+                    IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in compared)});
             """
 
-        sql_main = build_upsert(self.table, main_cols)
+        # Upsert the listing, record a new price and move it between rollup rows
+        # in one statement: the previous version leaves its (website, day), the
+        # new one enters its own. An unchanged re-scrape updates no row, so
+        # `upserted` is empty and nothing else is written; the statement returns
+        # whether the listing changed.
+        sql_main = f"""
+        WITH previous AS (
+          SELECT website, post_date, price FROM {self.table}
+          WHERE {self.key_column} = %({self.key_column})s
+        ),
+        upserted AS (
+          {build_upsert(self.table, main_cols, self.change_ignored, (self.change_marker,)).strip().rstrip(';')}
+          RETURNING {self.key_column}, website, post_date, price, date_scraped
+        ),
+        history AS (
+          INSERT INTO {self.history_table} (ad_id, observed_at, price)
+          SELECT {self.key_column}, COALESCE(date_scraped, now() AT TIME ZONE 'UTC'), price FROM upserted
+          WHERE price IS NOT NULL AND price IS DISTINCT FROM (SELECT price FROM previous)
+          ON CONFLICT (ad_id, observed_at) DO UPDATE SET price = EXCLUDED.price
+        ),
+        delta AS (
+          SELECT website, post_date, price, -1 AS sign FROM previous WHERE EXISTS (SELECT 1 FROM upserted)
+          UNION ALL
+          SELECT website, post_date, price, 1 AS sign FROM upserted
+        ),
+        rolled_up AS (
+          INSERT INTO {self.rollup_table} AS r (website, day, listings, priced, price_sum)
+          SELECT website, COALESCE(post_date::date, '-infinity'),
+                 SUM(sign), SUM(CASE WHEN price IS NOT NULL THEN sign ELSE 0 END), COALESCE(SUM(sign * price), 0)
+          FROM delta
+          GROUP BY 1, 2
+          -- a change that keeps the (website, day) and price cancels out and writes nothing
+          HAVING SUM(sign) <> 0 OR SUM(CASE WHEN price IS NOT NULL THEN sign ELSE 0 END) <> 0
+              OR COALESCE(SUM(sign * price), 0) <> 0
+          ON CONFLICT (website, day) DO UPDATE
+            SET listings  = r.listings + EXCLUDED.listings,
+                priced    = r.priced + EXCLUDED.priced,
+                price_sum = r.price_sum + EXCLUDED.price_sum
+        )
+        SELECT EXISTS (SELECT 1 FROM upserted);
+        """
         sql_det  = build_upsert(self.detail_table, detail_cols) if detail_cols else None
 
         # Execute upserts
         with self.conn.cursor() as cur:
             cur.execute(sql_main, main_data)
-            spider.logger.debug(f"[DB] upsert {self.table}.{main_data[self.key_column]}")
+            changed = cur.fetchone()[0]
+            spider.logger.debug(f"[DB] {'upsert' if changed else 'unchanged'} {self.table}.{main_data[self.key_column]}")
             if sql_det:
                 cur.execute(sql_det, detail_data)
-                spider.logger.debug(f"[DB] upsert {self.detail_table}.{detail_data[self.key_column]}")
+                detail_changed = cur.rowcount > 0
+                if detail_changed and not changed:
+                    # The listing row itself didn't change; move it forward so the change feed sees it
+                    cur.execute(
+                        f"UPDATE {self.table} SET date_scraped = COALESCE(%s, date_scraped), {self.change_marker} = DEFAULT "
+                        f"WHERE {self.key_column} = %s",
+                        (main_data['date_scraped'], main_data[self.key_column]),
+                    )
+                changed = changed or detail_changed
+                spider.logger.debug(f"[DB] {'upsert' if detail_changed else 'unchanged'} {self.detail_table}.{detail_data[self.key_column]}")
+
+        # Nothing to announce for a re-scrape that changed nothing
+        if not changed:
+            return item
+        self.upserted.add((main_data['website'], main_data['brand']))
+        self.pending += 1
+        if self.pending >= self.notify_every:
+            self.notify_upserted(spider)
 
         return item
 
@@ -674,3 +835,149 @@ class TrimInferencePipeline:
 
     def close_spider(self, spider: Spider):
         logger.info("TrimInferencePipeline closed for spider %s", spider.name)
+
+
+class DealScoringPipeline:
+    """
+    Scores each listing against its segment (brand, model, year) before the
+    Postgres pipeline upserts it: `expected_price` is the segment's median
+    price and `deal_score` how far below it the listing is asked, in percent
+    (negative when above). Segments with fewer than DEAL_SCORE_MIN_LISTINGS
+    priced listings, and unpriced items, get neither.
+
+    Items are buffered and scored together with NumPy once DEAL_SCORE_BATCH_SIZE
+    are waiting, or every DEAL_SCORE_FLUSH_SECONDS, so an item costs a dict
+    lookup plus its share of one vectorized pass, never a query. The segment
+    medians are read when the spider opens and again every
+    DEAL_SCORE_REFRESH_SECONDS; if that read fails the previous medians (or
+    none) are kept and items pass through unscored rather than being held.
+    """
+
+    stats_query = """
+        SELECT LOWER(TRIM(brand)), LOWER(TRIM(model)), year,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY price)
+        FROM listings
+        WHERE price > 0 AND brand IS NOT NULL AND model IS NOT NULL AND year IS NOT NULL
+        GROUP BY 1, 2, 3
+        HAVING COUNT(*) >= %s
+    """
+
+    def __init__(self, conn_params, batch_size=200, flush_seconds=2.0, refresh_seconds=3600.0, min_listings=5):
+        self.conn_params = conn_params
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.refresh_seconds = refresh_seconds
+        self.min_listings = min_listings
+        self.segments = {}                  # (brand, model, year) -> row of `medians`
+        self.medians = np.zeros(0)
+        self.loaded_at = None
+        self.buffer = []                    # (item, Deferred) pairs waiting for a batch
+        self.flusher = None
+        self.scored = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        params = dict(
+            host        = crawler.settings.get('POSTGRES_HOST'),
+            port        = crawler.settings.get('POSTGRES_PORT'),
+            dbname      = crawler.settings.get('POSTGRES_DB'),
+            user        = crawler.settings.get('POSTGRES_USER'),
+            password    = crawler.settings.get('POSTGRES_PASSWORD'),
+            sslmode     = crawler.settings.get('POSTGRES_SSLMODE'),
+            sslrootcert = crawler.settings.get('POSTGRES_SSLROOTCERT'),
+        )
+        if not all(params.values()):
+            raise NotConfigured(f"{cls.__name__}: incomplete Postgres settings")
+        return cls(
+            params,
+            batch_size=crawler.settings.getint('DEAL_SCORE_BATCH_SIZE', 200),
+            flush_seconds=crawler.settings.getfloat('DEAL_SCORE_FLUSH_SECONDS', 2.0),
+            refresh_seconds=crawler.settings.getfloat('DEAL_SCORE_REFRESH_SECONDS', 3600.0),
+            min_listings=crawler.settings.getint('DEAL_SCORE_MIN_LISTINGS', 5),
+        )
+
+    @staticmethod
+    def segment_key(brand, model, year):
+        try:
+            return (brand.strip().lower(), model.strip().lower(), int(year))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _price(value):
+        try:
+            price = float(value)
+        except (TypeError, ValueError):
+            return math.nan
+        return price if price > 0 else math.nan
+
+    def load_stats(self, spider):
+        self.loaded_at = time.monotonic()
+        try:
+            conn = psycopg2.connect(**self.conn_params)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(self.stats_query, (self.min_listings,))
+                    rows = cur.fetchall()
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            spider.logger.warning(f"[DB] deal scoring: segment medians not refreshed: {e}")
+            return
+        self.segments = {(brand, model, year): i for i, (brand, model, year, _) in enumerate(rows)}
+        self.medians = np.array([median for *_, median in rows], dtype=np.float64)
+        spider.logger.info(f"DealScoringPipeline: medians of {len(rows)} segments loaded")
+
+    def open_spider(self, spider):
+        self.load_stats(spider)
+        self.flusher = task.LoopingCall(self.flush, spider)
+        self.flusher.start(self.flush_seconds, now=False)
+
+    def close_spider(self, spider):
+        if self.flusher and self.flusher.running:
+            self.flusher.stop()
+        self.flush(spider)
+        spider.logger.info(f"DealScoringPipeline: {self.scored} items scored")
+
+    def process_item(self, item, spider):
+        # The item continues down the pipeline when its batch is scored
+        d = defer.Deferred()
+        self.buffer.append((item, d))
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
+        return d
+
+    def score(self, items):
+        adapters = [ItemAdapter(item) for item in items]
+        rows = np.array([
+            self.segments.get(self.segment_key(a.get('brand') or a.get('make'), a.get('model'), a.get('year')), -1)
+            for a in adapters
+        ], dtype=np.int64)
+        price = np.array([self._price(a.get('price')) for a in adapters], dtype=np.float64)
+        known = rows >= 0
+        expected = np.full(len(items), np.nan)
+        if len(self.medians):
+            expected[known] = self.medians[rows[known]]
+        deal_score = 100.0 * (expected - price) / expected
+        valid = ~np.isnan(deal_score)
+        # Half away from zero, as ROUND(numeric, 2) does in the backfill
+        expected = np.sign(expected) * np.floor(np.abs(expected) * 100 + 0.5) / 100
+        deal_score = np.sign(deal_score) * np.floor(np.abs(deal_score) * 100 + 0.5) / 100
+        for adapter, ok, e, d in zip(adapters, valid.tolist(), expected.tolist(), deal_score.tolist()):
+            adapter['expected_price'] = e if ok else None
+            adapter['deal_score'] = d if ok else None
+        self.scored += int(valid.sum())
+
+    def flush(self, spider):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        if time.monotonic() - self.loaded_at > self.refresh_seconds:
+            self.load_stats(spider)
+        try:
+            self.score([item for item, _ in batch])
+        except Exception as e:
+            # Never hold or lose items over scoring
+            spider.logger.warning(f"DealScoringPipeline: batch of {len(batch)} left unscored: {e}")
+        for item, d in batch:
+            d.callback(item)
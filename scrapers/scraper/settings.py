@@ -189,6 +189,15 @@ POSTGRES_USER       = "avnadmin"
 POSTGRES_PASSWORD   = os.getenv('AIVEN_PG_PASSWORD') # put password
 POSTGRES_SSLMODE    = 'verify-full'
 POSTGRES_SSLROOTCERT= os.getenv('AIVEN_PG_SSLROOTCERT') # put the full path of ca.pem
+# The API LISTENs here to invalidate cached responses for the upserted websites/brands
+POSTGRES_NOTIFY_CHANNEL = "listings_upserted"
+POSTGRES_NOTIFY_EVERY   = 200
+# DealScoringPipeline: items scored per NumPy batch, the longest an item waits
+# for one, how often the segment medians are re-read, and the smallest segment scored
+DEAL_SCORE_BATCH_SIZE      = 200
+DEAL_SCORE_FLUSH_SECONDS   = 2.0
+DEAL_SCORE_REFRESH_SECONDS = 3600
+DEAL_SCORE_MIN_LISTINGS    = 5
 
 TRIM_CLUSTERED_CSV = 'scripts/clustered_trim_variants.csv'
 # Configure item pipelines
@@ -7,5 +7,5 @@ class CarSwitchSpider(CarSwitchTemplateSpider):
     custom_settings = {
         **CarSwitchTemplateSpider.custom_settings,
         "FEEDS": {"carswitch.json": {"format": "json", "encoding": "utf8", "overwrite": True}},
-        "ITEM_PIPELINES": {"scraper.pipelines.CarSwitchPostgresPipeline": 300},
+        "ITEM_PIPELINES": {"scraper.pipelines.DealScoringPipeline": 250, "scraper.pipelines.CarSwitchPostgresPipeline": 300},
     }
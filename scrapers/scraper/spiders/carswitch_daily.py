@@ -13,6 +13,7 @@ class CarSwitchDailySpider(CarSwitchTemplateSpider):
         },
         "ITEM_PIPELINES": {
             "scraper.pipelines.LoadSeenIDsPipeline": 100,
+            "scraper.pipelines.DealScoringPipeline": 250,
             "scraper.pipelines.CarSwitchPostgresPipeline": 300,
         },
     }
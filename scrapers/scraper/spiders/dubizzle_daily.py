@@ -18,6 +18,7 @@ class DubizzleDailySpider(DubizzleTemplateSpider):
         "ITEM_PIPELINES": {
             "scraper.pipelines.LoadSeenIDsPipeline":      100,
             "scraper.pipelines.TrimInferencePipeline":   200,
+            "scraper.pipelines.DealScoringPipeline":     250,
             "scraper.pipelines.DubizzlePostgresPipeline":300,
         },
     }
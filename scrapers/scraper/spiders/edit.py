@@ -45,6 +45,7 @@ class EditSpider(Spider):
         "ITEM_PIPELINES": {
             "scraper.pipelines.LoadAllURLsPipeline":      100,
             "scraper.pipelines.TrimInferencePipeline" : 200,
+            "scraper.pipelines.DealScoringPipeline": 250,
             "scraper.pipelines.DubizzlePostgresPipeline": 300,
         },
         "USER_AGENT": None,
@@ -15,6 +15,7 @@ class OpenSooqSpider(OpenSooqTemplateSpider):
             "opensooq.json": {"format": "json", "encoding": "utf8", "overwrite": True}
         },
         "ITEM_PIPELINES": {
+           "scraper.pipelines.DealScoringPipeline":      250,
            "scraper.pipelines.OpenSooqPostgresPipeline":300,
         },
     }
@@ -12,6 +12,7 @@ class OpenSooqDailySpider(OpenSooqTemplateSpider):
         },
           "ITEM_PIPELINES": {
            "scraper.pipelines.LoadSeenIDsPipeline":      100,
+           "scraper.pipelines.DealScoringPipeline":      250,
            "scraper.pipelines.OpenSooqPostgresPipeline":300,
         },
     }
@@ -6,5 +6,5 @@ class SyarahSpider(SyarahTemplateSpider):
   custom_settings = {
     **SyarahTemplateSpider.custom_settings,
       "FEEDS": {"syarah.json": {"format": "json", "encoding": "utf8", "overwrite": True}},
-       "ITEM_PIPELINES": {"scraper.pipelines.SyarahPostgresPipeline": 300},
+       "ITEM_PIPELINES": {"scraper.pipelines.DealScoringPipeline": 250, "scraper.pipelines.SyarahPostgresPipeline": 300},
   }
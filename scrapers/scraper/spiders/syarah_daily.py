@@ -8,6 +8,7 @@ class SyarahDailySpider(SyarahTemplateSpider):
       "FEEDS": {"syarah_daily.json": {"format": "json", "encoding": "utf8", "overwrite": True}},
        "ITEM_PIPELINES": {
             "scraper.pipelines.LoadSeenIDsPipeline": 100,
+            "scraper.pipelines.DealScoringPipeline": 250,
             "scraper.pipelines.SyarahPostgresPipeline": 300,
         },
   }